@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+Built-in chess engine, in pure Python on top of python-chess.
+
+Plays easy mode without starting Stockfish, and keeps the game playable on
+machines where no Stockfish binary is found. It is an EngineBackend like the
+UCI ones, so the game runs it the same way: in a worker thread, under the same
+deadline, stoppable with stop().
+
+Search: iterative deepening negamax with alpha-beta, a transposition table,
+MVV-LVA capture ordering (after the table move, before killer moves) and a
+captures-only quiescence search. Evaluation: material plus piece-square tables.
+
+    python builtin_engine.py --depth 4
+    python builtin_engine.py --fen "6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1"
+"""
+
+import argparse
+import random
+import threading
+import time
+
+import chess
+import chess.engine
+
+from engine_backend import DIFFICULTY_PRESETS, EngineBackend
+
+PIECE_VALUES = {chess.PAWN: 100, chess.KNIGHT: 320, chess.BISHOP: 330,
+                chess.ROOK: 500, chess.QUEEN: 900, chess.KING: 0}
+
+# Piece-square tables from White's point of view, a8 first (as the board is printed)
+PIECE_SQUARE_TABLES = {
+    chess.PAWN: [
+        0, 0, 0, 0, 0, 0, 0, 0,
+        50, 50, 50, 50, 50, 50, 50, 50,
+        10, 10, 20, 30, 30, 20, 10, 10,
+        5, 5, 10, 25, 25, 10, 5, 5,
+        0, 0, 0, 20, 20, 0, 0, 0,
+        5, -5, -10, 0, 0, -10, -5, 5,
+        5, 10, 10, -20, -20, 10, 10, 5,
+        0, 0, 0, 0, 0, 0, 0, 0,
+    ],
+    chess.KNIGHT: [
+        -50, -40, -30, -30, -30, -30, -40, -50,
+        -40, -20, 0, 0, 0, 0, -20, -40,
+        -30, 0, 10, 15, 15, 10, 0, -30,
+        -30, 5, 15, 20, 20, 15, 5, -30,
+        -30, 0, 15, 20, 20, 15, 0, -30,
+        -30, 5, 10, 15, 15, 10, 5, -30,
+        -40, -20, 0, 5, 5, 0, -20, -40,
+        -50, -40, -30, -30, -30, -30, -40, -50,
+    ],
+    chess.BISHOP: [
+        -20, -10, -10, -10, -10, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 10, 10, 5, 0, -10,
+        -10, 5, 5, 10, 10, 5, 5, -10,
+        -10, 0, 10, 10, 10, 10, 0, -10,
+        -10, 10, 10, 10, 10, 10, 10, -10,
+        -10, 5, 0, 0, 0, 0, 5, -10,
+        -20, -10, -10, -10, -10, -10, -10, -20,
+    ],
+    chess.ROOK: [
+        0, 0, 0, 0, 0, 0, 0, 0,
+        5, 10, 10, 10, 10, 10, 10, 5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        0, 0, 0, 5, 5, 0, 0, 0,
+    ],
+    chess.QUEEN: [
+        -20, -10, -10, -5, -5, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 5, 5, 5, 0, -10,
+        -5, 0, 5, 5, 5, 5, 0, -5,
+        0, 0, 5, 5, 5, 5, 0, -5,
+        -10, 5, 5, 5, 5, 5, 0, -10,
+        -10, 0, 5, 0, 0, 0, 0, -10,
+        -20, -10, -10, -5, -5, -10, -10, -20,
+    ],
+    chess.KING: [
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -20, -30, -30, -40, -40, -30, -30, -20,
+        -10, -20, -20, -20, -20, -20, -20, -10,
+        20, 20, 0, 0, 0, 0, 20, 20,
+        20, 30, 10, 0, 0, 10, 30, 20,
+    ],
+}
+
+# Kings head for the centre once the queens and most pieces are gone
+KING_ENDGAME_TABLE = [
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10, 0, 0, -10, -20, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -30, 0, 0, 0, 0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50,
+]
+ENDGAME_MATERIAL = 1300  # Non-pawn material per side at or below which the endgame king table is used
+
+# Piece value + table value per square, indexed [color][piece type][square] (a1 = 0)
+SQUARE_SCORES = {color: {} for color in chess.COLORS}
+for _piece_type, _table in PIECE_SQUARE_TABLES.items():
+    for _color in chess.COLORS:
+        # The tables are printed from rank 8 down: square ^ 56 flips a1..h8 onto them for White
+        SQUARE_SCORES[_color][_piece_type] = [
+            PIECE_VALUES[_piece_type] + _table[square ^ 56 if _color == chess.WHITE else square]
+            for square in chess.SQUARES]
+KING_ENDGAME_SCORES = {color: [KING_ENDGAME_TABLE[square ^ 56 if color == chess.WHITE else square]
+                               for square in chess.SQUARES] for color in chess.COLORS}
+
+MATE_SCORE = 100000
+MATE_THRESHOLD = MATE_SCORE - 1000  # Scores beyond this are mates in (MATE_SCORE - score) plies
+INFINITY = MATE_SCORE + 1
+MAX_DEPTH = 64
+TABLE_SIZE = 1 << 18  # Transposition table entries kept before it is cleared
+CHECK_EVERY_NODES = 1024  # How often the search looks at the clock and the stop flag (the node budget: every node)
+
+# Transposition table bounds
+EXACT, LOWER, UPPER = 0, 1, 2
+
+# Skill levels below this add random noise to the root move scores (like Stockfish's weak skill levels)
+NOISE_SKILL_LEVEL = 10
+NOISE_PER_LEVEL = 15  # Centipawns of noise per level under NOISE_SKILL_LEVEL
+
+# Time a move may take with clocks: this share of the remaining time plus most of the increment
+CLOCK_TIME_FRACTION = 1 / 30
+CLOCK_INCREMENT_FRACTION = 0.8
+
+
+class SearchStopped(Exception):
+    """Raised inside the search when the budget runs out or stop() was called"""
+
+
+def evaluate(board):
+    """Static evaluation in centipawns from the side to move's point of view"""
+    score = 0
+    non_pawn = {chess.WHITE: 0, chess.BLACK: 0}
+    for color in chess.COLORS:
+        sign = 1 if color == chess.WHITE else -1
+        tables = SQUARE_SCORES[color]
+        for piece_type in (chess.PAWN, chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN):
+            table = tables[piece_type]
+            mask = board.pieces_mask(piece_type, color)
+            for square in chess.scan_forward(mask):
+                score += sign * table[square]
+            if piece_type != chess.PAWN:
+                non_pawn[color] += PIECE_VALUES[piece_type] * chess.popcount(mask)
+
+    endgame = max(non_pawn.values()) <= ENDGAME_MATERIAL
+    for color in chess.COLORS:
+        king = board.king(color)
+        if king is not None:
+            table = KING_ENDGAME_SCORES[color] if endgame else SQUARE_SCORES[color][chess.KING]
+            score += (1 if color == chess.WHITE else -1) * table[king]
+    return score if board.turn == chess.WHITE else -score
+
+
+def score_to_pov(score, turn):
+    """Search score (centipawns, or MATE_SCORE - plies) as a python-chess PovScore"""
+    if score >= MATE_THRESHOLD:
+        return chess.engine.PovScore(chess.engine.Mate((MATE_SCORE - score + 1) // 2), turn)
+    if score <= -MATE_THRESHOLD:
+        return chess.engine.PovScore(chess.engine.Mate(-((MATE_SCORE + score) // 2)), turn)
+    return chess.engine.PovScore(chess.engine.Cp(score), turn)
+
+
+def search_limits(limit, turn):
+    """(max depth, node budget, seconds) for a chess.engine.Limit, managing time from the clocks if given"""
+    depth = limit.depth or MAX_DEPTH
+    seconds = limit.time
+    clock = limit.white_clock if turn == chess.WHITE else limit.black_clock
+    if clock is not None:
+        increment = (limit.white_inc if turn == chess.WHITE else limit.black_inc) or 0
+        budget = clock * CLOCK_TIME_FRACTION + increment * CLOCK_INCREMENT_FRACTION
+        seconds = budget if seconds is None else min(seconds, budget)
+    return depth, limit.nodes, seconds
+
+
+class BuiltinEngine(EngineBackend):
+    """In-process alpha-beta engine with the EngineBackend interface"""
+
+    name = "builtin"
+
+    def __init__(self, path="builtin", options=None, seed=None):
+        super().__init__(path)
+        self.table = {}  # Transposition key -> (depth, bound, score, move), kept between searches
+        self.killers = [[None, None] for _ in range(MAX_DEPTH + 1)]
+        self.noise = 0
+        self.random = random.Random(seed)
+        self.stop_event = threading.Event()
+        self.nodes = 0
+        self.node_limit = None
+        self.deadline = None
+
+    def set_strength(self, skill_level):
+        self.noise = max(0, NOISE_SKILL_LEVEL - skill_level) * NOISE_PER_LEVEL
+
+    def configure(self, options):
+        pass  # No UCI options: Threads and Hash don't apply in-process
+
+    def begin_search(self):
+        self.stop_event.clear()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def kill(self):
+        self.stop()
+
+    def close(self):
+        self.stop()
+        self.table = {}
+
+    def search(self, fen, limit, on_info=None):
+        board = chess.Board(fen)
+        root_moves = list(board.legal_moves)
+        if not root_moves:
+            return None
+        started = time.monotonic()
+        max_depth, self.node_limit, seconds = search_limits(limit, board.turn)
+        self.deadline = started + seconds if seconds is not None else None
+        self.nodes = 0
+        self.killers = [[None, None] for _ in range(MAX_DEPTH + 1)]
+        if len(self.table) > TABLE_SIZE:
+            self.table = {}
+
+        # Weak skill levels get a fixed random bias per root move for the whole search
+        noise = {move: self.random.randint(-self.noise, self.noise) if self.noise else 0 for move in root_moves}
+        best_move = root_moves[0]
+        for depth in range(1, max_depth + 1):
+            try:
+                score, move = self.search_root(board, root_moves, depth, noise)
+            except SearchStopped:
+                break  # Keep the last completed depth's move
+            best_move = move
+            # Searched move first next iteration, then the rest in their previous order
+            root_moves.remove(move)
+            root_moves.insert(0, move)
+            if on_info is not None:
+                elapsed = time.monotonic() - started
+                on_info({"depth": depth, "score": score_to_pov(score, board.turn), "nodes": self.nodes,
+                         "time": elapsed, "nps": int(self.nodes / elapsed) if elapsed > 0 else 0,
+                         "pv": self.principal_variation(board, move, depth)})
+            if abs(score) >= MATE_THRESHOLD and MATE_SCORE - abs(score) <= depth:
+                break  # A mate was found within the full width of the search
+        # A stop that ended this search must not end the next one (begin_search clears late ones)
+        self.stop_event.clear()
+        return best_move.uci()
+
+    def search_root(self, board, moves, depth, noise):
+        """(score without the noise, move) of the best root move by noisy score"""
+        alpha, best_move, best_score, best_noisy = -INFINITY, moves[0], -INFINITY, -INFINITY
+        for move in moves:
+            board.push(move)
+            try:
+                score = -self.negamax(board, depth - 1, -INFINITY, -alpha + noise[move], 1)
+            finally:
+                board.pop()
+            if score + noise[move] > best_noisy:
+                best_score, best_noisy, best_move = score, score + noise[move], move
+                alpha = max(alpha, best_noisy)
+        # With noise the move played isn't the best one, so its score isn't the position's exact value
+        if not self.noise:
+            self.table[board._transposition_key()] = (depth, EXACT, best_score, best_move)
+        return best_score, best_move
+
+    def count_node(self):
+        """Count a node against the budget; the clock and the stop flag are only looked at periodically"""
+        self.nodes += 1
+        if self.node_limit is not None and self.nodes > self.node_limit:
+            raise SearchStopped()
+        if self.nodes % CHECK_EVERY_NODES == 0:
+            if self.stop_event.is_set():
+                raise SearchStopped()
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                raise SearchStopped()
+
+    def negamax(self, board, depth, alpha, beta, ply):
+        self.count_node()
+
+        if board.is_repetition(2) or board.is_insufficient_material():
+            return 0
+        if board.halfmove_clock >= 100:
+            # Mate on the 100th half-move still counts, as in python-chess's outcome()
+            return -(MATE_SCORE - ply) if board.is_checkmate() else 0
+
+        in_check = board.is_check()
+        if depth <= 0 and not in_check:
+            return self.quiescence(board, alpha, beta, ply)
+
+        key = board._transposition_key()
+        entry = self.table.get(key)
+        table_move = None
+        if entry is not None:
+            entry_depth, bound, score, table_move = entry
+            score = self.from_table(score, ply)
+            if entry_depth >= depth:
+                if bound == EXACT:
+                    return score
+                if bound == LOWER and score >= beta:
+                    return score
+                if bound == UPPER and score <= alpha:
+                    return score
+
+        original_alpha = alpha
+        best_score, best_move = -INFINITY, None
+        moves = self.ordered_moves(board, table_move, ply)
+        if not moves:
+            return -(MATE_SCORE - ply) if in_check else 0
+
+        # Checks are extended by a ply so mating lines aren't cut at the horizon
+        next_depth = depth if in_check else depth - 1
+        for move in moves:
+            board.push(move)
+            try:
+                score = -self.negamax(board, next_depth, -beta, -alpha, ply + 1)
+            finally:
+                board.pop()
+            if score > best_score:
+                best_score, best_move = score, move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if not board.is_capture(move) and ply <= MAX_DEPTH:
+                            killers = self.killers[ply]
+                            if killers[0] != move:
+                                killers[1], killers[0] = killers[0], move
+                        break
+
+        bound = UPPER if best_score <= original_alpha else LOWER if best_score >= beta else EXACT
+        self.table[key] = (depth, bound, self.to_table(best_score, ply), best_move)
+        return best_score
+
+    @staticmethod
+    def to_table(score, ply):
+        """Mate scores are stored as distance from the stored position, not from the root"""
+        if score >= MATE_THRESHOLD:
+            return score + ply
+        if score <= -MATE_THRESHOLD:
+            return score - ply
+        return score
+
+    @staticmethod
+    def from_table(score, ply):
+        if score >= MATE_THRESHOLD:
+            return score - ply
+        if score <= -MATE_THRESHOLD:
+            return score + ply
+        return score
+
+    def quiescence(self, board, alpha, beta, ply):
+        """Search captures only, until the position is quiet"""
+        self.count_node()
+
+        stand_pat = evaluate(board)
+        if stand_pat >= beta:
+            return stand_pat
+        alpha = max(alpha, stand_pat)
+
+        captures = sorted(board.generate_legal_captures(), key=lambda move: self.capture_order(board, move),
+                          reverse=True)
+        for move in captures:
+            board.push(move)
+            try:
+                score = -self.quiescence(board, -beta, -alpha, ply + 1)
+            finally:
+                board.pop()
+            if score >= beta:
+                return score
+            alpha = max(alpha, score)
+        return alpha
+
+    @staticmethod
+    def capture_order(board, move):
+        """MVV-LVA: most valuable victim first, then least valuable attacker"""
+        if board.is_en_passant(move):
+            victim = chess.PAWN
+        else:
+            victim = board.piece_type_at(move.to_square)
+        attacker = board.piece_type_at(move.from_square)
+        return PIECE_VALUES[victim] * 10 - PIECE_VALUES[attacker] + (PIECE_VALUES[chess.QUEEN] if move.promotion else 0)
+
+    def ordered_moves(self, board, table_move, ply):
+        """Legal moves: table move, captures and promotions by MVV-LVA, killers, then the rest"""
+        killers = self.killers[ply] if ply <= MAX_DEPTH else (None, None)
+        scored = []
+        for move in board.legal_moves:
+            if move == table_move:
+                order = 1 << 30
+            elif board.is_capture(move):
+                order = (1 << 20) + self.capture_order(board, move)
+            elif move.promotion:
+                order = (1 << 20) + PIECE_VALUES[move.promotion]
+            elif move == killers[0]:
+                order = 1 << 19
+            elif move == killers[1]:
+                order = (1 << 19) - 1
+            else:
+                order = 0
+            scored.append((order, move))
+        scored.sort(key=lambda entry: entry[0], reverse=True)
+        return [move for _, move in scored]
+
+    def principal_variation(self, board, first_move, depth):
+        """Best line from the transposition table, starting with the root move"""
+        line = [first_move]
+        board = board.copy(stack=False)
+        board.push(first_move)
+        while len(line) < depth:
+            entry = self.table.get(board._transposition_key())
+            if entry is None or entry[3] is None or entry[3] not in board.legal_moves:
+                break
+            line.append(entry[3])
+            board.push(entry[3])
+        return line
+
+
+def builtin_limit(difficulty):
+    """Search limit for the built-in engine at a difficulty: its depth, with the preset's deadline as a time cap"""
+    preset = DIFFICULTY_PRESETS[difficulty]
+    return chess.engine.Limit(depth=preset["builtin_depth"], time=preset["deadline_ms"] / 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search a position with the built-in engine")
+    parser.add_argument("--fen", default=chess.STARTING_FEN)
+    parser.add_argument("--depth", type=int, default=None)
+    parser.add_argument("--movetime", type=int, default=None, help="Time limit in ms")
+    parser.add_argument("--difficulty", choices=list(DIFFICULTY_PRESETS), default="normal",
+                        help="Search like the game at this difficulty (when no depth or time is given)")
+    args = parser.parse_args()
+
+    engine = BuiltinEngine()
+    if args.depth is None and args.movetime is None:
+        engine.set_strength(DIFFICULTY_PRESETS[args.difficulty]["skill_level"])
+        limit = builtin_limit(args.difficulty)
+    else:
+        limit = chess.engine.Limit(depth=args.depth, time=args.movetime / 1000 if args.movetime else None)
+
+    board = chess.Board(args.fen)
+
+    def on_info(info):
+        pv = board.variation_san(info["pv"])
+        print(f"depth {info['depth']} score {info['score'].pov(board.turn)} nodes {info['nodes']} "
+              f"nps {info['nps']} time {info['time']:.2f} s pv {pv}")
+
+    best_move = engine.search(args.fen, limit, on_info)
+    print(f"bestmove {best_move}")
+
+
+if __name__ == "__main__":
+    main()
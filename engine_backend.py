@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Engine backends for the chess game.
+
+The game talks to an EngineBackend: the python-chess `chess.engine` UCI
+client for Stockfish (or the stand-in), the built-in Python engine and the
+replayed recordings all answer the same calls. A reduced backend on the
+`stockfish` package (depth and time limits only) can be benchmarked against
+the UCI one:
+
+    python engine_backend.py --searches 200 --depth 1
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import chess
+import chess.engine
+from stockfish import Stockfish
+
+# Where to look for the Stockfish binary, in order
+STOCKFISH_PATHS = [
+    r"C:\Users\NAV\Downloads\stockfish-windows-x86-64-avx2\stockfish\stockfish-windows-x86-64-avx2.exe",
+    r"C:\Users\NAV\Downloads\stockfish-windows-x86-64-avx2\stockfish\stockfish.exe",
+    r"C:\Users\NAV\Downloads\stockfish-windows-x86-64-avx2\stockfish\stockfish",
+    "stockfish.exe",
+    "stockfish",
+    "./stockfish.exe",
+    "./stockfish"
+]
+
+# Optional settings file shared by the game, the server, simul mode and the tuner
+# (an empty or missing file means defaults)
+CONFIG_PATH = "config.json"
+
+# Bundled stand-in engine for load tests and benchmarks
+STANDIN_ENGINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "standin_engine.py")
+
+# One search thread: a node budget only gives repeatable searches single-threaded
+DEFAULT_ENGINE_OPTIONS = {
+    "Threads": 1,
+    "Hash": 32,
+}
+
+# Difficulty presets shared by the game window and the game server.
+# Strength comes from the skill level and a node budget (go nodes N), so a move
+# costs the same CPU work on any machine and under any load; deadline_ms is only
+# the wall-clock safety net for a stalled engine, sized so a single thread doing
+# 100k nodes per second (a slow host) still finishes the budget in time. The
+# game window searches in a worker, so a long search never freezes it.
+# builtin_depth is the search depth of the built-in engine (builtin_engine.py),
+# which plays easy mode and stands in for Stockfish when no binary is found.
+DIFFICULTY_PRESETS = {
+    # Very weak player, makes mistakes: low skill, tiny search
+    "easy": {"skill_level": 1, "nodes": 2000, "deadline_ms": 1000, "builtin_depth": 2},
+    # Balanced: medium skill and search
+    "normal": {"skill_level": 8, "nodes": 100000, "deadline_ms": 2000, "builtin_depth": 4},
+    # Maximum strength for quick checkmates: full skill, big search
+    "strongest": {"skill_level": 20, "nodes": 2000000, "deadline_ms": 20000, "builtin_depth": 6},
+}
+
+
+def load_config(path=CONFIG_PATH):
+    """Load optional settings from the config file ({} if there are none)"""
+    try:
+        with open(path) as f:
+            text = f.read().strip()
+        return json.loads(text) if text else {}
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"Could not read {path}: {e}")
+        return {}
+
+
+def resolve_engine_path(path):
+    """File behind an engine path: 'standin' is shorthand for the bundled stand-in"""
+    return STANDIN_ENGINE_PATH if path == "standin" else path
+
+
+def engine_command(path):
+    """Command line for an engine path (Python engines such as the stand-in run under this interpreter)"""
+    path = resolve_engine_path(path)
+    if path.endswith(".py"):
+        return [sys.executable, path]
+    return path
+
+
+def engine_search_paths(paths=None):
+    """Candidate engine paths: explicit ones, else $STOCKFISH_PATH and the usual locations"""
+    if paths:
+        return list(paths)
+    if os.environ.get("STOCKFISH_PATH"):
+        return [os.environ["STOCKFISH_PATH"]] + STOCKFISH_PATHS
+    return STOCKFISH_PATHS
+
+
+class EngineBackend:
+    """Interface the game uses to talk to a UCI engine"""
+
+    name = "engine"
+
+    def __init__(self, path):
+        self.path = path
+
+    def set_strength(self, skill_level):
+        """Apply a difficulty preset's skill level (0-20)"""
+        raise NotImplementedError
+
+    def configure(self, options):
+        """Set raw UCI options such as Threads or Hash"""
+        raise NotImplementedError
+
+    def search(self, fen, limit, on_info=None):
+        """Search a position and return the best move in UCI notation (None if there is none)
+
+        Blocks until the engine answers. on_info is called with an info dict
+        (python-chess keys: depth, score, pv, ...) for every info line, and
+        stop() may be called from another thread to end the search early.
+        """
+        raise NotImplementedError
+
+    def begin_search(self):
+        """Called when a search is handed to the engine, before search() runs
+
+        Clears a stop() left over from an earlier search, so a stop() sent between
+        the hand-off and the start of search() is kept instead of lost.
+        """
+
+    def stop(self):
+        """Ask the engine to finish the running search now"""
+        raise NotImplementedError
+
+    def kill(self):
+        """Forcibly terminate an engine that stopped responding"""
+        raise NotImplementedError
+
+    def close(self):
+        """Shut the engine down cleanly"""
+        raise NotImplementedError
+
+
+class StockfishBackend(EngineBackend):
+    """Backend built on the synchronous `stockfish` package, through its public API only
+
+    The package can only search to a depth (go depth) or for a time (go movetime):
+    no node budgets, no search info, no stop and no kill. That is enough for the
+    backend benchmark, but not for the game, the server or simul mode, which
+    search by node budget under a deadline and always use UciEngineBackend.
+    """
+
+    name = "stockfish"
+
+    def __init__(self, path, options=None):
+        super().__init__(path)
+        self.engine = Stockfish(path=engine_command(path),
+                                parameters=dict(DEFAULT_ENGINE_OPTIONS, **(options or {})))
+
+    def set_strength(self, skill_level):
+        self.engine.set_skill_level(skill_level)
+
+    def configure(self, options):
+        self.engine.update_engine_parameters(options)
+
+    def search(self, fen, limit, on_info=None):
+        # on_info is never called: the package doesn't report search info
+        if limit.nodes is not None or limit.mate is not None or limit.white_clock is not None \
+                or limit.black_clock is not None or (limit.depth is None and limit.time is None):
+            raise ValueError("the stockfish package backend only supports depth and time limits")
+        # Keep the hash between positions: no ucinewgame for every search
+        self.engine.set_fen_position(fen, False)
+        if limit.time is not None:
+            return self.engine.get_best_move_time(max(1, int(limit.time * 1000)))
+        self.engine.set_depth(limit.depth)
+        return self.engine.get_best_move()
+
+    def stop(self):
+        pass  # Not supported: the search runs to its limit
+
+    def kill(self):
+        self.close()  # No kill in the package: quit, which waits for the engine to exit
+
+    def close(self):
+        engine, self.engine = self.engine, None
+        del engine  # The package sends quit when its object is deleted
+
+
+class UciEngineBackend(EngineBackend):
+    """Backend built on python-chess chess.engine (asyncio UCI protocol run by SimpleEngine)"""
+
+    name = "uci"
+
+    def __init__(self, path, options=None):
+        super().__init__(path)
+        self.engine = chess.engine.SimpleEngine.popen_uci(engine_command(path))
+        self.analysis = None  # Running analysis, so stop() can reach it
+        self.configure(dict(DEFAULT_ENGINE_OPTIONS, **(options or {})))
+
+    def set_strength(self, skill_level):
+        # Same as the stockfish package: no Elo limit, it would override the skill level
+        self.configure({"Skill Level": skill_level, "UCI_LimitStrength": False})
+
+    def configure(self, options):
+        supported = {}
+        for name, value in options.items():
+            option = self.engine.options.get(name)
+            if option is None:
+                print(f"{self.path} has no option {name}, skipping")
+                continue
+            # Clamp to the engine's declared range (e.g. UCI_Elo differs between versions)
+            if option.type == "spin":
+                value = max(option.min, min(option.max, int(value)))
+            supported[name] = value
+        self.engine.configure(supported)
+
+    def search(self, fen, limit, on_info=None):
+        board = chess.Board(fen)
+        with self.engine.analysis(board, limit) as analysis:
+            self.analysis = analysis
+            try:
+                for info in analysis:
+                    if on_info is not None:
+                        on_info(info)
+                best = analysis.wait()
+            finally:
+                self.analysis = None
+        return best.move.uci() if best.move else None
+
+    def analysis_stream(self, fen, limit):
+        """Open a streaming analysis (iterate it for info dicts, stop() it when done)"""
+        return self.engine.analysis(chess.Board(fen), limit)
+
+    def stop(self):
+        analysis = self.analysis
+        if analysis is not None:
+            analysis.stop()
+
+    def kill(self):
+        # Closing the transport kills the process and ends the background event loop
+        self.engine.close()
+
+    def close(self):
+        try:
+            self.engine.quit()
+        except (chess.engine.EngineError, TimeoutError):
+            pass
+        finally:
+            self.engine.close()
+
+
+def apply_difficulty(engine, difficulty):
+    """Configure an engine for one of the DIFFICULTY_PRESETS"""
+    engine.set_strength(DIFFICULTY_PRESETS[difficulty]["skill_level"])
+
+
+def difficulty_limit(difficulty):
+    """Search limit for one move at a difficulty: the preset's node budget"""
+    return chess.engine.Limit(nodes=DIFFICULTY_PRESETS[difficulty]["nodes"])
+
+
+BACKENDS = {
+    StockfishBackend.name: StockfishBackend,
+    UciEngineBackend.name: UciEngineBackend,
+}
+
+
+def open_engine_backend(kind="uci", paths=None, options=None):
+    """Start the first engine found on the search paths with the given backend, or return None"""
+    backend_class = BACKENDS.get(kind)
+    if backend_class is None:
+        print(f"Unknown engine backend '{kind}', using uci")
+        backend_class = UciEngineBackend
+
+    for path in engine_search_paths(paths):
+        try:
+            backend = backend_class(path, options)
+            print(f"Stockfish loaded successfully from: {path} ({backend.name} backend)")
+            return backend
+        except Exception as e:
+            print(f"Failed to load from {path}: {e}")
+    return None
+
+
+def latency_percentiles(latencies, fractions=(0.50, 0.95, 0.99)):
+    """Percentiles (nearest rank) and max of a list of latencies, as a dict like {"p50": ..., "max": ...}"""
+    ordered = sorted(latencies) or [0.0]
+    result = {f"p{int(f * 100)}": ordered[int(f * (len(ordered) - 1))] for f in fractions}
+    result["max"] = ordered[-1]
+    return result
+
+
+def benchmark_backend(backend, searches, limit):
+    """Run repeated searches and return the sorted per-request latencies in ms"""
+    board = chess.Board()
+    latencies = []
+    for _ in range(searches):
+        started = time.monotonic()
+        best_move = backend.search(board.fen(), limit)
+        latencies.append((time.monotonic() - started) * 1000)
+        # Walk through a game so positions vary but stay realistic
+        if best_move is None or board.is_game_over():
+            board = chess.Board()
+        else:
+            board.push_uci(best_move)
+    return sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the engine backends against each other")
+    parser.add_argument("--path", help="Engine binary, or 'standin' for the bundled stand-in (default: first one found)")
+    parser.add_argument("--searches", type=int, default=100, help="Searches per backend")
+    parser.add_argument("--depth", type=int, default=None, help="Search depth limit")
+    parser.add_argument("--nodes", type=int, default=None, help="Search node limit")
+    parser.add_argument("--movetime", type=int, default=None, help="Search time limit in ms")
+    parser.add_argument("--difficulty", choices=list(DIFFICULTY_PRESETS),
+                        help="Search like the game at this difficulty (its skill level and node budget)")
+    args = parser.parse_args()
+
+    if args.difficulty:
+        # Time per move at a preset on this host, for capacity planning
+        limit = difficulty_limit(args.difficulty)
+    else:
+        if args.depth is None and args.nodes is None and args.movetime is None:
+            args.depth = 1  # Shallow searches measure the I/O overhead, not engine strength
+        limit = chess.engine.Limit(depth=args.depth, nodes=args.nodes,
+                                   time=args.movetime / 1000 if args.movetime else None)
+    paths = [args.path] if args.path else None
+
+    for kind in BACKENDS:
+        backend = open_engine_backend(kind, paths)
+        if backend is None:
+            print(f"{kind}: no engine found")
+            continue
+        try:
+            if args.difficulty:
+                apply_difficulty(backend, args.difficulty)
+            latencies = benchmark_backend(backend, args.searches, limit)
+        except ValueError as e:
+            print(f"{kind:>10}: skipped, {e}")
+            continue
+        finally:
+            backend.close()
+        stats = latency_percentiles(latencies)
+        total = sum(latencies) / 1000
+        print(f"{kind:>10}: {args.searches} searches in {total:.2f} s ({args.searches / total:.0f}/s), "
+              f"p50 {stats['p50']:.2f} ms, p95 {stats['p95']:.2f} ms, max {stats['max']:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
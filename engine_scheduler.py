@@ -0,0 +1,437 @@
+"""
+Fair scheduler for engine requests shared by many games and analysis jobs.
+
+Requests carry a priority class and a session. Interactive moves always go
+before background analysis; within a class, sessions take turns, so one busy
+session can't starve the others. Each class has its own queue-depth limit.
+When an interactive request finds every engine busy, a running background
+search is cut short with `stop` and queued again, so background work never
+holds interactive moves back for a whole search.
+
+Every search also has a wall-clock deadline (the difficulty preset's
+deadline_ms, or the limit's own time): a caller never waits on a hung engine
+for longer, and the engine is stopped, then killed and replaced.
+
+Queue wait and latency are measured per class (see metrics()).
+"""
+
+import threading
+import time
+from collections import deque
+
+from engine_backend import DIFFICULTY_PRESETS, EngineBackend, apply_difficulty, latency_percentiles, open_engine_backend
+
+# Priority classes, most urgent first
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+PRIORITY_CLASSES = [INTERACTIVE, BACKGROUND]
+
+METRICS_WINDOW = 5000  # Number of recent requests per class kept for percentiles
+MAX_PREEMPTIONS = 3  # A background search preempted this often runs to the end next time
+DEADLINE_SLACK_S = 0.3  # Added to a search's deadline before the caller gives up on it
+STOP_GRACE_S = 0.1  # Time a stopped search gets to answer before its engine is killed
+
+
+class PoolSaturated(Exception):
+    """Raised when a request can't be queued or waited too long for an engine"""
+
+
+class EngineTimeout(Exception):
+    """Raised when a running search misses its deadline"""
+
+
+class EngineRequest:
+    """One search waiting for, or running on, an engine"""
+
+    def __init__(self, fen, limit, difficulty, session, priority, on_info):
+        self.fen = fen
+        self.limit = limit
+        self.difficulty = difficulty
+        self.session = session
+        self.priority = priority
+        self.on_info = on_info
+
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self.queue_wait = None  # Seconds until the first start
+        self.preemptions = 0
+        self.preempt_requested = False
+        self.searching = False  # The engine has been handed the search (so a stop can reach it)
+        self.cancelled = False
+        self.started = threading.Event()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ClassStats:
+    """Counters and recent timings of one priority class"""
+
+    def __init__(self):
+        self.completed = 0
+        self.rejected = 0
+        self.preempted = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.latencies = deque(maxlen=METRICS_WINDOW)
+        self.queue_waits = deque(maxlen=METRICS_WINDOW)
+
+    def to_dict(self):
+        return {
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "preempted": self.preempted,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "latency_ms": latency_percentiles(list(self.latencies)),
+            "queue_wait_ms": latency_percentiles(list(self.queue_waits)),
+        }
+
+
+def reached_limit(limit, progress):
+    """Whether a search ran to its depth, node or time limit rather than being stopped before it"""
+    if limit.depth is not None and progress.get("depth", 0) >= limit.depth:
+        return True
+    if limit.nodes is not None and progress.get("nodes", 0) >= limit.nodes:
+        return True
+    if limit.time is not None and "started" in progress and time.monotonic() - progress["started"] >= limit.time:
+        return True
+    return False
+
+
+class EngineScheduler:
+    """Engine processes with one worker thread each, fed from per-class, per-session queues"""
+
+    def __init__(self, size, max_queue=64, max_background_queue=16, backend="uci", paths=None, queue_timeout=5.0,
+                 options=None):
+        self.backend = backend
+        self.paths = paths
+        self.options = options  # UCI options for every engine, e.g. tuned Threads and Hash
+        self.queue_timeout = queue_timeout
+        self.max_queue = {INTERACTIVE: max_queue, BACKGROUND: max_background_queue}
+
+        self.condition = threading.Condition()
+        # Per class: session -> its queued requests, and the order sessions take turns in
+        self.queues = {priority: {} for priority in PRIORITY_CLASSES}
+        self.turns = {priority: deque() for priority in PRIORITY_CLASSES}
+        self.pending = {priority: 0 for priority in PRIORITY_CLASSES}
+        self.running = {}  # Worker index -> (request, engine)
+        self.stats = {priority: ClassStats() for priority in PRIORITY_CLASSES}
+        self.closed = False
+
+        self.engines = []
+        for _ in range(size):
+            engine = open_engine_backend(backend, paths, options)
+            if engine is None:
+                raise RuntimeError("No engine found for the pool")
+            self.engines.append(engine)
+        self.size = size
+        self.workers = [threading.Thread(target=self.work, args=(i,), daemon=True) for i in range(size)]
+        for worker in self.workers:
+            worker.start()
+
+    def search(self, fen, limit, difficulty=None, session=None, priority=INTERACTIVE, on_info=None):
+        """Queue a search and wait for its best move (UCI notation, None if there is none)
+
+        Raises PoolSaturated if the class queue is full or no engine picks the
+        request up within queue_timeout, and EngineTimeout if the search runs
+        past its deadline (see search_deadline()).
+        """
+        request = EngineRequest(fen, limit, difficulty, session, priority, on_info)
+        self.submit(request)
+
+        if not request.started.wait(self.queue_timeout):
+            with self.condition:
+                if not request.started.is_set():
+                    self.unqueue(request)
+                    self.stats[priority].rejected += 1
+                    raise PoolSaturated("timed out waiting for an engine")
+
+        deadline = self.search_deadline(limit, difficulty)
+        while not request.done.wait(deadline):
+            with self.condition:
+                if request.done.is_set():
+                    break
+                # A preempted request is queued again and gets a fresh deadline when it restarts
+                if request in self.running_requests() and time.monotonic() - request.started_at >= deadline:
+                    self.abandon(request)
+                    self.stats[priority].timeouts += 1
+                    raise EngineTimeout(f"engine missed its {deadline:.1f} s deadline")
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    @staticmethod
+    def search_deadline(limit, difficulty):
+        """Seconds a running search may take: the preset's deadline_ms, or the limit's time if longer"""
+        deadline = 0.0
+        if difficulty is not None:
+            deadline = DIFFICULTY_PRESETS[difficulty]["deadline_ms"] / 1000
+        if limit.time is not None:
+            deadline = max(deadline, limit.time)
+        return deadline + DEADLINE_SLACK_S if deadline else None
+
+    def running_requests(self):
+        """Requests on an engine right now (caller holds the lock)"""
+        return [request for request, _ in self.running.values()]
+
+    def abandon(self, request):
+        """Stop a search nobody waits for any more, and kill its engine if it doesn't answer (caller holds the lock)"""
+        request.cancelled = True
+        for running, engine in self.running.values():
+            if running is request:
+                self.stop_engine(engine)
+                threading.Timer(STOP_GRACE_S, self.kill_stalled, args=(request, engine)).start()
+
+    def kill_stalled(self, request, engine):
+        """Kill an engine still stuck on an abandoned search; its worker then replaces it"""
+        with self.condition:
+            if not any(running is request and current is engine for running, current in self.running.values()):
+                return
+        print("Engine did not answer a stop, killing it")
+        try:
+            engine.kill()
+        except Exception as e:
+            print(f"Could not kill engine: {e}")
+
+    def submit(self, request):
+        with self.condition:
+            if self.closed:
+                raise PoolSaturated("scheduler is shut down")
+            if self.pending[request.priority] >= self.max_queue[request.priority]:
+                self.stats[request.priority].rejected += 1
+                raise PoolSaturated(f"{request.priority} queue is full")
+            self.enqueue(request)
+            self.condition.notify()
+            if request.priority == INTERACTIVE and len(self.running) >= self.size:
+                self.preempt_background()
+
+    def enqueue(self, request, front=False):
+        """Add a request to its session's queue (caller holds the lock)"""
+        queue = self.queues[request.priority].get(request.session)
+        if queue is None:
+            queue = self.queues[request.priority][request.session] = deque()
+            self.turns[request.priority].append(request.session)
+        if front:
+            queue.appendleft(request)
+        else:
+            queue.append(request)
+        self.pending[request.priority] += 1
+
+    def unqueue(self, request):
+        """Remove a request that hasn't started (caller holds the lock)"""
+        queue = self.queues[request.priority].get(request.session)
+        if queue is None or request not in queue:
+            return False
+        queue.remove(request)
+        self.pending[request.priority] -= 1
+        if not queue:
+            del self.queues[request.priority][request.session]
+            self.turns[request.priority].remove(request.session)
+        return True
+
+    def take(self):
+        """Next request: most urgent class first, sessions in turn (caller holds the lock)"""
+        for priority in PRIORITY_CLASSES:
+            turns = self.turns[priority]
+            if not turns:
+                continue
+            session = turns.popleft()
+            queue = self.queues[priority][session]
+            request = queue.popleft()
+            self.pending[priority] -= 1
+            if queue:
+                turns.append(session)  # Back of the line for its next request
+            else:
+                del self.queues[priority][session]
+            return request
+        return None
+
+    def preempt_background(self):
+        """Stop the longest-running background search that may still be preempted (caller holds the lock)
+
+        Stopping under the lock keeps the worker from starting another request
+        on that engine first, so the stop can't hit the wrong search. A request
+        whose search hasn't been started yet is only marked: its worker queues
+        it again instead of starting it.
+        """
+        candidates = [(request, engine) for request, engine in self.running.values()
+                      if request.priority == BACKGROUND and not request.preempt_requested
+                      and request.preemptions < MAX_PREEMPTIONS]
+        if not candidates:
+            return
+        request, engine = min(candidates, key=lambda entry: entry[0].started_at)
+        request.preempt_requested = True
+        if request.searching:
+            self.stop_engine(engine)
+
+    @staticmethod
+    def stop_engine(engine):
+        try:
+            engine.stop()
+        except Exception as e:
+            print(f"Could not stop engine: {e}")
+
+    def work(self, index):
+        """Worker: run requests on one engine until the scheduler closes"""
+        engine = self.engines[index]
+        configured = None
+        while True:
+            with self.condition:
+                request = self.take()
+                while request is None and not self.closed:
+                    self.condition.wait()
+                    request = self.take()
+                if request is None:
+                    return
+                request.started_at = time.monotonic()
+                if request.queue_wait is None:
+                    request.queue_wait = request.started_at - request.enqueued_at
+                self.running[index] = (request, engine)
+            request.started.set()
+
+            best_move, error, progress = None, None, {}
+            try:
+                # Engines keep their settings, so only reconfigure when the difficulty changes
+                if request.difficulty is not None and configured != request.difficulty:
+                    apply_difficulty(engine, request.difficulty)
+                    configured = request.difficulty
+                with self.condition:
+                    request.searching = not request.preempt_requested
+                    if request.searching:
+                        engine.begin_search()
+                if request.searching:
+                    best_move = engine.search(request.fen, request.limit, self.track_progress(request, progress))
+            except Exception as e:
+                error = e
+                engine, configured = self.replace_engine(engine), None
+                if engine is not None:
+                    self.engines[index] = engine
+
+            with self.condition:
+                del self.running[index]
+                stats = self.stats[request.priority]
+                searched, request.searching = request.searching, False
+                # A stop that came too late (or never reached the engine) left a complete result
+                cut_short = not searched or not reached_limit(request.limit, progress)
+                if error is None and request.preempt_requested and cut_short and not request.cancelled:
+                    # Cut short for an interactive move: search again from scratch later
+                    request.preempt_requested = False
+                    request.preemptions += 1
+                    stats.preempted += 1
+                    self.enqueue(request, front=True)
+                    self.condition.notify()
+                else:
+                    request.preempt_requested = False
+                    if error is not None:
+                        stats.errors += 1
+                    else:
+                        stats.completed += 1
+                        stats.queue_waits.append(request.queue_wait * 1000)
+                        stats.latencies.append((time.monotonic() - request.enqueued_at) * 1000)
+                    request.result, request.error = best_move, error
+                    request.done.set()
+                if engine is None:
+                    self.size -= 1
+                    self.fail_if_empty()
+                    return
+
+    @staticmethod
+    def track_progress(request, progress):
+        """on_info for a search: keeps the deepest depth, the node count and the start time in `progress`"""
+        progress["started"] = time.monotonic()
+
+        def on_info(info):
+            for key in ("depth", "nodes"):
+                if key in info:
+                    progress[key] = max(progress.get(key, 0), info[key])
+            if request.on_info is not None:
+                request.on_info(info)
+        return on_info
+
+    def replace_engine(self, engine):
+        """Swap a failed engine for a fresh process (None if none could be started)"""
+        try:
+            engine.kill()
+        except Exception:
+            pass
+        replacement = open_engine_backend(self.backend, self.paths, self.options)
+        if replacement is None:
+            print(f"Engine could not be replaced, pool shrinks to {self.size - 1}")
+        return replacement
+
+    def fail_if_empty(self):
+        """With no engine left, fail every queued request instead of leaving it waiting (caller holds the lock)"""
+        if self.size > 0:
+            return
+        request = self.take()
+        while request is not None:
+            request.error = RuntimeError("no engine left in the pool")
+            request.started.set()
+            request.done.set()
+            request = self.take()
+
+    def cancel(self, session, priority=BACKGROUND):
+        """Drop a session's queued requests of one class and stop its running search"""
+        with self.condition:
+            for request in list(self.queues[priority].get(session, ())):
+                self.unqueue(request)
+                request.cancelled = True
+                request.started.set()
+                request.done.set()
+            for request, engine in self.running.values():
+                if request.session == session and request.priority == priority:
+                    request.cancelled = True
+                    self.stop_engine(engine)
+
+    def session_engine(self, session, priority=BACKGROUND, difficulty=None):
+        """Engine-like handle whose searches go through the scheduler"""
+        return ScheduledEngine(self, session, priority, difficulty)
+
+    def metrics(self):
+        with self.condition:
+            return {
+                "engines": self.size,
+                "busy": len(self.running),
+                "queued": dict(self.pending),
+                "classes": {priority: stats.to_dict() for priority, stats in self.stats.items()},
+            }
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+            for _, engine in self.running.values():
+                self.stop_engine(engine)
+        for worker in self.workers:
+            worker.join(1.0)
+        for engine in self.engines:
+            try:
+                engine.close()
+            except Exception:
+                pass
+
+
+class ScheduledEngine(EngineBackend):
+    """EngineBackend for one session and class of a shared EngineScheduler (for GameAnnotator and the like)"""
+
+    name = "scheduled"
+
+    def __init__(self, scheduler, session, priority, difficulty):
+        super().__init__("scheduler")
+        self.scheduler = scheduler
+        self.session = session
+        self.priority = priority
+        self.difficulty = difficulty
+
+    def search(self, fen, limit, on_info=None):
+        return self.scheduler.search(fen, limit, self.difficulty, self.session, self.priority, on_info)
+
+    def stop(self):
+        self.scheduler.cancel(self.session, self.priority)
+
+    def kill(self):
+        self.stop()
+
+    def close(self):
+        self.stop()  # The engines belong to the scheduler
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Pick Stockfish's Threads and Hash for this host and save them to config.json.
+
+Candidates are measured the way the engines will actually run: `concurrent`
+engines at once (the game window searches with one engine at a time, since
+the post-game analysis only starts once the game is over; a game server runs
+its whole pool). Each measurement is the time every engine takes to reach a
+fixed depth on a small suite of positions, which decides the winner; a
+candidate with fewer threads or less hash wins when it is within TOLERANCE of
+the fastest. Stockfish's own `bench` (nodes per second) is printed alongside
+for comparison with other hosts but does not affect the choice.
+
+Threads are tuned first with the default hash, then hash sizes with the
+best thread count. The result goes to "engine_options" in config.json,
+which the game and the game server pass to every engine they start.
+
+    python engine_tuning.py
+    python engine_tuning.py --concurrent 8 --depth 14   # for a server with 8 engines
+    python engine_tuning.py --dry-run
+
+Note that with more than one thread a node budget no longer gives exactly
+the same search twice (see DIFFICULTY_PRESETS); it is still the same amount
+of work, done sooner.
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+
+import chess.engine
+
+from engine_backend import (CONFIG_PATH, DEFAULT_ENGINE_OPTIONS, UciEngineBackend, engine_command, engine_search_paths,
+                            load_config)
+
+# Positions searched for time to depth: opening, two middlegames, an endgame
+TUNING_POSITIONS = [
+    chess.STARTING_FEN,
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP1B1PPP/R2QKB1R w KQ - 0 8",
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+]
+TUNING_DEPTH = 16
+BENCH_DEPTH = 13
+BENCH_TIMEOUT_S = 300
+HASH_SIZES_MB = [16, 32, 64, 128, 256, 512, 1024]
+MEMORY_SHARE = 0.25  # Share of the host's memory all engines' hash tables together may use
+TOLERANCE = 0.05  # Within 5% of the fastest, the cheaper setting wins
+
+
+def host_cores():
+    """CPU cores this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def host_memory_mb():
+    """Physical memory in MB, or None where it can't be read"""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def thread_candidates(cores, concurrent):
+    """1, 2, 4... up to the cores each engine gets when they all search at once"""
+    limit = max(1, cores // concurrent)
+    candidates = []
+    threads = 1
+    while threads < limit:
+        candidates.append(threads)
+        threads *= 2
+    candidates.append(limit)
+    return candidates
+
+
+def hash_candidates(memory_mb, concurrent):
+    """Hash sizes that fit every engine's table in MEMORY_SHARE of the host's memory"""
+    if memory_mb is None:
+        return [size for size in HASH_SIZES_MB if size <= 256]
+    budget = memory_mb * MEMORY_SHARE / concurrent
+    return [size for size in HASH_SIZES_MB if size <= budget] or [HASH_SIZES_MB[0]]
+
+
+def run_bench(path, threads, hash_mb, concurrent):
+    """Total nodes per second of `concurrent` simultaneous `stockfish bench` runs (None if unsupported)"""
+    command = engine_command(path)
+    command = command if isinstance(command, list) else [command]
+    command = command + ["bench", str(hash_mb), str(threads), str(BENCH_DEPTH), "default", "depth"]
+    processes = [subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                  stderr=subprocess.STDOUT, universal_newlines=True)
+                 for _ in range(concurrent)]
+    total = 0
+    for process in processes:
+        try:
+            output, _ = process.communicate(timeout=BENCH_TIMEOUT_S)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            return None
+        match = re.search(r"Nodes/second\s*:\s*(\d+)", output)
+        if match is None:
+            return None
+        total += int(match.group(1))
+    return total
+
+
+def run_suite(engine, depth, positions, result):
+    """Worker: time to depth and nodes per position, searched one after the other like a game"""
+    times, nodes = [], 0
+    for fen in positions:
+        last = {}
+
+        def on_info(info):
+            if "nodes" in info:
+                last["nodes"] = info["nodes"]
+
+        started = time.monotonic()
+        engine.search(fen, chess.engine.Limit(depth=depth), on_info)
+        times.append(time.monotonic() - started)
+        nodes += last.get("nodes", 0)
+    result["time"] = sum(times)
+    result["nodes"] = nodes
+
+
+def measure(path, threads, hash_mb, concurrent, depth, positions=TUNING_POSITIONS):
+    """Time to depth (mean suite seconds per engine) and total nps with `concurrent` engines searching at once"""
+    engines = [UciEngineBackend(path, {"Threads": threads, "Hash": hash_mb}) for _ in range(concurrent)]
+    try:
+        results = [{} for _ in engines]
+        workers = [threading.Thread(target=run_suite, args=(engine, depth, positions, result))
+                   for engine, result in zip(engines, results)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        for engine in engines:
+            engine.close()
+    if any("time" not in result for result in results):
+        raise RuntimeError("a search failed")
+    suite_time = sum(result["time"] for result in results) / len(results)
+    nps = sum(result["nodes"] / result["time"] for result in results if result["time"] > 0)
+    return {"threads": threads, "hash": hash_mb, "time": suite_time, "nps": int(nps),
+            "bench_nps": run_bench(path, threads, hash_mb, concurrent)}
+
+
+def pick_best(measurements, key):
+    """Fastest measurement, or the cheapest one (by key) within TOLERANCE of it"""
+    # Only time to depth counts: it is what a game waits for. bench_nps is informational,
+    # since more threads raise nps through search overhead without reaching depth sooner
+    fastest = min(measurement["time"] for measurement in measurements)
+    good_enough = [m for m in measurements if m["time"] <= fastest * (1 + TOLERANCE)]
+    return min(good_enough, key=lambda m: m[key])
+
+
+def describe(measurement):
+    bench = f", bench {measurement['bench_nps']:,} nps" if measurement["bench_nps"] else ""
+    return (f"Threads {measurement['threads']:>2}, Hash {measurement['hash']:>4} MB: "
+            f"{measurement['time']:.2f} s to depth, {measurement['nps']:,} nps{bench}")
+
+
+def tune(path, concurrent, depth):
+    """Measure thread counts, then hash sizes, and return the best {"Threads": ..., "Hash": ...}"""
+    cores, memory_mb = host_cores(), host_memory_mb()
+    print(f"{cores} cores, {memory_mb if memory_mb is not None else 'unknown'} MB memory, "
+          f"{concurrent} engines searching at once, depth {depth}")
+
+    measurements = []
+    for threads in thread_candidates(cores, concurrent):
+        measurements.append(measure(path, threads, DEFAULT_ENGINE_OPTIONS["Hash"], concurrent, depth))
+        print(describe(measurements[-1]))
+    best_threads = pick_best(measurements, "threads")["threads"]
+
+    measurements = []
+    for hash_mb in hash_candidates(memory_mb, concurrent):
+        measurements.append(measure(path, best_threads, hash_mb, concurrent, depth))
+        print(describe(measurements[-1]))
+    best = pick_best(measurements, "hash")
+    return {"Threads": best["threads"], "Hash": best["hash"]}
+
+
+def load_engine_options(path=CONFIG_PATH):
+    """The tuned "engine_options" of a config file ({} if there are none)"""
+    return load_config(path).get("engine_options", {})
+
+
+def save_engine_options(options, path=CONFIG_PATH):
+    """Store the options as "engine_options" in the config file, keeping everything else in it"""
+    config = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            text = f.read().strip()
+        config = json.loads(text) if text else {}
+    config["engine_options"] = options
+    with open(path, "w") as f:
+        json.dump(config, f, indent=2)
+        f.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune Stockfish's Threads and Hash for this host")
+    parser.add_argument("--path", help="Engine binary (default: the first one found)")
+    parser.add_argument("--concurrent", type=int, default=1,
+                        help="Engines searching at the same time (1 for the game window, the pool size for a server)")
+    parser.add_argument("--depth", type=int, default=TUNING_DEPTH, help="Depth searched in every position")
+    parser.add_argument("--config", default=CONFIG_PATH, help="Configuration file to update")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the best settings")
+    args = parser.parse_args()
+
+    path = args.path
+    if path is None:
+        path = next((candidate for candidate in engine_search_paths() if os.path.exists(candidate)), None)
+        if path is None:
+            parser.error("no Stockfish binary found, pass --path")
+
+    options = tune(path, args.concurrent, args.depth)
+    print(f"Best: Threads {options['Threads']}, Hash {options['Hash']} MB")
+    if not args.dry_run:
+        save_engine_options(options, args.config)
+        print(f"Saved to {args.config}")
+
+
+if __name__ == "__main__":
+    main()
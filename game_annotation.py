@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Post-game annotation for the chess game.
+
+When a game ends, a GameAnnotator replays it in a background thread with its
+own engine, evaluates every position and marks inaccuracies, mistakes and
+blunders, as well as mates that were missed while Stockfish still had moves
+left under the move limit.
+
+Positions are analysed from the last one back to the first: the engine keeps
+its hash between searches, and what it learnt about the later positions helps
+it with the earlier ones that lead to them.
+
+    python game_annotation.py --moves e2e4,e7e5,d1h5,b8c6,f1c4,g8f6,h5f7
+"""
+
+import argparse
+import threading
+
+import chess
+import chess.engine
+
+from engine_backend import open_engine_backend
+
+# Search for every analysed position (depth, capped in time for slow machines)
+ANNOTATION_DEPTH = 12
+ANNOTATION_TIME_S = 1.0
+
+# Evaluations are clamped so winning "mate in 5" vs "mate in 3" isn't counted as a loss
+ANNOTATION_SCORE_CAP = 1000
+MATE_SCORE = 100000
+
+# Centipawn loss thresholds, worst first: (loss, label, suffix)
+ANNOTATION_THRESHOLDS = [
+    (300, "blunder", "??"),
+    (100, "mistake", "?"),
+    (50, "inaccuracy", "?!"),
+]
+
+
+class MoveAnnotation:
+    """Verdict on one played move"""
+
+    def __init__(self, ply, move, san, color, loss=0, label=None, missed_mate=None, mate_within_limit=False):
+        self.ply = ply
+        self.move = move
+        self.san = san
+        self.color = color
+        self.loss = loss  # Centipawns lost from the mover's point of view
+        self.label = label  # "blunder", "mistake", "inaccuracy" or None
+        self.missed_mate = missed_mate  # Mate in N that was available before the move
+        self.mate_within_limit = mate_within_limit  # The missed mate fit in Stockfish's remaining moves
+
+    @property
+    def suffix(self):
+        for _, label, suffix in ANNOTATION_THRESHOLDS:
+            if label == self.label:
+                return suffix
+        return ""
+
+    def describe(self):
+        """Human readable comment, empty for good moves"""
+        parts = []
+        if self.label:
+            parts.append(f"{self.label} (-{self.loss / 100:.1f})")
+        if self.missed_mate:
+            note = f"missed mate in {self.missed_mate}"
+            if self.mate_within_limit:
+                note += " within the move limit"
+            parts.append(note)
+        return ", ".join(parts)
+
+
+class GameAnnotator:
+    """Background analysis of a finished game that can be cancelled and resumed"""
+
+    def __init__(self, starting_fen, moves, engine_color, max_moves=float('inf'),
+                 backend="uci", paths=None, depth=ANNOTATION_DEPTH, time_s=ANNOTATION_TIME_S,
+                 engine=None, report=True, options=None):
+        self.starting_fen = starting_fen
+        self.moves = list(moves)
+        self.engine_color = engine_color
+        self.max_moves = max_moves
+        self.backend = backend
+        self.paths = paths
+        self.options = options  # UCI options for the engine opened here
+        self.limit = chess.engine.Limit(depth=depth, time=time_s)
+        self.report = report  # Print the summary when done
+
+        # Every position of the game: positions[i] is the one before moves[i]
+        board = chess.Board(starting_fen)
+        self.positions = [board.fen()]
+        self.sans = []
+        for move in self.moves:
+            self.sans.append(board.san(move))
+            board.push(move)
+            self.positions.append(board.fen())
+
+        self.scores = {}  # Position index -> chess.engine.PovScore, filled from the end
+        self.annotations = None  # List of MoveAnnotation once every position is scored
+        self.engine = engine  # Opened on first use unless one is given (e.g. a scheduler handle)
+        self.error = None
+        self.cancel_event = threading.Event()
+        self.worker = None
+
+    @property
+    def total(self):
+        return len(self.positions)
+
+    @property
+    def done(self):
+        return self.annotations is not None
+
+    @property
+    def running(self):
+        return self.worker is not None and self.worker.is_alive()
+
+    def start(self):
+        """Start, or resume where a cancelled run stopped"""
+        if self.done or self.running:
+            return
+        self.cancel_event.clear()
+        self.error = None
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def cancel(self):
+        """Stop analysing without waiting; scores found so far are kept for resume()"""
+        self.cancel_event.set()
+        engine = self.engine
+        if engine is not None:
+            try:
+                engine.stop()
+            except Exception:
+                pass
+
+    resume = start
+
+    def close(self):
+        """Cancel and shut the analysis engine down"""
+        self.cancel()
+        engine, self.engine = self.engine, None
+        if engine is not None:
+            try:
+                engine.close()
+            except Exception:
+                pass
+
+    def run(self):
+        """Worker: score the positions backwards, then classify the moves"""
+        try:
+            for index in reversed(range(self.total)):
+                if self.cancel_event.is_set():
+                    return
+                if index in self.scores:
+                    continue
+                score = self.evaluate(self.positions[index])
+                # A stopped search is incomplete: leave the position for resume()
+                if score is None or self.cancel_event.is_set():
+                    return
+                self.scores[index] = score
+
+            self.annotations = self.classify()
+            if self.report:
+                print(self.summary())
+        except Exception as e:
+            self.error = e
+            if self.report:
+                print(f"Post-game analysis failed: {e}")
+        finally:
+            if self.done:
+                self.close()
+
+    def evaluate(self, fen):
+        """Score one position from White's point of view"""
+        board = chess.Board(fen)
+        outcome = board.outcome()
+        if outcome is not None:
+            # Finished positions are scored directly, the engine has no move to search
+            if outcome.winner is None:
+                return chess.engine.PovScore(chess.engine.Cp(0), chess.WHITE)
+            return chess.engine.PovScore(chess.engine.Mate(0), board.turn)
+
+        if self.engine is None:
+            self.engine = open_engine_backend(self.backend, self.paths, self.options)
+            if self.engine is None:
+                raise RuntimeError("no engine available")
+
+        result = {"score": None}
+
+        def on_info(info):
+            if "score" in info and not info.get("lowerbound") and not info.get("upperbound"):
+                result["score"] = info["score"]
+
+        # cancel() sets the event before it stops the engine: checked after the hand-off, neither is missed
+        self.engine.begin_search()
+        if self.cancel_event.is_set():
+            return None
+        self.engine.search(fen, self.limit, on_info)
+        return result["score"]
+
+    def classify(self):
+        """Turn consecutive position scores into move annotations"""
+        annotations = []
+        engine_moves = 0
+        for ply, move in enumerate(self.moves):
+            color = chess.Board(self.positions[ply]).turn
+            before = self.scores[ply].pov(color)
+            after = self.scores[ply + 1].pov(color)
+            loss = max(0, self.capped(before) - self.capped(after))
+
+            label = None
+            for threshold, name, _ in ANNOTATION_THRESHOLDS:
+                if loss >= threshold:
+                    label = name
+                    break
+
+            # A mate was on the board and the move didn't keep it (or delivered it)
+            missed_mate = None
+            mate = before.mate()
+            if mate is not None and mate > 0:
+                kept = after.mate() is not None and 0 <= after.mate() < mate
+                if not kept:
+                    missed_mate = mate
+
+            # Stockfish only had so many moves left to deliver it
+            mate_within_limit = False
+            if color == self.engine_color:
+                moves_left = self.max_moves - engine_moves
+                mate_within_limit = missed_mate is not None and missed_mate <= moves_left
+                engine_moves += 1
+
+            annotations.append(MoveAnnotation(ply, move, self.sans[ply], color, loss, label,
+                                              missed_mate, mate_within_limit))
+        return annotations
+
+    @staticmethod
+    def capped(score):
+        value = score.score(mate_score=MATE_SCORE)
+        return max(-ANNOTATION_SCORE_CAP, min(ANNOTATION_SCORE_CAP, value))
+
+    def counts(self, color):
+        """Number of moves per label for one side, plus missed mates"""
+        counts = {label: 0 for _, label, _ in ANNOTATION_THRESHOLDS}
+        counts["missed mate"] = 0
+        for annotation in self.annotations or []:
+            if annotation.color != color:
+                continue
+            if annotation.label:
+                counts[annotation.label] += 1
+            if annotation.missed_mate:
+                counts["missed mate"] += 1
+        return counts
+
+    def annotated_moves(self):
+        """Move list in SAN with annotation symbols, e.g. '1. e4 e5 2. Qh5?? ...'"""
+        board = chess.Board(self.starting_fen)
+        parts = []
+        for annotation in self.annotations or []:
+            number = board.fullmove_number
+            if board.turn == chess.WHITE:
+                parts.append(f"{number}.")
+            elif not parts:
+                parts.append(f"{number}...")
+            parts.append(annotation.san + annotation.suffix)
+            board.push(annotation.move)
+        return " ".join(parts)
+
+    def to_dict(self):
+        """Progress and results, for the game server"""
+        return {
+            "scored": len(self.scores),
+            "positions": self.total,
+            "done": self.done,
+            "running": self.running,
+            "error": str(self.error) if self.error is not None else None,
+            "annotated": self.annotated_moves() if self.done else None,
+            "moves": [{"san": a.san, "label": a.label, "loss": a.loss, "missed_mate": a.missed_mate,
+                       "mate_within_limit": a.mate_within_limit} for a in self.annotations or []],
+        }
+
+    def summary(self):
+        """Console report: annotated move list and every flagged move"""
+        lines = ["Post-game analysis:", self.annotated_moves()]
+        for annotation in self.annotations or []:
+            comment = annotation.describe()
+            if comment:
+                side = "Stockfish" if annotation.color == self.engine_color else "You"
+                lines.append(f"  {side}, {annotation.san}: {comment}")
+        return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Annotate a game given as UCI moves")
+    parser.add_argument("--fen", default=chess.STARTING_FEN, help="Starting position")
+    parser.add_argument("--moves", required=True, help="Comma separated moves in UCI notation")
+    parser.add_argument("--engine-color", choices=["white", "black"], default="black",
+                        help="Side played by Stockfish (for the move limit)")
+    parser.add_argument("--max-moves", type=int, default=None, help="Stockfish's move limit")
+    parser.add_argument("--path", help="Engine binary, or 'standin' for the bundled stand-in")
+    parser.add_argument("--depth", type=int, default=ANNOTATION_DEPTH)
+    args = parser.parse_args()
+
+    moves = [chess.Move.from_uci(move) for move in args.moves.split(",") if move]
+    annotator = GameAnnotator(args.fen, moves, args.engine_color == "white",
+                              args.max_moves if args.max_moves is not None else float('inf'),
+                              paths=[args.path] if args.path else None, depth=args.depth)
+    annotator.start()
+    annotator.worker.join()
+    annotator.close()
+
+
+if __name__ == "__main__":
+    main()
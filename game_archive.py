@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""
+Compact binary archive of played and analysed games.
+
+Layout: a "CHGA" + version header, then self-contained blocks, so an archive
+can be appended to (one block per write session) and streamed block by block:
+
+    block  := varint game_count, varint payload_length, zlib(payload)
+    game   := varint flags, varint header_count, (str key, str value)*,
+              [str fen], varint move_count, move_count * uint16le move,
+              [move_count * varint score]
+    str    := varint byte_length, utf-8 bytes
+
+A move is from-square | to-square << 6 | promotion << 12 in 16 bits, so
+replaying a game needs no move generation, unlike parsing PGN's SAN. Scores
+(from the post-game analysis, White's point of view after each move) are
+zigzag varints, with the low bit telling centipawns and mates apart. A mate
+White gives is stored as its distance (0 once delivered), a mate White gets
+as -1 - distance, so "White mated Black" and "White is mated" stay apart.
+Version 1 archives stored both as the signed distance and lost the sign of
+mate 0; they are still read, and upgraded before anything is appended.
+
+    python game_archive.py import games.pgn games.cga
+    python game_archive.py export games.cga games.pgn
+    python game_archive.py bench games.pgn
+"""
+
+import argparse
+import os
+import sys
+import time
+import zlib
+from array import array
+
+import chess
+import chess.engine
+import chess.pgn
+
+ARCHIVE_MAGIC = b"CHGA"
+ARCHIVE_VERSION = 2
+BLOCK_GAMES = 256  # Games per compressed block
+COMPRESSION_LEVEL = 6
+
+FLAG_FEN = 1
+FLAG_SCORES = 2
+
+
+def write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, pos):
+    """Decode a varint at data[pos], returning (value, next position)"""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def read_stream_varint(stream):
+    """Decode a varint from a file, None at end of file"""
+    value = 0
+    shift = 0
+    while True:
+        byte = stream.read(1)
+        if not byte:
+            if shift:
+                raise ValueError("Truncated archive")
+            return None
+        value |= (byte[0] & 0x7F) << shift
+        if byte[0] < 0x80:
+            return value
+        shift += 7
+
+
+def write_str(out, text):
+    data = text.encode("utf-8")
+    write_varint(out, len(data))
+    out += data
+
+
+def read_str(data, pos):
+    length, pos = read_varint(data, pos)
+    return data[pos:pos + length].decode("utf-8"), pos + length
+
+
+def encode_move(move):
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+
+def decode_move(value):
+    return chess.Move(value & 63, (value >> 6) & 63, (value >> 12) or None)
+
+
+_move_table = []
+
+
+def move_table():
+    """Every encodable move, indexed by its code (built once, decoding is then a lookup)"""
+    if not _move_table:
+        _move_table.extend(decode_move(value) for value in range(1 << 15))
+    return _move_table
+
+
+def encode_score(score):
+    """PovScore (or None) -> unsigned int: 0 for none, else zigzag(value) * 2 + is_mate, plus one"""
+    if score is None:
+        return 0
+    white = score.white()
+    mate = white.mate()
+    if mate is not None:
+        # Mate(0) is the mated side, MateGiven the mating one: both have mate() == 0
+        value, kind = (mate if white > chess.engine.Cp(0) else mate - 1), 1
+    else:
+        value, kind = white.score(), 0
+    zigzag = value * 2 if value >= 0 else -value * 2 - 1
+    return (zigzag * 2 + kind) + 1
+
+
+def decode_score(code, version=ARCHIVE_VERSION):
+    if code == 0:
+        return None
+    code -= 1
+    kind, zigzag = code & 1, code >> 1
+    value = zigzag // 2 if zigzag % 2 == 0 else -(zigzag + 1) // 2
+    if not kind:
+        score = chess.engine.Cp(value)
+    elif version < 2:
+        score = chess.engine.Mate(value)
+    elif value == 0:
+        score = chess.engine.MateGiven
+    else:
+        score = chess.engine.Mate(value if value > 0 else value + 1)
+    return chess.engine.PovScore(score, chess.WHITE)
+
+
+def pack_moves(moves):
+    """Moves as little-endian uint16 codes, whatever the host's byte order"""
+    encoded = array("H", [encode_move(move) for move in moves])
+    if sys.byteorder == "big":
+        encoded.byteswap()
+    return encoded.tobytes()
+
+
+def unpack_move_codes(data):
+    encoded = array("H")
+    encoded.frombytes(data)
+    if sys.byteorder == "big":
+        encoded.byteswap()
+    return encoded
+
+
+class ArchivedGame:
+    """A game as stored in the archive: PGN-style headers, start position, moves and optional scores"""
+
+    def __init__(self, headers=None, starting_fen=chess.STARTING_FEN, moves=None, scores=None, game_id=None):
+        self.headers = dict(headers or {})
+        self.starting_fen = starting_fen
+        self.moves = list(moves or [])
+        self.scores = scores  # None, or one PovScore (or None) per move
+        self.game_id = game_id  # Position in the archive, set when read
+
+    def board(self):
+        """Final position, replayed without legality checks (the moves were legal when stored)"""
+        board = chess.Board(self.starting_fen)
+        for move in self.moves:
+            board.push(move)
+        return board
+
+    def encode(self, out):
+        has_fen = self.starting_fen != chess.STARTING_FEN
+        flags = (FLAG_FEN if has_fen else 0) | (FLAG_SCORES if self.scores is not None else 0)
+        write_varint(out, flags)
+        write_varint(out, len(self.headers))
+        for key, value in self.headers.items():
+            write_str(out, key)
+            write_str(out, str(value))
+        if has_fen:
+            write_str(out, self.starting_fen)
+        write_varint(out, len(self.moves))
+        out += pack_moves(self.moves)
+        if self.scores is not None:
+            for score in self.scores:
+                write_varint(out, encode_score(score))
+
+    @classmethod
+    def decode(cls, data, pos, game_id=None, version=ARCHIVE_VERSION):
+        """Decode one game at data[pos], returning (game, next position)"""
+        flags, pos = read_varint(data, pos)
+        count, pos = read_varint(data, pos)
+        headers = {}
+        for _ in range(count):
+            key, pos = read_str(data, pos)
+            headers[key], pos = read_str(data, pos)
+        starting_fen = chess.STARTING_FEN
+        if flags & FLAG_FEN:
+            starting_fen, pos = read_str(data, pos)
+        count, pos = read_varint(data, pos)
+        encoded = unpack_move_codes(data[pos:pos + 2 * count])
+        pos += 2 * count
+        table = move_table()
+        moves = [table[value] for value in encoded]
+        scores = None
+        if flags & FLAG_SCORES:
+            scores = []
+            for _ in range(count):
+                code, pos = read_varint(data, pos)
+                scores.append(decode_score(code, version))
+        return cls(headers, starting_fen, moves, scores, game_id), pos
+
+    @classmethod
+    def from_pgn(cls, pgn_game):
+        """Convert a chess.pgn.Game, keeping [%eval] comments as scores"""
+        headers = {key: value for key, value in pgn_game.headers.items() if key not in ("FEN", "SetUp")}
+        moves, scores = [], []
+        for node in pgn_game.mainline():
+            moves.append(node.move)
+            scores.append(node.eval())
+        if not any(score is not None for score in scores):
+            scores = None
+        return cls(headers, pgn_game.board().fen(), moves, scores)
+
+    def to_pgn(self):
+        """Convert to a chess.pgn.Game, scores written as [%eval] comments"""
+        pgn_game = chess.pgn.Game(self.headers)
+        if self.starting_fen != chess.STARTING_FEN:
+            pgn_game.setup(chess.Board(self.starting_fen))
+        node = pgn_game
+        for i, move in enumerate(self.moves):
+            node = node.add_variation(move)
+            if self.scores is not None and self.scores[i] is not None:
+                node.set_eval(self.scores[i])
+        return pgn_game
+
+
+class ArchiveWriter:
+    """Streaming writer: games are buffered and compressed a block at a time"""
+
+    def __init__(self, path, append=True):
+        exists = append and os.path.exists(path) and os.path.getsize(path) > 0
+        if exists and archive_version(path) < ARCHIVE_VERSION:
+            upgrade_archive(path)
+        self.next_game_id = count_games(path) if exists else 0
+        self.file = open(path, "ab" if exists else "wb")
+        if not exists:
+            self.file.write(ARCHIVE_MAGIC + bytes([ARCHIVE_VERSION]))
+        self.pending = []
+
+    def write(self, game):
+        """Add a game and return its id in the archive"""
+        game_id = self.next_game_id
+        self.next_game_id += 1
+        self.pending.append(game)
+        if len(self.pending) >= BLOCK_GAMES:
+            self.flush()
+        return game_id
+
+    def flush(self):
+        if not self.pending:
+            return
+        payload = bytearray()
+        for game in self.pending:
+            game.encode(payload)
+        compressed = zlib.compress(bytes(payload), COMPRESSION_LEVEL)
+        header = bytearray()
+        write_varint(header, len(self.pending))
+        write_varint(header, len(compressed))
+        self.file.write(header + compressed)
+        self.file.flush()
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_archive(path):
+    """Open an archive for reading, returning (stream after the header, format version)"""
+    stream = open(path, "rb")
+    header = stream.read(len(ARCHIVE_MAGIC) + 1)
+    if len(header) <= len(ARCHIVE_MAGIC) or header[:len(ARCHIVE_MAGIC)] != ARCHIVE_MAGIC:
+        stream.close()
+        raise ValueError(f"{path} is not a game archive")
+    if header[-1] > ARCHIVE_VERSION:
+        stream.close()
+        raise ValueError(f"{path} needs a newer version of this program (format {header[-1]})")
+    return stream, header[-1]
+
+
+def archive_version(path):
+    stream, version = open_archive(path)
+    stream.close()
+    return version
+
+
+def upgrade_archive(path):
+    """Rewrite an older archive in the current format, keeping every game id"""
+    upgraded = path + ".upgrade"
+    with ArchiveWriter(upgraded, append=False) as writer:
+        for game in read_games(path):
+            writer.write(game)
+    os.replace(upgraded, path)
+    print(f"Upgraded {path} to archive format {ARCHIVE_VERSION}")
+
+
+def iter_blocks(stream):
+    """Yield (game count, offset of the compressed payload, payload length) for every block"""
+    while True:
+        count = read_stream_varint(stream)
+        if count is None:
+            return
+        length = read_stream_varint(stream)
+        offset = stream.tell()
+        yield count, offset, length
+        stream.seek(offset + length)
+
+
+def count_games(path):
+    """Number of games in an archive, read from the block headers only"""
+    stream, _ = open_archive(path)
+    with stream:
+        return sum(count for count, _, _ in iter_blocks(stream))
+
+
+def read_games(path, start=0):
+    """Stream the games of an archive, from game id `start` on"""
+    stream, version = open_archive(path)
+    with stream:
+        game_id = 0
+        for count, offset, length in iter_blocks(stream):
+            if game_id + count <= start:
+                game_id += count  # Whole block skipped without decompressing it
+                continue
+            stream.seek(offset)
+            data = zlib.decompress(stream.read(length))
+            stream.seek(offset + length)
+            pos = 0
+            for _ in range(count):
+                game, pos = ArchivedGame.decode(data, pos, game_id, version)
+                if game_id >= start:
+                    yield game
+                game_id += 1
+
+
+def read_game(path, game_id):
+    """One game by id (None if the archive is shorter)"""
+    for game in read_games(path, game_id):
+        return game
+    return None
+
+
+def pgn_to_archive(pgn_path, archive_path, append=False):
+    """Bulk import a PGN file, returning the number of games converted"""
+    count = 0
+    with open(pgn_path, encoding="utf-8", errors="replace") as pgn, ArchiveWriter(archive_path, append) as writer:
+        while True:
+            pgn_game = chess.pgn.read_game(pgn)
+            if pgn_game is None:
+                break
+            writer.write(ArchivedGame.from_pgn(pgn_game))
+            count += 1
+    return count
+
+
+def archive_to_pgn(archive_path, pgn_path):
+    """Bulk export an archive to PGN, returning the number of games converted"""
+    count = 0
+    with open(pgn_path, "w", encoding="utf-8") as pgn:
+        for game in read_games(archive_path):
+            print(game.to_pgn(), file=pgn, end="\n\n")
+            count += 1
+    return count
+
+
+def benchmark(pgn_path):
+    """Compare size and replay time of a PGN file and its archive"""
+    archive_path = pgn_path + ".cga"
+    count = pgn_to_archive(pgn_path, archive_path)
+
+    # Loading: PGN has to replay every SAN move on a board to know what it is
+    started = time.monotonic()
+    with open(pgn_path, encoding="utf-8", errors="replace") as pgn:
+        while chess.pgn.read_game(pgn) is not None:
+            pass
+    pgn_time = time.monotonic() - started
+
+    started = time.monotonic()
+    games = list(read_games(archive_path))
+    archive_time = time.monotonic() - started
+
+    # Replaying every loaded game to its final position
+    started = time.monotonic()
+    for game in games:
+        game.board()
+    replay_time = time.monotonic() - started
+
+    pgn_size, archive_size = os.path.getsize(pgn_path), os.path.getsize(archive_path)
+    print(f"{count} games")
+    print(f"size:   PGN {pgn_size / 1024:.0f} KiB, archive {archive_size / 1024:.0f} KiB "
+          f"({archive_size / pgn_size:.1%})")
+    print(f"load:   PGN {pgn_time:.2f} s, archive {archive_time:.2f} s ({pgn_time / archive_time:.1f}x faster)")
+    print(f"replay to the final positions: {replay_time:.2f} s more")
+    os.remove(archive_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert between PGN and the compact game archive")
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("import", help="PGN -> archive")
+    command.add_argument("pgn")
+    command.add_argument("archive")
+    command.add_argument("--append", action="store_true", help="Add to an existing archive")
+    command = commands.add_parser("export", help="Archive -> PGN")
+    command.add_argument("archive")
+    command.add_argument("pgn")
+    command = commands.add_parser("bench", help="Compare size and replay speed with PGN")
+    command.add_argument("pgn")
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    if args.command == "import":
+        count = pgn_to_archive(args.pgn, args.archive, args.append)
+    elif args.command == "export":
+        count = archive_to_pgn(args.archive, args.pgn)
+    else:
+        benchmark(args.pgn)
+        return
+    print(f"Converted {count} games in {time.monotonic() - started:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+"""
+Headless multi-session game server.
+
+Hosts many concurrent games over a small JSON HTTP API on localhost, each
+with its own board, move limit and difficulty, all sharing a bounded pool of
+engine processes behind a fair scheduler (engine_scheduler.py): moves are
+interactive requests, post-game analysis is background work. When a class's
+wait queue is full, requests are refused with 503 + Retry-After instead of
+piling up.
+
+    python game_server.py --port 8765 --engines 4 --queue 64
+    python game_server.py --path standin --load-test 300
+
+API:
+    POST   /games              {"color": "white", "fen": ..., "max_moves": 5, "difficulty": "normal"}
+    GET    /games/<id>
+    POST   /games/<id>/move    {"move": "e2e4"}
+    DELETE /games/<id>
+    POST   /games/<id>/analysis
+    GET    /games/<id>/analysis
+    GET    /metrics
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import chess
+
+from engine_backend import CONFIG_PATH, DIFFICULTY_PRESETS, difficulty_limit, latency_percentiles
+from engine_scheduler import BACKGROUND, INTERACTIVE, EngineScheduler, EngineTimeout, PoolSaturated
+from engine_tuning import load_engine_options
+from game_annotation import GameAnnotator
+
+SESSION_TTL_S = 30 * 60  # Idle games are dropped after this long
+RETRY_AFTER_S = 1
+ANALYSIS_POLLS = 60  # Load test: how long a player waits for its analysis
+ANALYSIS_POLL_S = 0.5
+
+
+class GameSession:
+    """One game against the engine: board, move limit and difficulty"""
+
+    def __init__(self, session_id, board, user_color, max_moves, difficulty):
+        self.id = session_id
+        self.board = board
+        self.user_color = user_color
+        self.max_moves = max_moves  # None means unlimited
+        self.difficulty = difficulty
+        self.move_count = 0  # Engine moves played
+        self.move_history = []
+        self.game_over = False
+        self.game_result = ""
+        self.annotator = None  # Post-game analysis, once requested
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+    def engine_out_of_moves(self):
+        return self.max_moves is not None and self.move_count >= self.max_moves
+
+    def check_after_user_move(self):
+        if self.board.is_checkmate():
+            if self.max_moves is None:
+                self.game_result = "You won! Stockfish couldn't checkmate you!"
+            else:
+                self.game_result = f"You won! Stockfish couldn't mate in {self.max_moves}!"
+            self.game_over = True
+        elif self.board.is_stalemate():
+            self.game_result = "Stalemate!"
+            self.game_over = True
+        elif self.engine_out_of_moves():
+            self.game_result = f"You survived! Stockfish failed to mate in {self.max_moves}!"
+            self.game_over = True
+
+    def check_after_engine_move(self):
+        if self.board.is_checkmate():
+            self.game_result = f"Stockfish wins in {self.move_count} moves!"
+            self.game_over = True
+        elif self.engine_out_of_moves():
+            self.game_result = f"You survived! Stockfish failed to mate in {self.max_moves}!"
+            self.game_over = True
+        elif self.board.is_stalemate():
+            self.game_result = "Stalemate!"
+            self.game_over = True
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "fen": self.board.fen(),
+            "color": "white" if self.user_color == chess.WHITE else "black",
+            "difficulty": self.difficulty,
+            "max_moves": self.max_moves,
+            "engine_moves": self.move_count,
+            "moves": [move.uci() for move in self.move_history],
+            "game_over": self.game_over,
+            "result": self.game_result,
+        }
+
+    def snapshot(self):
+        """to_dict() under the session lock, so a move played on another thread can't change it halfway"""
+        with self.lock:
+            return self.to_dict()
+
+
+class GameServer:
+    """Session registry plus the shared engine scheduler"""
+
+    def __init__(self, scheduler, max_sessions=1000):
+        self.scheduler = scheduler
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def create_session(self, options):
+        board = chess.Board(options.get("fen") or chess.STARTING_FEN)
+        if not board.is_valid():
+            raise ValueError(f"Illegal position: {board.status()!r}")
+        color = options.get("color", "white")
+        if color not in ("white", "black"):
+            raise ValueError("color must be 'white' or 'black'")
+        difficulty = options.get("difficulty", "normal")
+        if difficulty not in DIFFICULTY_PRESETS:
+            raise ValueError(f"difficulty must be one of {', '.join(DIFFICULTY_PRESETS)}")
+        max_moves = options.get("max_moves", 5)
+        if max_moves is not None and (not isinstance(max_moves, int) or max_moves < 1):
+            raise ValueError("max_moves must be a positive integer or null")
+
+        with self.lock:
+            self.expire_sessions()
+            if len(self.sessions) >= self.max_sessions:
+                raise PoolSaturated("too many sessions")
+            session = GameSession(uuid.uuid4().hex[:12], board, color == "white", max_moves, difficulty)
+            self.sessions[session.id] = session
+
+        # The engine moves first when it has the move (unless the position is already over)
+        with session.lock:
+            if board.turn != session.user_color:
+                session.check_after_user_move()
+            if board.turn != session.user_color and not session.game_over:
+                try:
+                    self.engine_move(session)
+                except Exception:
+                    with self.lock:
+                        self.sessions.pop(session.id, None)
+                    raise
+        return session
+
+    def expire_sessions(self):
+        cutoff = time.monotonic() - SESSION_TTL_S
+        for session_id in [sid for sid, s in self.sessions.items() if s.last_used < cutoff]:
+            self.stop_analysis(self.sessions.pop(session_id))
+
+    def get_session(self, session_id):
+        with self.lock:
+            session = self.sessions.get(session_id)
+        if session is not None:
+            session.last_used = time.monotonic()
+        return session
+
+    def delete_session(self, session_id):
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self.stop_analysis(session)
+        return True
+
+    def play_move(self, session, uci):
+        """Apply the user's move and the engine's reply; the user move is undone if the engine doesn't reply"""
+        with session.lock:
+            if session.game_over:
+                raise ValueError("Game is over")
+            if session.board.turn != session.user_color:
+                raise ValueError("Not your turn")
+            try:
+                move = chess.Move.from_uci(uci)
+            except ValueError:
+                raise ValueError(f"Invalid move: {uci}")
+            if move not in session.board.legal_moves:
+                raise ValueError(f"Illegal move: {uci}")
+
+            session.board.push(move)
+            session.move_history.append(move)
+            session.check_after_user_move()
+            if not session.game_over:
+                try:
+                    self.engine_move(session)
+                except Exception:
+                    # Saturated pool, missed deadline, failed engine or no legal reply: keep
+                    # the game consistent so the client can simply retry the same move
+                    session.board.pop()
+                    session.move_history.pop()
+                    raise
+
+    def engine_move(self, session):
+        """Play the engine's reply; raises RuntimeError without touching the board if there is no legal one"""
+        best_move = self.scheduler.search(session.board.fen(), difficulty_limit(session.difficulty),
+                                          session.difficulty, session.id, INTERACTIVE)
+        # The game isn't over here, so None (a cancelled request) is a failed reply too
+        try:
+            move = chess.Move.from_uci(best_move) if best_move else None
+        except ValueError:
+            move = None
+        if move is None or move not in session.board.legal_moves:
+            raise RuntimeError(f"engine replied {best_move!r}, not a legal move")
+        session.board.push(move)
+        session.move_history.append(move)
+        session.move_count += 1
+        session.check_after_engine_move()
+
+    def start_analysis(self, session):
+        """Analyse a game in the background at full strength (interactive moves go first)"""
+        with session.lock:
+            if session.annotator is None:
+                if not session.move_history:
+                    raise ValueError("No moves to analyse")
+                engine = self.scheduler.session_engine(session.id, BACKGROUND, "strongest")
+                session.annotator = GameAnnotator(session.board.root().fen(), session.board.move_stack,
+                                                  engine_color=not session.user_color,
+                                                  max_moves=session.max_moves or float('inf'),
+                                                  engine=engine, report=False)
+            session.annotator.start()  # Also resumes an analysis that failed for lack of engines
+            return session.annotator
+
+    @staticmethod
+    def stop_analysis(session):
+        if session.annotator is not None:
+            session.annotator.close()
+
+    def metrics(self):
+        with self.lock:
+            sessions = len(self.sessions)
+        return dict(self.scheduler.metrics(), sessions=sessions)
+
+
+class GameRequestHandler(BaseHTTPRequestHandler):
+    """JSON HTTP front end for GameServer"""
+
+    server_version = "ChessGameServer/1.0"
+    protocol_version = "HTTP/1.1"  # Keep-alive, so load tests don't pay a connect per request
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        """The request body as a dict ({} without one); anything but a JSON object is a 400"""
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        body = json.loads(self.rfile.read(length))
+        if not isinstance(body, dict):
+            raise ValueError("Request body must be a JSON object")
+        return body
+
+    def route(self):
+        path = urllib.parse.urlsplit(self.path).path  # Ignore any ?query
+        parts = [part for part in path.split("/") if part]
+        game_server = self.server.game_server
+        session = None
+        if len(parts) >= 2 and parts[0] == "games":
+            session = game_server.get_session(parts[1])
+            if session is None:
+                self.send_json(404, {"error": "No such game"})
+                return None, None, None
+        return parts, game_server, session
+
+    def handle_request(self, method):
+        try:
+            parts, game_server, session = self.route()
+            if parts is None:
+                return
+            if method == "GET" and parts == ["metrics"]:
+                self.send_json(200, game_server.metrics())
+            elif method == "POST" and parts == ["games"]:
+                self.send_json(201, game_server.create_session(self.read_json()).snapshot())
+            elif method == "GET" and len(parts) == 2 and parts[0] == "games":
+                self.send_json(200, session.snapshot())
+            elif method == "POST" and len(parts) == 3 and parts[0] == "games" and parts[2] == "move":
+                game_server.play_move(session, self.read_json().get("move", ""))
+                self.send_json(200, session.snapshot())
+            elif method == "POST" and len(parts) == 3 and parts[0] == "games" and parts[2] == "analysis":
+                self.send_json(202, game_server.start_analysis(session).to_dict())
+            elif method == "GET" and len(parts) == 3 and parts[0] == "games" and parts[2] == "analysis":
+                if session.annotator is None:
+                    self.send_json(404, {"error": "No analysis requested"})
+                else:
+                    self.send_json(200, session.annotator.to_dict())
+            elif method == "DELETE" and len(parts) == 2 and parts[0] == "games":
+                game_server.delete_session(session.id)
+                self.send_json(200, {"deleted": session.id})
+            else:
+                self.send_json(404, {"error": "Not found"})
+        except PoolSaturated as e:
+            self.send_json(503, {"error": str(e)}, {"Retry-After": str(RETRY_AFTER_S)})
+        except EngineTimeout as e:
+            self.send_json(504, {"error": str(e)}, {"Retry-After": str(RETRY_AFTER_S)})
+        except (ValueError, json.JSONDecodeError) as e:
+            self.send_json(400, {"error": str(e)})
+        except Exception as e:
+            self.send_json(500, {"error": f"Engine error: {e}"})
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+
+class GameHTTPServer(ThreadingHTTPServer):
+    """Threaded HTTP server with a listen backlog sized for hundreds of clients"""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def make_http_server(game_server, host, port, verbose=False):
+    httpd = GameHTTPServer((host, port), GameRequestHandler)
+    httpd.game_server = game_server
+    httpd.verbose = verbose
+    return httpd
+
+
+def run_load_test(base_url, sessions, moves_per_game, analysis_share=0.0, seed=0):
+    """Play many concurrent random games against the server and report latency and rejections
+
+    A share of the players asks for a post-game analysis and polls it, which
+    adds background engine work competing with everyone's moves.
+    """
+    rng = random.Random(seed)
+    latencies = []
+    counters = {"ok": 0, "rejected": 0, "failed": 0}
+    lock = threading.Lock()
+
+    def call(method, path, payload=None):
+        data = json.dumps(payload).encode() if payload is not None else None
+        request = urllib.request.Request(base_url + path, data=data, method=method,
+                                         headers={"Content-Type": "application/json"})
+        started = time.monotonic()
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                result = json.loads(response.read())
+                status = response.status
+        except urllib.error.HTTPError as e:
+            result, status = json.loads(e.read() or b"{}"), e.code
+        except (urllib.error.URLError, ConnectionError) as e:
+            result, status = {"error": str(e)}, 599
+        with lock:
+            latencies.append((time.monotonic() - started) * 1000)
+            if status == 503:
+                counters["rejected"] += 1
+            elif status >= 400:
+                counters["failed"] += 1
+            else:
+                counters["ok"] += 1
+        return status, result
+
+    def player(seed):
+        player_rng = random.Random(seed)
+        status, game = call("POST", "/games", {"color": "white", "max_moves": None, "difficulty": "easy"})
+        if status != 201:
+            return
+        for _ in range(moves_per_game):
+            if game["game_over"]:
+                break
+            board = chess.Board(game["fen"])
+            move = player_rng.choice(list(board.legal_moves)).uci()
+            status, result = call("POST", f"/games/{game['id']}/move", {"move": move})
+            if status in (503, 504):
+                time.sleep(RETRY_AFTER_S * player_rng.random())
+                continue
+            if status != 200:
+                break
+            game = result
+        if game["moves"] and player_rng.random() < analysis_share:
+            call("POST", f"/games/{game['id']}/analysis")
+            for _ in range(ANALYSIS_POLLS):
+                time.sleep(ANALYSIS_POLL_S)
+                status, analysis = call("GET", f"/games/{game['id']}/analysis")
+                if status != 200 or analysis["done"]:
+                    break
+                if analysis["error"]:
+                    # Background queue was full: resume the analysis where it stopped
+                    call("POST", f"/games/{game['id']}/analysis")
+        call("DELETE", f"/games/{game['id']}")
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=player, args=(rng.random(),)) for _ in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    stats = latency_percentiles(latencies)
+    total = sum(counters.values())
+    print(f"{sessions} sessions, {total} requests in {elapsed:.2f} s ({total / elapsed:.0f} req/s)")
+    print(f"ok {counters['ok']}, rejected (503) {counters['rejected']}, failed {counters['failed']}")
+    print(f"request latency: p50 {stats['p50']:.1f} ms, p95 {stats['p95']:.1f} ms, "
+          f"p99 {stats['p99']:.1f} ms, max {stats['max']:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless multi-session chess game server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--engines", type=int, default=4, help="Engine processes in the shared pool")
+    parser.add_argument("--queue", type=int, default=64, help="Moves allowed to wait for an engine")
+    parser.add_argument("--background-queue", type=int, default=16,
+                        help="Analysis searches allowed to wait for an engine")
+    parser.add_argument("--queue-timeout", type=float, default=5.0, help="Seconds a request may wait")
+    parser.add_argument("--max-sessions", type=int, default=1000)
+    parser.add_argument("--path", help="Engine binary, or 'standin' for the bundled stand-in")
+    parser.add_argument("--config", default=CONFIG_PATH,
+                        help="Configuration file with tuned engine options (see engine_tuning.py)")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    parser.add_argument("--load-test", type=int, metavar="SESSIONS",
+                        help="Start the server, play SESSIONS concurrent games against it and exit")
+    parser.add_argument("--moves", type=int, default=20, help="Moves per game in the load test")
+    parser.add_argument("--analysis-share", type=float, default=0.0,
+                        help="Share of load test games that request a post-game analysis")
+    args = parser.parse_args()
+
+    scheduler = EngineScheduler(args.engines, args.queue, args.background_queue,
+                                paths=[args.path] if args.path else None, queue_timeout=args.queue_timeout,
+                                options=load_engine_options(args.config))
+    game_server = GameServer(scheduler, args.max_sessions)
+    httpd = make_http_server(game_server, args.host, args.port, args.verbose)
+    print(f"Game server listening on http://{args.host}:{httpd.server_port} with {args.engines} engines")
+
+    try:
+        if args.load_test:
+            threading.Thread(target=httpd.serve_forever, daemon=True).start()
+            run_load_test(f"http://{args.host}:{httpd.server_port}", args.load_test, args.moves, args.analysis_share)
+            print(json.dumps(game_server.metrics(), indent=2))
+        else:
+            httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.load_test:
+            httpd.shutdown()
+        httpd.server_close()
+        scheduler.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,18 @@
+import argparse
 import pygame
 import chess
 import chess.engine
 import os
 import sys
-from stockfish import Stockfish
+import threading
+import time
+from collections import deque
+from builtin_engine import BuiltinEngine, builtin_limit
+from engine_backend import (DIFFICULTY_PRESETS, apply_difficulty, difficulty_limit, latency_percentiles, load_config,
+                            open_engine_backend)
+from game_annotation import GameAnnotator
+from game_archive import ArchivedGame, ArchiveWriter
+from position_index import INDEX_PATH, PositionIndex, summarize
 
 # Initialize Pygame
 pygame.init()
@@ -22,12 +31,183 @@ HIGHLIGHT = (255, 255, 0, 128)
 TEXT_COLOR = (255, 255, 255)
 BUTTON_COLOR = (74, 144, 226)
 BUTTON_HOVER = (100, 170, 255)
+PROBLEM_COLOR = (255, 80, 80)
+
+# Engine request deadlines: the preset's deadline (or the clock budget) + slack is a
+# hard wall-clock limit, after which the search is stopped and a fallback move is played
+ENGINE_DEADLINE_SLACK_MS = 300
+ENGINE_STOP_GRACE_MS = 100
+ENGINE_CLOCK_DEADLINE_FRACTION = 0.1  # With clocks, one move may use at most this share of the remaining time
+ENGINE_LATENCY_WINDOW = 200  # Number of recent engine replies kept for percentiles
+
+# The only events the main loop handles; SDL drops everything else before it reaches the queue
+INPUT_EVENTS = [pygame.QUIT, pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP, pygame.MOUSEMOTION, pygame.KEYDOWN]
+INPUT_LATENCY_WINDOW = 1000  # Number of recent clicks/drag frames kept for percentiles
+
+# Finished games are appended here (config.json "archive_path" overrides it)
+ARCHIVE_PATH = "games.cga"
+
+# Built-in time controls: (label, {side: (base seconds, increment seconds)}) or None for no clock
+TIME_CONTROLS = [
+    ("No clock", None),
+    ("1+0", {"user": (60, 0), "engine": (60, 0)}),
+    ("3+2", {"user": (180, 2), "engine": (180, 2)}),
+    ("5+3", {"user": (300, 3), "engine": (300, 3)}),
+    ("10+0", {"user": (600, 0), "engine": (600, 0)}),
+]
+
+# Piece values for the cheap fallback search
+PIECE_VALUES = {chess.PAWN: 1, chess.KNIGHT: 3, chess.BISHOP: 3, chess.ROOK: 5, chess.QUEEN: 9, chess.KING: 0}
+
+# Setup position problems (python-chess status flags) shown before starting a game
+POSITION_PROBLEMS = [
+    (chess.STATUS_TOO_MANY_KINGS, "Too many kings"),
+    (chess.STATUS_TOO_MANY_WHITE_PAWNS, "Too many white pawns"),
+    (chess.STATUS_TOO_MANY_BLACK_PAWNS, "Too many black pawns"),
+    (chess.STATUS_PAWNS_ON_BACKRANK, "Pawns on the back rank"),
+    (chess.STATUS_TOO_MANY_WHITE_PIECES, "Too many white pieces"),
+    (chess.STATUS_TOO_MANY_BLACK_PIECES, "Too many black pieces"),
+    (chess.STATUS_OPPOSITE_CHECK, "Side to move is giving check"),
+    (chess.STATUS_TOO_MANY_CHECKERS, "Too many pieces giving check"),
+    (chess.STATUS_IMPOSSIBLE_CHECK, "Impossible check"),
+]
+# Missing kings are not blocking: ensure_valid_position adds them on start
+MISSING_KING_STATUS = chess.STATUS_NO_WHITE_KING | chess.STATUS_NO_BLACK_KING
+
+PIECE_IMAGE_FILES = {
+    'P': 'Pawn_White.png',    # White Pawn
+    'R': 'Rook_White.png',    # White Rook
+    'N': 'Knight_White.png',  # White Knight
+    'B': 'Bishop_White.png',  # White Bishop
+    'Q': 'Queen_White.png',   # White Queen
+    'K': 'King_White.png',    # White King
+    'p': 'Pawn.png',          # Black Pawn
+    'r': 'Rook.png',          # Black Rook
+    'n': 'Knight.png',        # Black Knight
+    'b': 'Bishop.png',        # Black Bishop
+    'q': 'Queen.png',         # Black Queen
+    'k': 'King.png'           # Black King
+}
+
+def load_piece_images(size):
+    """Piece images by symbol, scaled to size x size (red placeholders for missing files)"""
+    images = {}
+    for piece, filename in PIECE_IMAGE_FILES.items():
+        try:
+            path = os.path.join('Chess_All', filename)
+            img = pygame.image.load(path)
+            img = pygame.transform.scale(img, (size, size))
+            images[piece] = img
+        except pygame.error as e:
+            print(f"Could not load {filename}: {e}")
+            # Create a placeholder
+            surf = pygame.Surface((size, size))
+            surf.fill((255, 0, 0))
+            images[piece] = surf
+    return images
+
+def load_time_controls(config):
+    """Built-in time controls plus any custom ones from the config"""
+    time_controls = list(TIME_CONTROLS)
+    # e.g. {"time_controls": [{"name": "3+2 vs 1+0", "user": [180, 2], "engine": [60, 0]}]}
+    for entry in config.get("time_controls", []):
+        try:
+            sides = {side: (float(entry[side][0]), float(entry[side][1])) for side in ("user", "engine")}
+            time_controls.append((str(entry.get("name", "Custom")), sides))
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            print(f"Ignoring invalid time control {entry}: {e}")
+    return time_controls
+
+class ChessClock:
+    """Two-sided chess clock with per-side base time and increment, driven by time.monotonic()"""
+
+    def __init__(self, white_ms, black_ms, white_inc_ms=0, black_inc_ms=0):
+        self.remaining = {chess.WHITE: white_ms, chess.BLACK: black_ms}
+        self.increment = {chess.WHITE: white_inc_ms, chess.BLACK: black_inc_ms}
+        self.running = None  # Color whose clock is ticking
+        self.turn_started = 0.0
+
+    def start(self, color):
+        """Start the given side's clock"""
+        self.running = color
+        self.turn_started = time.monotonic()
+
+    def stop(self):
+        """Stop the clock, charging the running side for its elapsed time"""
+        if self.running is not None:
+            self.remaining[self.running] = self.time_left(self.running)
+            self.running = None
+
+    def press(self):
+        """End the running side's turn: charge its time, add its increment and start the other side"""
+        color = self.running
+        if color is None:
+            return
+        self.stop()
+        self.remaining[color] += self.increment[color]
+        self.start(not color)
+
+    def time_left(self, color):
+        """Remaining milliseconds for a side, including the running turn"""
+        remaining = self.remaining[color]
+        if color == self.running:
+            remaining -= (time.monotonic() - self.turn_started) * 1000
+        return remaining
+
+    def flagged(self, color):
+        """Whether a side has run out of time"""
+        return self.time_left(color) <= 0
+
+    @staticmethod
+    def format_time(ms):
+        """Format milliseconds as m:ss (with tenths under ten seconds)"""
+        ms = max(0, ms)
+        if ms < 10000:
+            return f"0:{ms / 1000:04.1f}"
+        seconds = int(ms // 1000)
+        return f"{seconds // 60}:{seconds % 60:02d}"
+
+class InputLatency:
+    """Input-to-display latency: from the frame picking an event up to the flip that shows it
+
+    Time the event spent queued before the frame started isn't visible to
+    pygame, so it is left out; it is at most one frame with the queue kept short.
+    """
 
-class ChessGame:
     def __init__(self):
+        self.latencies = {"click": deque(maxlen=INPUT_LATENCY_WINDOW), "drag": deque(maxlen=INPUT_LATENCY_WINDOW)}
+        self.pending = {}  # Kind -> when the oldest event not shown yet was picked up
+        self.motion_events = 0
+        self.coalesced = 0  # Motion events dropped in favour of a later position in the same frame
+
+    def picked_up(self, kind, at):
+        self.pending.setdefault(kind, at)
+
+    def shown(self, at):
+        """A frame was flipped: everything picked up so far is on screen"""
+        for kind, picked_up in self.pending.items():
+            self.latencies[kind].append((at - picked_up) * 1000)
+        self.pending.clear()
+
+    def report(self):
+        lines = []
+        for kind, latencies in self.latencies.items():
+            if latencies:
+                stats = latency_percentiles(list(latencies))
+                lines.append(f"Input latency ({kind}, {len(latencies)} samples): p50 {stats['p50']:.1f} ms, "
+                             f"p95 {stats['p95']:.1f} ms, p99 {stats['p99']:.1f} ms, max {stats['max']:.1f} ms")
+        if self.motion_events:
+            lines.append(f"Mouse motion: {self.coalesced} of {self.motion_events} events coalesced")
+        return "\n".join(lines)
+
+class ChessGame:
+    def __init__(self, config=None, engine=None):
         self.screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
         pygame.display.set_caption("Chess - Drag & Drop vs Stockfish")
         
+        # Optional settings from config.json (a replayed session brings its own)
+        self.config = config if config is not None else load_config()
+        
         # Initialize difficulty mode FIRST (needed for Stockfish initialization)
         self.difficulty_mode = "normal"  # "easy", "normal", "strongest"
         
@@ -54,45 +234,26 @@ class ChessGame:
         self.dragging_from_palette = False
         self.drag_offset = (0, 0)
         
-        # Stockfish setup - using your specific path
-        try:
-            # Try your Stockfish path and common alternatives
-            stockfish_paths = [
-                r"C:\Users\NAV\Downloads\stockfish-windows-x86-64-avx2\stockfish\stockfish-windows-x86-64-avx2.exe",
-                r"C:\Users\NAV\Downloads\stockfish-windows-x86-64-avx2\stockfish\stockfish.exe",
-                r"C:\Users\NAV\Downloads\stockfish-windows-x86-64-avx2\stockfish\stockfish",
-                "stockfish.exe",
-                "stockfish",
-                "./stockfish.exe",
-                "./stockfish"
-            ]
-            
-            self.stockfish = None
-            for path in stockfish_paths:
-                try:
-                    # Configure Stockfish with better initial parameters
-                    self.stockfish = Stockfish(path=path, depth=8, parameters={
-                        "Threads": 2,
-                        "Hash": 32,
-                        "UCI_Elo": 1500,  # Will be updated based on difficulty
-                        "Skill Level": 8   # Will be updated based on difficulty
-                    })
-                    
-                    # Set initial difficulty
-                    self.update_stockfish_difficulty()
-                    print(f"Stockfish 17.1 loaded successfully from: {path}")
-                    break
-                except Exception as e:
-                    print(f"Failed to load from {path}: {e}")
-                    continue
-                    
-            if not self.stockfish:
-                print("Warning: Stockfish not found at any of the expected paths.")
-                print(f"Please ensure stockfish.exe is at: C:\\Users\\NAV\\Downloads\\stockfish-windows-x86-64-avx2\\stockfish\\")
-                
-        except Exception as e:
-            print(f"Error initializing Stockfish: {e}")
-            self.stockfish = None
+        # Stockfish setup: config.json may pick the binary,
+        # or the caller hands an engine in (replays answer from the recording)
+        self.stockfish = engine if engine is not None else self.create_engine()
+        if not self.stockfish:
+            print("Warning: Stockfish not found at any of the expected paths.")
+            print(f"Please ensure stockfish.exe is at: C:\\Users\\NAV\\Downloads\\stockfish-windows-x86-64-avx2\\stockfish\\")
+            print("Playing with the built-in engine instead")
+        
+        # Built-in engine: plays easy mode, and every mode when Stockfish is missing
+        self.builtin_engine = BuiltinEngine()
+        self.update_stockfish_difficulty(self.builtin_engine)
+        
+        # Engine request bookkeeping (deadlines, fallbacks, latency)
+        self.engine_move_cache = {}  # (fen, difficulty) -> uci move from completed searches
+        self.engine_latencies = deque(maxlen=ENGINE_LATENCY_WINDOW)
+        self.engine_restarting = False
+        self.engine_search = None  # The running search of Stockfish's move, see request_engine_move
+        
+        # Input handling timings (reported on exit)
+        self.input_latency = InputLatency()
         
         # Load piece images
         self.piece_images = self.load_piece_images()
@@ -103,6 +264,16 @@ class ChessGame:
         self.drag_pos = (0, 0)
         self.selected_square = None
         
+        # Legal move index for the current position (from-square -> list of moves)
+        # Built lazily and invalidated whenever the position changes
+        self.legal_move_index = None
+        self.promotion_choices = []  # Pending promotion moves waiting for the picker
+        
+        # Setup validation results, refreshed lazily after every setup edit
+        self.position_problems = None
+        self.problem_squares = set()
+        self.missing_kings = False
+        
         # Game state
         self.move_count = 0
         self.max_moves = 5
@@ -114,6 +285,27 @@ class ChessGame:
         self.move_options = ["Unlimited", "5", "6", "7", "8", "9", "10"]
         self.selected_move_option = 1  # Default to "5"
         
+        # Time controls and clocks (no clock by default)
+        self.time_controls = load_time_controls(self.config)
+        self.selected_time_control = 0
+        self.clock = None
+        
+        # Post-game analysis of the last finished game (runs in the background)
+        self.annotator = None
+        self.analyse_finished_games = True  # Off for replays: no analysis engine, nothing archived
+        
+        # Session recording (--record), None unless recording
+        self.recorder = None
+        
+        # Game archive: the finished game is saved once, with its analysis if that completed
+        self.archive_writer = None
+        self.finished_game_headers = None
+        self.game_archived = True
+        
+        # Index of archived positions, opened on first use (config.json "index_path")
+        self.position_index = None
+        self.position_history = None  # Lookup result for the current position, refreshed lazily
+        
         # Undo/Redo functionality
         self.move_history = []  # Stack of moves for undo
         self.redo_history = []  # Stack of moves for redo
@@ -135,6 +327,7 @@ class ChessGame:
             'white': pygame.Rect(BOARD_SIZE + 20, 100, 75, 30),
             'black': pygame.Rect(BOARD_SIZE + 105, 100, 75, 30),
             'move_limit': pygame.Rect(BOARD_SIZE + 20, 140, 160, 30),
+            'time_control': pygame.Rect(BOARD_SIZE + 190, 140, 80, 30),
             'mate_puzzle': pygame.Rect(BOARD_SIZE + 20, 180, 160, 30),
             'reset': pygame.Rect(BOARD_SIZE + 20, 220, 160, 40),
             'clear': pygame.Rect(BOARD_SIZE + 20, 270, 160, 40),
@@ -156,36 +349,7 @@ class ChessGame:
         self.setup_initial_pieces()
 
     def load_piece_images(self):
-        images = {}
-        piece_files = {
-            'P': 'Pawn_White.png',    # White Pawn
-            'R': 'Rook_White.png',    # White Rook
-            'N': 'Knight_White.png',  # White Knight
-            'B': 'Bishop_White.png',  # White Bishop
-            'Q': 'Queen_White.png',   # White Queen
-            'K': 'King_White.png',    # White King
-            'p': 'Pawn.png',          # Black Pawn
-            'r': 'Rook.png',          # Black Rook
-            'n': 'Knight.png',        # Black Knight
-            'b': 'Bishop.png',        # Black Bishop
-            'q': 'Queen.png',         # Black Queen
-            'k': 'King.png'           # Black King
-        }
-        
-        for piece, filename in piece_files.items():
-            try:
-                path = os.path.join('Chess_All', filename)
-                img = pygame.image.load(path)
-                img = pygame.transform.scale(img, (SQUARE_SIZE - 10, SQUARE_SIZE - 10))
-                images[piece] = img
-            except pygame.error as e:
-                print(f"Could not load {filename}: {e}")
-                # Create a placeholder
-                surf = pygame.Surface((SQUARE_SIZE - 10, SQUARE_SIZE - 10))
-                surf.fill((255, 0, 0))
-                images[piece] = surf
-        
-        return images
+        return load_piece_images(SQUARE_SIZE - 10)
 
     def toggle_fullscreen(self):
         """Toggle between fullscreen and windowed mode"""
@@ -205,30 +369,33 @@ class ChessGame:
         pygame.display.iconify()
         print("Window minimized")
 
-    def update_stockfish_difficulty(self):
-        """Update Stockfish parameters based on difficulty mode"""
-        if self.stockfish is None:
+    def create_engine(self):
+        """Start an engine backend, trying the configured path first"""
+        paths = None
+        if self.config.get("stockfish_path"):
+            paths = [self.config["stockfish_path"]]
+        # Threads and Hash tuned for this host by engine_tuning.py, if it was run
+        engine = open_engine_backend("uci", paths, self.config.get("engine_options"))
+        if engine is not None:
+            self.update_stockfish_difficulty(engine)
+        return engine
+
+    def update_stockfish_difficulty(self, engine=None):
+        """Update Stockfish (and built-in engine) parameters based on difficulty mode"""
+        engines = [engine] if engine is not None else [self.stockfish, self.builtin_engine]
+        engines = [engine for engine in engines if engine is not None]
+        if not engines:
             return
             
         print(f"Updating Stockfish to {self.difficulty_mode} mode...")
+        for engine in engines:
+            apply_difficulty(engine, self.difficulty_mode)
             
         if self.difficulty_mode == "easy":
-            # Easy mode: very weak player, makes mistakes
-            self.stockfish.set_skill_level(1)  # Very low skill
-            self.stockfish.set_elo_rating(600)  # Very low rating
-            self.stockfish.set_depth(2)  # Very shallow search
             print("Easy mode: Stockfish will play very weakly")
         elif self.difficulty_mode == "strongest":
-            # Strongest mode: maximum strength, quick checkmates
-            self.stockfish.set_skill_level(20)  # Maximum skill
-            self.stockfish.set_elo_rating(3200)  # Maximum rating
-            self.stockfish.set_depth(15)  # Deeper search for strongest mode
             print("Strongest mode: Stockfish will play at maximum strength")
         else:  # normal mode
-            # Normal mode: balanced
-            self.stockfish.set_skill_level(8)  # Medium skill
-            self.stockfish.set_elo_rating(1500)  # Medium rating
-            self.stockfish.set_depth(6)  # Medium search
             print("Normal mode: Stockfish will play at medium strength")
 
     def setup_initial_pieces(self):
@@ -236,6 +403,7 @@ class ChessGame:
         # Standard starting position
         starting_fen = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
         self.board = chess.Board(starting_fen)
+        self.invalidate_position_caches()
 
     def setup_mate_puzzle(self):
         """Set up a position where Stockfish can deliver mate in 5 or fewer moves"""
@@ -245,6 +413,7 @@ class ChessGame:
         
         try:
             self.board = chess.Board(mate_fen)
+            self.invalidate_position_caches()
             # Set move limit to 5 for the challenge
             self.selected_move_option = 1  # "5" moves
             self.max_moves = 5
@@ -258,6 +427,7 @@ class ChessGame:
             # Fallback to a simpler winning position
             simple_mate_fen = "6k1/5ppp/8/8/8/8/5PPP/4R1K1 w - - 0 1"
             self.board = chess.Board(simple_mate_fen)
+            self.invalidate_position_caches()
             print("Loaded simpler mate puzzle")
 
     def square_to_coords(self, square):
@@ -286,6 +456,26 @@ class ChessGame:
             rank = 7 - (y // SQUARE_SIZE)
         return chess.square(file, rank)
 
+    def invalidate_position_caches(self):
+        """Drop the cached legal move index and validation after the position changes"""
+        self.legal_move_index = None
+        self.promotion_choices = []
+        self.position_problems = None
+        self.position_history = None
+
+    def get_legal_move_index(self):
+        """Get the legal move index for the current position, building it once per position"""
+        if self.legal_move_index is None:
+            index = {}
+            for move in self.board.legal_moves:
+                index.setdefault(move.from_square, []).append(move)
+            self.legal_move_index = index
+        return self.legal_move_index
+
+    def get_legal_moves_from(self, square):
+        """Get all legal moves (including every promotion choice) starting on a square"""
+        return self.get_legal_move_index().get(square, [])
+
     def draw_board(self):
         """Draw the chess board with border"""
         # Draw board border
@@ -440,8 +630,9 @@ class ChessGame:
             note_surface = self.font.render(note_text, True, (150, 150, 150))
             self.screen.blit(note_surface, (BOARD_SIZE + 20, 160))
         
-        # Start button
-        start_color = BUTTON_HOVER if self.user_color is not None else (100, 100, 100)
+        # Start button (disabled until a color is chosen and the setup is valid)
+        can_start = self.user_color is not None and (not self.setup_mode or self.is_position_safe())
+        start_color = BUTTON_HOVER if can_start else (100, 100, 100)
         pygame.draw.rect(self.screen, start_color, self.buttons['start'])
         start_text = self.font.render("Start Game", True, TEXT_COLOR)
         self.screen.blit(start_text, (BOARD_SIZE + 60, 60))
@@ -466,6 +657,14 @@ class ChessGame:
         move_limit_text = self.font.render(move_text, True, TEXT_COLOR)
         self.screen.blit(move_limit_text, (BOARD_SIZE + 25, 147))
         
+        # Time control button
+        pygame.draw.rect(self.screen, BUTTON_COLOR, self.buttons['time_control'])
+        tc_text = self.font.render(self.time_controls[self.selected_time_control][0], True, TEXT_COLOR)
+        self.screen.blit(tc_text, tc_text.get_rect(center=self.buttons['time_control'].center))
+        
+        # Clocks
+        self.draw_clocks()
+        
         # Mate puzzle button
         pygame.draw.rect(self.screen, (255, 140, 0), self.buttons['mate_puzzle'])  # Orange color
         puzzle_text = self.font.render("🎯 Mate in 5 Puzzle", True, TEXT_COLOR)
@@ -524,6 +723,18 @@ class ChessGame:
             if self.game_result:
                 result_surface = self.font.render(self.game_result, True, (255, 255, 0))
                 self.screen.blit(result_surface, (BOARD_SIZE + 20, status_y + 75))
+            
+            self.draw_annotation(status_y + 100)
+        elif self.get_position_problems() or self.missing_kings:
+            # Setup problems replace the instructions until they're fixed
+            header = self.font.render("Position problems:", True, PROBLEM_COLOR)
+            self.screen.blit(header, (BOARD_SIZE + 20, 395))
+            for i, problem in enumerate(self.position_problems):
+                text = self.font.render(f"- {problem}", True, PROBLEM_COLOR)
+                self.screen.blit(text, (BOARD_SIZE + 20, 420 + i * 20))
+            if self.missing_kings:
+                note = self.font.render("Missing kings added on start", True, (255, 255, 0))
+                self.screen.blit(note, (BOARD_SIZE + 20, 420 + len(self.position_problems) * 20))
         else:
             # Instructions
             instructions = [
@@ -540,17 +751,40 @@ class ChessGame:
                 text = self.font.render(line, True, TEXT_COLOR)
                 self.screen.blit(text, (BOARD_SIZE + 20, 320 + i * 25))
 
+    def draw_clocks(self):
+        """Draw both clocks, highlighting the side whose clock is running"""
+        if self.clock is None:
+            return
+
+        engine_color = not self.user_color
+        for i, (label, color) in enumerate((("You", self.user_color), ("SF", engine_color))):
+            time_left = self.clock.time_left(color)
+            if self.clock.running == color:
+                text_color = (255, 80, 80) if time_left < 10000 else (0, 255, 0)
+            else:
+                text_color = TEXT_COLOR
+            text = self.font.render(f"{label} {ChessClock.format_time(time_left)}", True, text_color)
+            self.screen.blit(text, (BOARD_SIZE + 190, 185 + i * 25))
+
     def handle_mouse_down(self, pos):
         """Handle mouse button down events"""
         x, y = pos
         
+        # While Stockfish thinks, only the view buttons work: everything else would change the game under it
+        if self.engine_search is not None:
+            view_buttons = (self.buttons['rotate'], self.bottom_buttons['minimize'], self.bottom_buttons['fullscreen'])
+            if not any(rect.collidepoint(pos) for rect in view_buttons):
+                return
+        
         # Check UI buttons
         if self.buttons['start'].collidepoint(pos):
-            if self.user_color is not None:
+            if self.user_color is None:
+                print("Cannot start game: No color selected!")
+            elif self.setup_mode and not self.is_position_safe():
+                print("Cannot start game: Fix the position problems first!")
+            else:
                 print(f"Starting game as {'White' if self.user_color == chess.WHITE else 'Black'}")
                 self.start_game()
-            else:
-                print("Cannot start game: No color selected!")
         elif self.buttons['white'].collidepoint(pos) and self.setup_mode:
             self.user_color = chess.WHITE
             print("Selected White")
@@ -576,6 +810,10 @@ class ChessGame:
             else:
                 self.max_moves = int(self.move_options[self.selected_move_option])
                 print(f"Selected: {self.max_moves} moves")
+        elif self.buttons['time_control'].collidepoint(pos) and self.setup_mode:
+            # Cycle through time controls
+            self.selected_time_control = (self.selected_time_control + 1) % len(self.time_controls)
+            print(f"Selected time control: {self.time_controls[self.selected_time_control][0]}")
         elif self.buttons['mate_puzzle'].collidepoint(pos) and self.setup_mode:
             print("Setting up Mate in 5 puzzle...")
             self.setup_mate_puzzle()
@@ -608,6 +846,11 @@ class ChessGame:
                     self.toggle_fullscreen()
                     return
         else:
+            # An open promotion picker takes the click before anything else
+            if self.promotion_choices:
+                self.handle_promotion_click(pos)
+                return
+
             # Check for palette piece click first
             palette_piece = self.get_palette_piece_at(pos)
             if palette_piece and self.setup_mode:
@@ -631,6 +874,7 @@ class ChessGame:
                             self.drag_pos = pos
                             # Remove piece from board temporarily
                             self.board.remove_piece_at(square)
+                            self.invalidate_position_caches()
                     elif self.game_started and self.board.turn == self.user_color:
                         # Game mode: make move
                         self.handle_game_move(square)
@@ -648,7 +892,8 @@ class ChessGame:
             elif not self.dragging_from_palette and self.selected_square is not None:
                 # Return piece to original position (only if dragged from board)
                 self.board.set_piece_at(self.selected_square, self.dragged_piece)
-            
+            self.invalidate_position_caches()
+
             # Reset dragging state
             self.dragging = False
             self.dragging_from_palette = False
@@ -660,47 +905,149 @@ class ChessGame:
         if self.dragging:
             self.drag_pos = pos
 
+    def handle_events(self, events):
+        """Handle one frame's events; returns False once the window is closed
+
+        Mouse motion is coalesced: only the latest position before each button
+        event (and at the end of the frame) is handled, so a backed-up queue
+        never replays a drag step by step.
+        """
+        picked_up = time.perf_counter()
+        motion = None
+        for event in events:
+            if event.type == pygame.MOUSEMOTION:
+                self.input_latency.motion_events += 1
+                if motion is not None:
+                    self.input_latency.coalesced += 1
+                motion = event.pos
+                continue
+            if motion is not None:
+                self.handle_coalesced_motion(motion, picked_up)
+                motion = None
+            if event.type == pygame.QUIT:
+                return False
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                self.input_latency.picked_up("click", picked_up)
+                self.handle_mouse_down(event.pos)
+            elif event.type == pygame.MOUSEBUTTONUP:
+                self.input_latency.picked_up("click", picked_up)
+                self.handle_mouse_up(event.pos)
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_a:
+                self.input_latency.picked_up("click", picked_up)
+                self.toggle_annotation()
+        if motion is not None:
+            self.handle_coalesced_motion(motion, picked_up)
+        return True
+
+    def handle_coalesced_motion(self, pos, picked_up):
+        if self.dragging:
+            self.input_latency.picked_up("drag", picked_up)
+        self.handle_mouse_motion(pos)
+
     def handle_game_move(self, square):
         """Handle player moves during the game"""
-        # Simple click-to-move system
+        # Simple click-to-move system, validated against the legal move index
         if self.selected_square is None:
-            # Select piece
-            piece = self.board.piece_at(square)
-            if piece and piece.color == self.user_color:
+            # Select piece (only pieces that actually have a legal move)
+            if self.get_legal_moves_from(square):
                 self.selected_square = square
         else:
-            # Try to make move
-            move = chess.Move(self.selected_square, square)
-            
-            # Check for promotion
-            piece = self.board.piece_at(self.selected_square)
-            if piece and piece.piece_type == chess.PAWN:
-                if (piece.color == chess.WHITE and chess.square_rank(square) == 7) or \
-                   (piece.color == chess.BLACK and chess.square_rank(square) == 0):
-                    move = chess.Move(self.selected_square, square, promotion=chess.QUEEN)
-            
-            if move in self.board.legal_moves:
-                self.board.push(move)
-                self.move_history.append(move)  # Record move for undo
-                self.redo_history.clear()  # Clear redo history when new move is made
-                self.selected_square = None
-                
-                # Check game state
-                if self.board.is_checkmate():
-                    if self.max_moves == float('inf'):
-                        self.game_result = "You won! Stockfish couldn't checkmate you!"
-                    else:
-                        self.game_result = f"You won! Stockfish couldn't mate in {self.max_moves}!"
-                    self.game_over = True
-                elif self.board.is_stalemate():
-                    self.game_result = "Stalemate!"
-                    self.game_over = True
-                else:
-                    # Stockfish's turn
-                    self.make_stockfish_move()
+            # Find the legal moves matching the clicked destination
+            candidates = [move for move in self.get_legal_moves_from(self.selected_square)
+                          if move.to_square == square]
+
+            if len(candidates) > 1:
+                # Several moves share this destination: it's a promotion, let the user pick
+                self.promotion_choices = candidates
+            elif candidates:
+                self.make_user_move(candidates[0])
+            elif self.get_legal_moves_from(square):
+                # Clicked another movable piece: switch selection
+                self.selected_square = square
             else:
                 self.selected_square = None
 
+    def make_user_move(self, move):
+        """Play a validated user move and hand the turn to Stockfish"""
+        self.check_clock_flags()
+        if self.game_over:
+            return
+
+        self.board.push(move)
+        if self.clock is not None:
+            self.clock.press()
+        self.invalidate_position_caches()
+        self.move_history.append(move)  # Record move for undo
+        self.redo_history.clear()  # Clear redo history when new move is made
+        self.selected_square = None
+
+        # Check game state
+        if self.board.is_checkmate():
+            if self.max_moves == float('inf'):
+                self.end_game("You won! Stockfish couldn't checkmate you!")
+            else:
+                self.end_game(f"You won! Stockfish couldn't mate in {self.max_moves}!")
+        elif self.board.is_stalemate():
+            self.end_game("Stalemate!")
+        else:
+            # Stockfish's turn
+            self.make_stockfish_move()
+
+    def get_promotion_picker_rects(self):
+        """Get (rect, move) pairs for the promotion picker, stacked from the target square"""
+        if not self.promotion_choices:
+            return []
+
+        # Queen first, like most chess GUIs
+        order = [chess.QUEEN, chess.ROOK, chess.BISHOP, chess.KNIGHT]
+        moves = sorted(self.promotion_choices, key=lambda move: order.index(move.promotion))
+
+        x, y = self.square_to_coords(moves[0].to_square)
+        step = SQUARE_SIZE if y == 0 else -SQUARE_SIZE  # Grow towards the board centre
+        return [(pygame.Rect(x, y + i * step, SQUARE_SIZE, SQUARE_SIZE), move)
+                for i, move in enumerate(moves)]
+
+    def handle_promotion_click(self, pos):
+        """Pick a promotion piece, or cancel the promotion when clicking elsewhere"""
+        for rect, move in self.get_promotion_picker_rects():
+            if rect.collidepoint(pos):
+                print(f"Promoting to {chess.piece_name(move.promotion)}")
+                self.make_user_move(move)
+                return
+
+        self.promotion_choices = []
+        self.selected_square = None
+
+    def draw_move_hints(self):
+        """Highlight the selected piece and its legal destination squares"""
+        if not self.game_started or self.selected_square is None:
+            return
+
+        x, y = self.square_to_coords(self.selected_square)
+        highlight_surf = pygame.Surface((SQUARE_SIZE, SQUARE_SIZE))
+        highlight_surf.set_alpha(128)
+        highlight_surf.fill((255, 255, 0))
+        self.screen.blit(highlight_surf, (x, y))
+
+        # One dot per destination square (promotions share a square)
+        destinations = {move.to_square for move in self.get_legal_moves_from(self.selected_square)}
+        for square in destinations:
+            x, y = self.square_to_coords(square)
+            center = (x + SQUARE_SIZE // 2, y + SQUARE_SIZE // 2)
+            if self.board.piece_at(square):
+                pygame.draw.circle(self.screen, (60, 160, 60), center, SQUARE_SIZE // 2 - 4, 4)
+            else:
+                pygame.draw.circle(self.screen, (60, 160, 60), center, SQUARE_SIZE // 8)
+
+    def draw_promotion_picker(self):
+        """Draw the promotion piece choices over the board"""
+        for rect, move in self.get_promotion_picker_rects():
+            pygame.draw.rect(self.screen, (230, 230, 230), rect)
+            pygame.draw.rect(self.screen, (90, 90, 90), rect, 2)
+            symbol = chess.Piece(move.promotion, self.board.turn).symbol()
+            if symbol in self.piece_images:
+                self.screen.blit(self.piece_images[symbol], (rect.x + 5, rect.y + 5))
+
     def start_game(self):
         """Start the game with current board position"""
         if self.user_color is None:
@@ -708,19 +1055,221 @@ class ChessGame:
             
         # Ensure position is valid by adding kings if missing
         self.ensure_valid_position()
-            
+
+        # Never hand an illegal position to the engine
+        if not self.is_position_safe():
+            print(f"Cannot start game: {', '.join(self.position_problems)}")
+            return
+
         self.setup_mode = False
         self.game_started = True
         self.show_piece_palette = False  # Hide palette during game
         self.move_count = 0
         self.game_over = False
         self.game_result = ""
+        self.stop_annotation()
+        self.start_clock()
         
         # Set the turn based on user color
         # If user is black, stockfish goes first
         if self.user_color == chess.BLACK:
             self.make_stockfish_move()
             
+    def start_clock(self):
+        """Create the clocks for the selected time control and start the side to move"""
+        label, sides = self.time_controls[self.selected_time_control]
+        if sides is None:
+            self.clock = None
+            return
+
+        (user_base, user_inc), (engine_base, engine_inc) = sides["user"], sides["engine"]
+        if self.user_color == chess.WHITE:
+            self.clock = ChessClock(user_base * 1000, engine_base * 1000, user_inc * 1000, engine_inc * 1000)
+        else:
+            self.clock = ChessClock(engine_base * 1000, user_base * 1000, engine_inc * 1000, user_inc * 1000)
+        self.clock.start(self.board.turn)
+        print(f"Clocks started: {label}")
+
+    def end_game(self, result):
+        """Finish the game with a result and stop the clocks"""
+        self.game_result = result
+        self.game_over = True
+        if self.clock is not None:
+            self.clock.stop()
+
+    def pause_clock(self):
+        """Stop the clocks while stepping through the move history, charging the side that was thinking"""
+        if self.clock is not None:
+            self.clock.stop()
+
+    def resume_clock(self):
+        """Run the user's clock again after an undo or redo (no increment, it isn't a move)
+
+        With Stockfish to move the clocks stay paused: stepping through the history
+        doesn't start a search, so Stockfish's clock only runs once it is asked for a move.
+        """
+        if self.clock is None or self.game_over or not self.game_started:
+            return
+        if self.board.turn == self.user_color:
+            self.clock.start(self.board.turn)
+        self.check_clock_flags()
+
+    def check_clock_flags(self):
+        """End the game when the side to move runs out of time"""
+        if self.clock is None or self.game_over or not self.game_started:
+            return
+
+        if self.clock.flagged(self.user_color):
+            self.end_game("You ran out of time!")
+        elif self.clock.flagged(not self.user_color):
+            self.end_game("Stockfish ran out of time!")
+        if self.game_over:
+            print(self.game_result)
+
+    def start_annotation(self):
+        """Analyse the game that just finished in the background"""
+        if (self.annotator is not None or not self.analyse_finished_games or not self.game_started
+                or not self.board.move_stack):
+            return
+        # Undo may have taken moves back: annotate what's on the board now
+        self.annotator = GameAnnotator(self.board.root().fen(), self.board.move_stack,
+                                       engine_color=not self.user_color, max_moves=self.max_moves,
+                                       paths=[self.config["stockfish_path"]] if self.config.get("stockfish_path") else None,
+                                       engine=BuiltinEngine() if self.stockfish is None else None,
+                                       options=self.config.get("engine_options"))
+        print(f"Analysing the game ({len(self.annotator.moves)} moves), press A to pause")
+        self.annotator.start()
+        self.finished_game_headers = self.get_game_headers()
+        self.game_archived = False
+
+    def stop_annotation(self):
+        """Drop the previous game's analysis without waiting for its engine"""
+        self.archive_game()
+        annotator, self.annotator = self.annotator, None
+        if annotator is not None:
+            threading.Thread(target=annotator.close, daemon=True).start()
+
+    def toggle_annotation(self):
+        """Pause or resume the post-game analysis"""
+        if self.annotator is None or self.annotator.done:
+            return
+        if self.annotator.running:
+            self.annotator.cancel()
+            print("Analysis paused")
+        else:
+            self.annotator.resume()
+            print("Analysis resumed")
+
+    def get_game_headers(self):
+        """PGN-style headers describing the game that just finished"""
+        you, engine = "You", "Stockfish"
+        return {
+            "Event": "Chess vs Stockfish",
+            "Date": time.strftime("%Y.%m.%d"),
+            "White": you if self.user_color == chess.WHITE else engine,
+            "Black": engine if self.user_color == chess.WHITE else you,
+            "Result": self.board.result(),
+            "Difficulty": self.difficulty_mode,
+            "MoveLimit": "Unlimited" if self.max_moves == float('inf') else str(int(self.max_moves)),
+            "TimeControl": self.time_controls[self.selected_time_control][0],
+            "Termination": self.game_result,
+        }
+
+    def archive_game(self):
+        """Save the finished game to the archive, with the analysis scores if the analysis completed"""
+        annotator = self.annotator
+        if annotator is None or self.game_archived:
+            return
+        self.game_archived = True
+
+        scores = None
+        if annotator.done:
+            # Score of the position after each move
+            scores = [annotator.scores[ply + 1] for ply in range(len(annotator.moves))]
+        game = ArchivedGame(self.finished_game_headers, annotator.starting_fen, annotator.moves, scores)
+        path = self.config.get("archive_path", ARCHIVE_PATH)
+        try:
+            if self.archive_writer is None:
+                self.archive_writer = ArchiveWriter(path)
+            game_id = self.archive_writer.write(game)
+            self.archive_writer.flush()  # One block per game, nothing is lost if the game crashes
+            print(f"Game saved to {path} (#{game_id})")
+        except (OSError, ValueError) as e:
+            print(f"Could not save the game to {path}: {e}")
+            return
+
+        index = self.get_position_index()
+        if index is not None:
+            index.add_game(game_id, game)
+            self.position_history = None
+
+    def get_position_index(self):
+        """Open the position index on first use (None if it can't be opened)"""
+        if self.position_index is None:
+            path = self.config.get("index_path", INDEX_PATH)
+            try:
+                self.position_index = PositionIndex(path)
+            except (OSError, ValueError) as e:
+                print(f"Position index unavailable ({path}): {e}")
+                self.position_index = False  # Don't retry every frame
+        return self.position_index or None
+
+    def get_position_history(self):
+        """Archived games that reached the current position: (times seen, result counts, moves played)"""
+        if self.position_history is None:
+            index = self.get_position_index()
+            entries = index.lookup(self.board) if index is not None else []
+            results, moves = summarize(entries)
+            self.position_history = (len(entries), results, moves)
+        return self.position_history
+
+    def draw_position_history(self, y):
+        """Draw how often the setup position was reached before, the results and the moves played"""
+        seen, results, moves = self.get_position_history()
+        if not seen:
+            text = self.font.render("Position not seen before", True, (150, 150, 150))
+            self.screen.blit(text, (BOARD_SIZE + 20, y))
+            return
+
+        lines = [f"Seen {seen}x before", " ".join(f"{result} x{count}" for result, count in results.most_common())]
+        legal_moves = self.get_legal_move_index() if self.is_position_safe() else {}
+        for move, count, engine_move in moves[:4]:
+            # Hash collisions are possible: only name moves that are legal here
+            if move not in legal_moves.get(move.from_square, ()):
+                continue
+            who = "Stockfish" if engine_move else "Played"
+            lines.append(f"{who}: {self.board.san(move)} x{count}")
+        for i, line in enumerate(lines):
+            self.screen.blit(self.font.render(line, True, (0, 255, 255)), (BOARD_SIZE + 20, y + i * 22))
+
+    def draw_annotation(self, y):
+        """Draw analysis progress, then the flagged moves of both sides"""
+        annotator = self.annotator
+        if annotator is None:
+            return
+
+        if not annotator.done:
+            if annotator.error is not None:
+                status = "Analysis failed"
+            elif annotator.running:
+                status = f"Analysing: {len(annotator.scores)}/{annotator.total} positions"
+            else:
+                status = "Analysis paused (A to resume)"
+            self.screen.blit(self.font.render(status, True, (150, 150, 150)), (BOARD_SIZE + 20, y))
+            return
+
+        lines = []
+        for label, color in (("You", self.user_color), ("SF", not self.user_color)):
+            counts = annotator.counts(color)
+            lines.append(f"{label}: {counts['blunder']}?? {counts['mistake']}? {counts['inaccuracy']}?! "
+                         f"{counts['missed mate']} missed mates")
+        for annotation in annotator.annotations:
+            if annotation.missed_mate and annotation.color != self.user_color:
+                limit_note = " (in limit)" if annotation.mate_within_limit else ""
+                lines.append(f"SF {annotation.san}: missed M{annotation.missed_mate}{limit_note}")
+        for i, line in enumerate(lines[:6]):
+            self.screen.blit(self.font.render(line, True, (0, 255, 255)), (BOARD_SIZE + 20, y + i * 22))
+
     def ensure_valid_position(self):
         """Ensure the position has kings and is valid"""
         # Check if kings exist
@@ -746,86 +1295,315 @@ class ChessGame:
                     print(f"Added black king at {chess.square_name(square)}")
                     break
 
+        self.invalidate_position_caches()
+
+    def fix_setup_rights(self):
+        """Drop castling and en passant rights that the current setup can't support"""
+        clean_rights = self.board.clean_castling_rights()
+        if clean_rights != self.board.castling_rights:
+            self.board.castling_rights = clean_rights
+            self.legal_move_index = None
+            print("Removed impossible castling rights")
+
+        if self.board.ep_square is not None and not self.board.has_legal_en_passant():
+            self.board.ep_square = None
+            self.legal_move_index = None
+            print("Removed impossible en passant square")
+
+    def get_position_problems(self):
+        """Validate the setup position once per edit and return the blocking problems"""
+        if self.position_problems is not None:
+            return self.position_problems
+
+        self.fix_setup_rights()
+        status = self.board.status()
+
+        self.position_problems = [message for flag, message in POSITION_PROBLEMS if status & flag]
+        self.missing_kings = bool(status & MISSING_KING_STATUS)
+
+        # Remember the offending squares so they can be marked on the board
+        self.problem_squares = set()
+        if status & chess.STATUS_PAWNS_ON_BACKRANK:
+            self.problem_squares |= set(self.board.pieces(chess.PAWN, chess.WHITE) & chess.BB_BACKRANKS)
+            self.problem_squares |= set(self.board.pieces(chess.PAWN, chess.BLACK) & chess.BB_BACKRANKS)
+        if status & chess.STATUS_OPPOSITE_CHECK:
+            king = self.board.king(not self.board.turn)
+            self.problem_squares |= set(self.board.attackers(self.board.turn, king))
+            self.problem_squares.add(king)
+        if status & (chess.STATUS_TOO_MANY_CHECKERS | chess.STATUS_IMPOSSIBLE_CHECK):
+            self.problem_squares |= set(self.board.checkers())
+
+        if self.position_problems:
+            print(f"Setup position problems: {', '.join(self.position_problems)}")
+        return self.position_problems
+
+    def is_position_safe(self):
+        """Whether the position can be handed to the engine (missing kings are added on start)"""
+        return not self.get_position_problems()
+
+    def draw_problem_squares(self):
+        """Mark squares involved in setup problems"""
+        if not self.setup_mode or not self.get_position_problems():
+            return
+
+        for square in self.problem_squares:
+            x, y = self.square_to_coords(square)
+            pygame.draw.rect(self.screen, PROBLEM_COLOR, (x, y, SQUARE_SIZE, SQUARE_SIZE), 4)
+
     def make_stockfish_move(self):
-        """Make a move with Stockfish"""
-        if self.stockfish is None or self.game_over or (self.max_moves != float('inf') and self.move_count >= self.max_moves):
+        """Start Stockfish's move; poll_engine_move plays it once the search is done"""
+        if self.game_over or (self.max_moves != float('inf') and self.move_count >= self.max_moves):
             if self.max_moves != float('inf') and self.move_count >= self.max_moves and not self.board.is_checkmate():
-                self.game_result = f"You survived! Stockfish failed to mate in {int(self.max_moves)}!"
-                self.game_over = True
+                self.end_game(f"You survived! Stockfish failed to mate in {int(self.max_moves)}!")
             return
-        
+
+        # After stepping through the history the clocks may be paused with Stockfish to move
+        if self.clock is not None and self.clock.running is None:
+            self.clock.start(self.board.turn)
+
         try:
-            # Set the current position directly (position should be valid now)
-            self.stockfish.set_fen_position(self.board.fen())
-            
-            # Get best move based on difficulty with time limits for responsiveness
+            # Get best move based on difficulty (a fixed node budget per move)
             if self.difficulty_mode == "strongest":
-                # In strongest mode, give more time for maximum strength
                 print("Strongest mode: Stockfish thinking deeply...")
-                best_move = self.stockfish.get_best_move_time(2000)  # 2 seconds max for maximum strength
             elif self.difficulty_mode == "easy":
-                # In easy mode, very quick thinking
                 print("Easy mode: Stockfish thinking quickly...")
-                best_move = self.stockfish.get_best_move_time(200)  # 0.2 seconds max
             else:
-                # Normal mode
                 print("Normal mode: Stockfish thinking...")
-                best_move = self.stockfish.get_best_move_time(500)  # 0.5 seconds max
-            
-            if best_move and best_move != "None":
-                move = chess.Move.from_uci(best_move)
-                if move in self.board.legal_moves:
-                    self.board.push(move)
-                    self.move_history.append(move)  # Record Stockfish move for undo
-                    self.redo_history.clear()  # Clear redo history when new move is made
-                    self.move_count += 1
-                    
-                    # Check game state
-                    if self.board.is_checkmate():
-                        self.game_result = f"Stockfish wins in {self.move_count} moves!"
-                        self.game_over = True
-                    elif self.max_moves != float('inf') and self.move_count >= self.max_moves:
-                        if not self.board.is_checkmate():
-                            self.game_result = f"You survived! Stockfish failed to mate in {int(self.max_moves)}!"
-                        self.game_over = True
-                    elif self.board.is_stalemate():
-                        self.game_result = "Stalemate!"
-                        self.game_over = True
-                        
+            self.request_engine_move()
         except Exception as e:
             print(f"Stockfish error: {e}")
-            # Try to restart Stockfish if it crashed
+            self.recycle_stockfish()
+
+    def play_engine_move(self, best_move):
+        """Play the engine's reply and check the game state"""
+        if self.recorder is not None:
+            self.recorder.record_engine_reply(self.board.fen(), best_move)
+        
+        # Stockfish may have used up its clock while thinking
+        self.check_clock_flags()
+        if self.game_over:
+            return
+        
+        if best_move and best_move != "None":
+            move = chess.Move.from_uci(best_move)
+            if move in self.board.legal_moves:
+                self.board.push(move)
+                if self.clock is not None:
+                    self.clock.press()
+                self.invalidate_position_caches()
+                self.move_history.append(move)  # Record Stockfish move for undo
+                self.redo_history.clear()  # Clear redo history when new move is made
+                self.move_count += 1
+                
+                # Check game state
+                if self.board.is_checkmate():
+                    self.end_game(f"Stockfish wins in {self.move_count} moves!")
+                elif self.max_moves != float('inf') and self.move_count >= self.max_moves:
+                    self.end_game(f"You survived! Stockfish failed to mate in {int(self.max_moves)}!")
+                elif self.board.is_stalemate():
+                    self.end_game("Stalemate!")
+
+    def request_engine_move(self):
+        """Start the engine's search in a worker under a hard deadline
+
+        The window keeps running while the engine thinks: poll_engine_move
+        plays the reply once it is in, or a fallback move once the deadline
+        has passed.
+        """
+        fen = self.board.fen()
+        engine = self.get_move_engine()
+        pending = {"fen": fen, "cache_key": (fen, self.difficulty_mode), "engine": engine,
+                   "started": time.monotonic(), "worker": None, "stopped_at": None,
+                   "search": {"best_move": None, "pv_move": None, "done": False, "error": None}}
+        self.engine_search = pending
+
+        if engine is None:
+            # Engine is being recycled: don't wait for it
+            self.poll_engine_move()
+            return
+
+        limit, pending["deadline_ms"] = self.get_engine_limit(engine)
+        pending["deadline"] = pending["started"] + pending["deadline_ms"] / 1000
+        # The search runs in a worker so the deadline can't be overrun by a stalled engine
+        engine.begin_search()
+        pending["worker"] = threading.Thread(target=self.run_engine_search, args=(engine, fen, limit, pending["search"]),
+                                             daemon=True)
+        pending["worker"].start()
+
+    def poll_engine_move(self):
+        """Play the engine's reply once it is in; stop the search at its deadline (called every frame)"""
+        pending = self.engine_search
+        if pending is None:
+            return
+        engine, search, worker = pending["engine"], pending["search"], pending["worker"]
+
+        if worker is not None and worker.is_alive():
+            now = time.monotonic()
+            if pending["stopped_at"] is None:
+                if now < pending["deadline"] and not self.game_over:
+                    return
+                if not self.game_over:
+                    print(f"Stockfish missed its {pending['deadline_ms']:.0f} ms deadline, stopping search")
+                try:
+                    engine.stop()
+                except Exception as e:
+                    print(f"Could not stop Stockfish: {e}")
+                pending["stopped_at"] = now
+                return
+            if now - pending["stopped_at"] < ENGINE_STOP_GRACE_MS / 1000:
+                return
+        self.engine_search = None
+
+        if search["done"]:
+            best_move = search["best_move"]
+            if best_move:
+                self.engine_move_cache[pending["cache_key"]] = best_move
+        else:
+            # Stalled or crashed: answer now, replace the engine in the background
+            if search["error"] is not None:
+                print(f"Stockfish error: {search['error']}")
+            best_move = self.get_fallback_move(pending["cache_key"], search["pv_move"])
+            if engine is not None and engine is not self.builtin_engine:
+                self.recycle_stockfish()
+        self.record_engine_latency(pending["started"])
+
+        try:
+            self.play_engine_move(best_move)
+        except Exception as e:
+            print(f"Stockfish error: {e}")
+            self.recycle_stockfish()
+
+    def wait_for_engine_move(self):
+        """Block until a pending engine reply has been played (replays: the next input came after it)"""
+        while self.engine_search is not None:
+            worker = self.engine_search["worker"]
+            if worker is not None:
+                worker.join(ENGINE_STOP_GRACE_MS / 1000)
+            self.poll_engine_move()
+
+    def get_move_engine(self):
+        """Engine for the next move: the built-in one in easy mode or without Stockfish
+
+        While Stockfish is being restarted there is none (the fallback move is
+        played instead of waiting for it).
+        """
+        if self.difficulty_mode == "easy":
+            return self.builtin_engine
+        if self.engine_restarting:
+            return None
+        return self.stockfish or self.builtin_engine
+
+    def get_engine_limit(self, engine):
+        """Build the search limit and its hard deadline in ms
+
+        Stockfish searches the difficulty's node budget, the built-in engine its
+        depth. With a clock they also manage their own time from
+        wtime/btime/winc/binc and the deadline caps a single move at a share of
+        the remaining time.
+        """
+        preset = DIFFICULTY_PRESETS[self.difficulty_mode]
+        builtin = engine is self.builtin_engine
+        if self.clock is None:
+            limit = builtin_limit(self.difficulty_mode) if builtin else difficulty_limit(self.difficulty_mode)
+            return limit, preset["deadline_ms"] + ENGINE_DEADLINE_SLACK_MS
+
+        limit = chess.engine.Limit(
+            depth=preset["builtin_depth"] if builtin else None,
+            nodes=None if builtin else preset["nodes"],
+            white_clock=max(1, self.clock.time_left(chess.WHITE)) / 1000,
+            black_clock=max(1, self.clock.time_left(chess.BLACK)) / 1000,
+            white_inc=self.clock.increment[chess.WHITE] / 1000,
+            black_inc=self.clock.increment[chess.BLACK] / 1000,
+        )
+        engine_time = max(0, self.clock.time_left(self.board.turn))
+        move_budget = engine_time * ENGINE_CLOCK_DEADLINE_FRACTION + self.clock.increment[self.board.turn]
+        return limit, min(engine_time, move_budget) + ENGINE_DEADLINE_SLACK_MS
+
+    def run_engine_search(self, engine, fen, limit, search):
+        """Worker: run a search, remembering the best move of the last completed depth"""
+        def on_info(info):
+            # Bound lines come from an unfinished iteration; only exact scores count
+            if info.get("pv") and not info.get("lowerbound") and not info.get("upperbound"):
+                search["pv_move"] = info["pv"][0].uci()
+
+        try:
+            search["best_move"] = engine.search(fen, limit, on_info)
+            search["done"] = True
+        except Exception as e:
+            search["error"] = e
+
+    def get_fallback_move(self, cache_key, pv_move):
+        """Pick a move without the engine: cached result, last completed depth, then a cheap search"""
+        legal_moves = list(self.board.legal_moves)
+        for candidate, source in ((self.engine_move_cache.get(cache_key), "cached result"),
+                                  (pv_move, "last completed depth")):
+            if candidate and chess.Move.from_uci(candidate) in legal_moves:
+                print(f"Using fallback move {candidate} ({source})")
+                return candidate
+
+        move = self.quick_search_move()
+        if move is not None:
+            print(f"Using fallback move {move.uci()} (quick search)")
+            return move.uci()
+        return None
+
+    def quick_search_move(self):
+        """Cheap one-ply search: mate if possible, otherwise the best material balance"""
+        best_move = None
+        best_score = None
+        for move in self.board.legal_moves:
+            self.board.push(move)
+            if self.board.is_checkmate():
+                self.board.pop()
+                return move
+            score = 0
+            for piece in self.board.piece_map().values():
+                value = PIECE_VALUES[piece.piece_type]
+                score += value if piece.color != self.board.turn else -value
+            if self.board.is_check():
+                score += 0.5  # Prefer forcing moves when material is equal
+            self.board.pop()
+            if best_score is None or score > best_score:
+                best_move, best_score = move, score
+        return best_move
+
+    def record_engine_latency(self, started):
+        """Record how long an engine request took and report the running percentiles"""
+        self.engine_latencies.append((time.monotonic() - started) * 1000)
+        stats = latency_percentiles(list(self.engine_latencies))
+        print(f"Engine reply latency: p50 {stats['p50']:.0f} ms, p95 {stats['p95']:.0f} ms, "
+              f"max {stats['max']:.0f} ms")
+
+    def recycle_stockfish(self):
+        """Kill the current engine and start a new one without blocking the game"""
+        if self.engine_restarting:
+            return
+        self.engine_restarting = True
+        old_engine, self.stockfish = self.stockfish, None
+
+        def restart():
             try:
-                self.restart_stockfish()
-            except:
-                print("Failed to restart Stockfish")
-                self.stockfish = None
+                if old_engine is not None:
+                    old_engine.kill()
+            except Exception:
+                pass
+            try:
+                if not self.restart_stockfish():
+                    print("Failed to restart Stockfish")
+            finally:
+                self.engine_restarting = False
+
+        threading.Thread(target=restart, daemon=True).start()
 
     def restart_stockfish(self):
         """Restart Stockfish if it crashes"""
         print("Attempting to restart Stockfish...")
-        stockfish_paths = [
-            r"C:\Users\NAV\Downloads\stockfish-windows-x86-64-avx2\stockfish\stockfish-windows-x86-64-avx2.exe",
-            r"C:\Users\NAV\Downloads\stockfish-windows-x86-64-avx2\stockfish\stockfish.exe",
-            "stockfish.exe",
-            "stockfish"
-        ]
-        
-        for path in stockfish_paths:
-            try:
-                self.stockfish = Stockfish(path=path, depth=8, parameters={
-                    "Threads": 2,
-                    "Hash": 32,
-                    "UCI_Elo": 1500,  # Will be updated based on difficulty
-                    "Skill Level": 8   # Will be updated based on difficulty
-                })
-                # Update to current difficulty mode
-                self.update_stockfish_difficulty()
-                print(f"Stockfish restarted successfully from: {path}")
-                return True
-            except Exception as e:
-                continue
-        return False
+        engine = self.create_engine()
+        if engine is None:
+            return False
+        self.stockfish = engine
+        print(f"Stockfish restarted successfully from: {engine.path}")
+        return True
 
     def reset_board(self):
         """Reset to starting position"""
@@ -835,14 +1613,17 @@ class ChessGame:
         self.game_over = False
         self.game_result = ""
         self.move_count = 0
+        self.clock = None
 
     def clear_board(self):
         """Clear all pieces from board and show piece palette"""
         self.board.clear()
+        self.invalidate_position_caches()
         self.setup_mode = True
         self.game_started = False
         self.game_over = False
         self.game_result = ""
+        self.clock = None
         self.show_piece_palette = True
         
     def undo_move(self):
@@ -859,11 +1640,15 @@ class ChessGame:
         
         # Undo the move on the board
         try:
+            self.pause_clock()
             self.board.pop()  # chess.Board.pop() undoes the last move
+            self.invalidate_position_caches()
+            self.selected_square = None
             self.move_count = max(0, self.move_count - 1)
             print(f"Undid move: {last_move}")
         except Exception as e:
             print(f"Error undoing move: {e}")
+        self.resume_clock()
             
     def redo_move(self):
         """Redo the last undone move"""
@@ -879,11 +1664,15 @@ class ChessGame:
         
         # Apply the move to the board
         try:
+            self.pause_clock()
             self.board.push(move)
+            self.invalidate_position_caches()
+            self.selected_square = None
             self.move_count += 1
             print(f"Redid move: {move}")
         except Exception as e:
             print(f"Error redoing move: {e}")
+        self.resume_clock()
 
     def draw_dragged_piece(self):
         """Draw the piece being dragged"""
@@ -969,51 +1758,120 @@ class ChessGame:
         moves_surface = self.font.render(moves_info, True, TEXT_COLOR)
         self.screen.blit(moves_surface, (20, BOARD_SIZE + 95))
         
+        # Time control info
+        tc_info = f"Time control: {self.time_controls[self.selected_time_control][0]}"
+        tc_surface = self.font.render(tc_info, True, TEXT_COLOR)
+        self.screen.blit(tc_surface, (20, BOARD_SIZE + 145))
+        
         # User moves info
         user_moves_info = "You have unlimited moves!"
         user_moves_surface = self.font.render(user_moves_info, True, (0, 255, 255))
         self.screen.blit(user_moves_surface, (20, BOARD_SIZE + 120))
 
+        # Earlier games that reached the setup position: right of the controls, clear of the piece palette
+        if not self.game_started and not (self.get_position_problems() or self.missing_kings):
+            self.draw_position_history(BOARD_SIZE + 20)
+
     def run(self):
         """Main game loop"""
         clock = pygame.time.Clock()
         running = True
         
+        # Window, text input, joystick... events are never looked at: don't queue them
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed(INPUT_EVENTS)
+        
         while running:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    running = False
-                elif event.type == pygame.MOUSEBUTTONDOWN:
-                    self.handle_mouse_down(event.pos)
-                elif event.type == pygame.MOUSEBUTTONUP:
-                    self.handle_mouse_up(event.pos)
-                elif event.type == pygame.MOUSEMOTION:
-                    self.handle_mouse_motion(event.pos)
-            
-            # Clear screen
-            self.screen.fill((40, 40, 40))
-            
-            # Draw everything
-            self.draw_board()
-            self.draw_pieces()
-            self.draw_ui()
-            self.draw_piece_palette()
-            self.draw_dragged_piece()
-            self.draw_bottom_panel()  # Add bottom panel
-            
-            # Highlight selected square in game mode
-            if self.game_started and self.selected_square is not None:
-                x, y = self.square_to_coords(self.selected_square)
-                highlight_surf = pygame.Surface((SQUARE_SIZE, SQUARE_SIZE))
-                highlight_surf.set_alpha(128)
-                highlight_surf.fill((255, 255, 0))
-                self.screen.blit(highlight_surf, (x, y))
-            
-            pygame.display.flip()
+            events = pygame.event.get()
+            if self.recorder is not None:
+                self.recorder.record_events(events)
+            running = self.handle_events(events)
+            self.update()
+            self.draw_frame()
+            self.input_latency.shown(time.perf_counter())
             clock.tick(60)
         
+        report = self.input_latency.report()
+        if report:
+            print(report)
+        if self.recorder is not None:
+            self.recorder.close(self.board)
+        self.shutdown()
+
+    def update(self):
+        """Per-frame work that doesn't depend on input"""
+        # Flag fall is checked every frame
+        self.check_clock_flags()
+        
+        # Stockfish's move is played once its search is done (or stopped at the deadline)
+        self.poll_engine_move()
+        
+        # A finished game is analysed in the background, then archived
+        if self.game_over:
+            self.start_annotation()
+        if self.annotator is not None and self.annotator.done:
+            self.archive_game()
+
+    def draw_frame(self):
+        """Draw everything and show it"""
+        # Clear screen
+        self.screen.fill((40, 40, 40))
+        
+        # Draw everything
+        self.draw_board()
+        self.draw_problem_squares()
+        self.draw_pieces()
+        self.draw_ui()
+        self.draw_piece_palette()
+        self.draw_dragged_piece()
+        self.draw_bottom_panel()  # Add bottom panel
+        
+        # Highlight selected square and legal destinations in game mode
+        self.draw_move_hints()
+        self.draw_promotion_picker()
+        
+        pygame.display.flip()
+
+    def shutdown(self):
+        """Save the last game and close engines, files and the window"""
+        if self.engine_search is not None and self.engine_search["worker"] is not None:
+            self.engine_search["engine"].stop()
+            self.engine_search["worker"].join(ENGINE_STOP_GRACE_MS / 1000)
+        self.archive_game()
+        if self.archive_writer is not None:
+            self.archive_writer.close()
+        if self.position_index:
+            self.position_index.close()
+        if self.annotator is not None:
+            self.annotator.close()
+        if self.stockfish is not None:
+            self.stockfish.close()
         pygame.quit()
 
+def main():
+    parser = argparse.ArgumentParser(description="Chess - Drag & Drop vs Stockfish")
+    parser.add_argument("--profile", nargs="?", const="profile.folded", metavar="PATH",
+                        help="Sample where the time goes and write collapsed stacks (flame graph input) on exit")
+    parser.add_argument("--record", metavar="PATH",
+                        help="Record input events and engine replies for session_replay.py")
+    args = parser.parse_args()
+
+    # Only imported when asked for: without --profile nothing is sampled or hooked
+    profiler = None
+    if args.profile:
+        from profiling import SamplingProfiler
+        profiler = SamplingProfiler()
+        profiler.start()
+    try:
+        game = ChessGame()
+        if args.record:
+            from session_replay import SessionRecorder
+            game.recorder = SessionRecorder(args.record, game.config, INPUT_EVENTS)
+        game.run()
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            profiler.save(args.profile)
+
 if __name__ == "__main__":
-    game = ChessGame()
-    game.run()
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+On-disk index from positions to the archived games they occurred in.
+
+Positions are keyed by their 64-bit Zobrist (Polyglot) hash. Each entry is a
+16-byte record: hash, game id, the move played from the position and a packed
+info field (ply, game result, whether Stockfish made that move), so a lookup
+answers "seen before, what was played, how did it end" without opening the
+archive.
+
+The index is a sorted file searched by binary search over an mmap, plus an
+append-only log of recently added games kept in memory. When the log grows
+past COMPACT_RECORDS it is merged into the sorted file.
+
+    python position_index.py build games.cga
+    python position_index.py lookup "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1"
+"""
+
+import argparse
+import heapq
+import mmap
+import os
+import struct
+import time
+from collections import Counter
+
+import chess
+import chess.polyglot
+
+from game_archive import decode_move, encode_move, read_games
+
+INDEX_PATH = "positions.idx"
+INDEX_MAGIC = b"CHPI"
+RECORD = struct.Struct("<QIHH")  # hash, game id, move, info
+HASH = struct.Struct("<Q")
+HEADER_SIZE = len(INDEX_MAGIC)
+COMPACT_RECORDS = 200000  # Log records merged into the sorted file at this size
+
+# Info field: ply (12 bits), result (2 bits), Stockfish made the move (1 bit)
+MAX_PLY = (1 << 12) - 1
+RESULT_CODES = {"*": 0, "1-0": 1, "0-1": 2, "1/2-1/2": 3}
+RESULT_NAMES = {code: name for name, code in RESULT_CODES.items()}
+
+
+def position_key(board):
+    return chess.polyglot.zobrist_hash(board)
+
+
+class PositionEntry:
+    """One occurrence of a position in an archived game"""
+
+    def __init__(self, game_id, ply, move, result, engine_move):
+        self.game_id = game_id
+        self.ply = ply
+        self.move = move  # Move played from the position (None if the game ended there)
+        self.result = result  # "1-0", "0-1", "1/2-1/2" or "*"
+        self.engine_move = engine_move  # The move was Stockfish's
+
+    @classmethod
+    def unpack(cls, game_id, move_code, info):
+        move = decode_move(move_code) if move_code else None
+        return cls(game_id, info & MAX_PLY, move, RESULT_NAMES[(info >> 12) & 3], bool(info >> 14 & 1))
+
+
+def game_records(game_id, game):
+    """Index records (hash, game id, move code, info) for every position of an archived game"""
+    result = RESULT_CODES.get(game.headers.get("Result", "*"), 0)
+    engine_colors = {color for color, name in ((chess.WHITE, game.headers.get("White")),
+                                                (chess.BLACK, game.headers.get("Black")))
+                     if name == "Stockfish"}
+    board = chess.Board(game.starting_fen)
+    records = []
+    for ply in range(len(game.moves) + 1):
+        move = game.moves[ply] if ply < len(game.moves) else None
+        engine_move = move is not None and board.turn in engine_colors
+        info = min(ply, MAX_PLY) | result << 12 | engine_move << 14
+        records.append((position_key(board), game_id, encode_move(move) if move else 0, info))
+        if move is not None:
+            board.push(move)
+    return records
+
+
+class PositionIndex:
+    """Sorted, memory-mapped records plus an in-memory log of recent ones"""
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self.log_path = path + ".log"
+        self.log = {}  # hash -> list of (game id, move code, info) not merged yet
+        self.log_records = 0
+        self.file = None
+        self.mmap = None
+        self.count = 0
+        self.open_sorted()
+        self.load_log()
+
+    def open_sorted(self):
+        if not os.path.exists(self.path):
+            with open(self.path, "wb") as f:
+                f.write(INDEX_MAGIC)
+        self.file = open(self.path, "rb")
+        if self.file.read(HEADER_SIZE) != INDEX_MAGIC:
+            raise ValueError(f"{self.path} is not a position index")
+        size = os.path.getsize(self.path) - HEADER_SIZE
+        self.count = size // RECORD.size
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.count else None
+
+    def load_log(self):
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, "rb") as f:
+            data = f.read()
+        usable = len(data) - len(data) % RECORD.size  # Ignore a record cut short by a crash
+        for key, game_id, move_code, info in RECORD.iter_unpack(data[:usable]):
+            self.log.setdefault(key, []).append((game_id, move_code, info))
+            self.log_records += 1
+
+    def add_game(self, game_id, game):
+        """Index every position of a finished game"""
+        records = game_records(game_id, game)
+        with open(self.log_path, "ab") as f:
+            f.write(b"".join(RECORD.pack(*record) for record in records))
+        for key, game_id, move_code, info in records:
+            self.log.setdefault(key, []).append((game_id, move_code, info))
+        self.log_records += len(records)
+        if self.log_records >= COMPACT_RECORDS:
+            self.compact()
+
+    def lookup(self, board):
+        """Every archived occurrence of the board's position"""
+        key = position_key(board)
+        found = [PositionEntry.unpack(*record) for record in self.log.get(key, ())]
+        if self.mmap is None:
+            return found
+
+        # Binary search for the records with this hash, then unpack them in one go
+        first = self.bisect(key, 0)
+        last = self.bisect(key + 1, first)
+        data = self.mmap[HEADER_SIZE + first * RECORD.size:HEADER_SIZE + last * RECORD.size]
+        found.extend(PositionEntry.unpack(game_id, move_code, info)
+                     for _, game_id, move_code, info in RECORD.iter_unpack(data))
+        return found
+
+    def bisect(self, key, lo):
+        """Index of the first sorted record whose hash is >= key"""
+        hi = self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if HASH.unpack_from(self.mmap, HEADER_SIZE + mid * RECORD.size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def compact(self):
+        """Merge the log into the sorted file"""
+        log_records = sorted((key, *record) for key, records in self.log.items() for record in records)
+
+        def sorted_records():
+            if self.mmap is not None:
+                for i in range(self.count):
+                    yield RECORD.unpack_from(self.mmap, HEADER_SIZE + i * RECORD.size)
+
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(INDEX_MAGIC)
+            chunk = []
+            for record in heapq.merge(sorted_records(), log_records):
+                chunk.append(RECORD.pack(*record))
+                if len(chunk) >= 65536:
+                    f.write(b"".join(chunk))
+                    chunk = []
+            f.write(b"".join(chunk))
+
+        self.close_sorted()
+        os.replace(temp_path, self.path)
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+        self.log = {}
+        self.log_records = 0
+        self.open_sorted()
+
+    def close_sorted(self):
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def close(self):
+        self.close_sorted()
+
+    @property
+    def size(self):
+        return self.count + self.log_records
+
+
+def summarize(entries):
+    """Results and moves played from a position: (result counts, [(move, times played, by Stockfish)])"""
+    results = Counter(entry.result for entry in entries)
+    moves = Counter((entry.move, entry.engine_move) for entry in entries if entry.move is not None)
+    return results, [(move, count, engine_move) for (move, engine_move), count in moves.most_common()]
+
+
+def build_index(archive_path, index_path=INDEX_PATH):
+    """Rebuild an index from scratch for every game of an archive"""
+    for path in (index_path, index_path + ".log"):
+        if os.path.exists(path):
+            os.remove(path)
+    index = PositionIndex(index_path)
+    games = 0
+    for game in read_games(archive_path):
+        index.add_game(game.game_id, game)
+        games += 1
+    index.compact()
+    return index, games
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Position index over the game archive")
+    parser.add_argument("--index", default=INDEX_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("build", help="Index every game of an archive")
+    command.add_argument("archive")
+    command = commands.add_parser("lookup", help="Show what happened from a position")
+    command.add_argument("fen")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        started = time.monotonic()
+        index, games = build_index(args.archive, args.index)
+        print(f"Indexed {index.size} positions of {games} games in {time.monotonic() - started:.1f} s")
+        index.close()
+        return
+
+    index = PositionIndex(args.index)
+    board = chess.Board(args.fen)
+    started = time.perf_counter()
+    entries = index.lookup(board)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    results, moves = summarize(entries)
+    print(f"Seen {len(entries)} times among {index.size} positions (lookup {elapsed_ms:.3f} ms)")
+    print("Results: " + ", ".join(f"{name} x{count}" for name, count in results.items()))
+    for move, count, engine_move in moves:
+        # A hash collision could bring back a move that isn't legal here
+        name = board.san(move) if move in board.legal_moves else move.uci()
+        print(f"  {name} x{count}{' (Stockfish)' if engine_move else ''}")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
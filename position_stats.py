@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Bulk position statistics over packed bitboards, vectorized with NumPy.
+
+Positions from EPD/FEN lists, PGN files (every mainline position) or the
+game archive are packed once into an array of 13 little-endian uint64 per
+position (12 piece bitboards + one word of side to move, castling and en
+passant) and cached next to the source as <source>.bb. Later runs memory-map
+the cache instead of parsing again.
+
+Features are computed for all positions at once with bitwise NumPy
+operations: material, piece-square occupancy heatmaps, king-safety
+counts (pawn shield, enemy pieces around the king) and mobility (squares
+attacked by each piece group, slider attacks by Kogge-Stone fills).
+
+    python position_stats.py stats games.pgn
+    python position_stats.py stats puzzles.epd --heatmaps heatmaps.npy
+    python position_stats.py bench games.cga
+"""
+
+import argparse
+import os
+import time
+
+import chess
+import chess.pgn
+import numpy as np
+
+from game_archive import read_games
+
+COLUMNS = 13  # 12 piece bitboards, then the meta word
+META = 12
+PIECE_NAMES = [f"{'white' if color else 'black'} {chess.piece_name(piece_type)}"
+               for color in (chess.WHITE, chess.BLACK) for piece_type in chess.PIECE_TYPES]
+MATERIAL_VALUES = np.array([1, 3, 3, 5, 9, 0] * 2, dtype=np.int64)  # Same scale as the game's fallback search
+MATERIAL_SIGNS = np.array([1] * 6 + [-1] * 6, dtype=np.int64)
+CHUNK_POSITIONS = 1 << 18  # Positions per chunk when converting and for the memory-hungry features
+
+# Meta word: side to move (bit 0), castling rights (bits 1-4: K Q k q), en passant square + 1 (bits 5-11)
+CASTLING_SQUARES = [chess.H1, chess.A1, chess.H8, chess.A8]
+
+U64 = np.uint64
+NOT_A = U64(~chess.BB_FILE_A & chess.BB_ALL)
+NOT_H = U64(~chess.BB_FILE_H & chess.BB_ALL)
+KING_ZONES = np.array([chess.BB_KING_ATTACKS[square] | chess.BB_SQUARES[square] for square in chess.SQUARES],
+                      dtype=U64)
+
+# Bit i of every byte value, for expanding byte histograms into squares
+BYTE_BITS = (np.arange(256)[:, None] >> np.arange(8)[None, :]) & 1
+
+# Sliding directions: (shift, mask applied to the squares the slide may move into)
+ROOK_DIRECTIONS = [(8, U64(chess.BB_ALL)), (-8, U64(chess.BB_ALL)), (1, NOT_A), (-1, NOT_H)]
+BISHOP_DIRECTIONS = [(9, NOT_A), (7, NOT_H), (-7, NOT_A), (-9, NOT_H)]
+
+
+def pack_board(board):
+    """13 uint64 words for one position"""
+    words = []
+    for own in (board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK]):
+        for pieces in (board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings):
+            words.append(pieces & own)
+    meta = int(board.turn)
+    for bit, square in enumerate(CASTLING_SQUARES):
+        if board.castling_rights & chess.BB_SQUARES[square]:
+            meta |= 2 << bit
+    if board.ep_square is not None:
+        meta |= (board.ep_square + 1) << 5
+    words.append(meta)
+    return words
+
+
+def unpack_board(row):
+    """chess.Board back from a packed row (for checks and debugging)"""
+    board = chess.Board(None)
+    for index in range(12):
+        color = chess.WHITE if index < 6 else chess.BLACK
+        for square in chess.scan_forward(int(row[index])):
+            board.set_piece_at(square, chess.Piece(index % 6 + 1, color))
+    meta = int(row[META])
+    board.turn = bool(meta & 1)
+    board.castling_rights = 0
+    for bit, square in enumerate(CASTLING_SQUARES):
+        if meta & (2 << bit):
+            board.castling_rights |= chess.BB_SQUARES[square]
+    board.ep_square = ((meta >> 5) & 127) - 1 if meta >> 5 else None
+    return board
+
+
+def iter_boards(path):
+    """Every position of an EPD/FEN list (one per line), a PGN file or a game archive"""
+    if path.endswith(".cga"):
+        for game in read_games(path):
+            board = chess.Board(game.starting_fen)
+            yield board
+            for move in game.moves:
+                board.push(move)
+                yield board
+    elif path.endswith(".pgn"):
+        with open(path, encoding="utf-8", errors="replace") as pgn:
+            while True:
+                game = chess.pgn.read_game(pgn)
+                if game is None:
+                    break
+                board = game.board()
+                yield board
+                for move in game.mainline_moves():
+                    board.push(move)
+                    yield board
+    else:
+        with open(path, encoding="utf-8") as lines:
+            for line in lines:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                fields = line.split()
+                # Full FENs have move counters, EPDs have opcodes instead
+                if len(fields) >= 6 and fields[4].isdigit():
+                    yield chess.Board(" ".join(fields[:6]))
+                else:
+                    yield chess.Board.from_epd(line)[0]
+
+
+def convert(source, target):
+    """Pack every position of a source file into a raw uint64 file, in chunks; returns the count"""
+    count = 0
+    temp_path = target + ".tmp"
+    with open(temp_path, "wb") as out:
+        chunk = []
+        for board in iter_boards(source):
+            chunk.extend(pack_board(board))
+            if len(chunk) >= CHUNK_POSITIONS * COLUMNS:
+                np.array(chunk, dtype="<u8").tofile(out)
+                count += len(chunk) // COLUMNS
+                chunk = []
+        np.array(chunk, dtype="<u8").tofile(out)
+        count += len(chunk) // COLUMNS
+    os.replace(temp_path, target)
+    return count
+
+
+def load_positions(source, refresh=False):
+    """Packed positions of a source as a read-only (N, 13) memory map, converting only when the cache is stale"""
+    cache = source + ".bb"
+    stale = not os.path.exists(cache) or os.path.getmtime(cache) < os.path.getmtime(source)
+    if refresh or stale:
+        started = time.monotonic()
+        count = convert(source, cache)
+        print(f"Packed {count} positions from {source} in {time.monotonic() - started:.1f} s")
+    if os.path.getsize(cache) == 0:
+        return np.zeros((0, COLUMNS), dtype="<u8")
+    return np.memmap(cache, dtype="<u8", mode="r").reshape(-1, COLUMNS)
+
+
+def popcount(bitboards):
+    """Set bits of every uint64 (element-wise)"""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bitboards).astype(np.int64)
+    # NumPy < 2.0: count bits a byte at a time
+    table = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+    as_bytes = np.ascontiguousarray(bitboards, dtype="<u8").view(np.uint8)
+    return table[as_bytes].reshape(bitboards.shape + (8,)).sum(axis=-1)
+
+
+def shift(bitboards, amount):
+    """Shift towards higher squares for positive amounts, lower for negative"""
+    if amount > 0:
+        return bitboards << U64(amount)
+    return bitboards >> U64(-amount)
+
+
+def slider_attacks(sliders, empty, directions):
+    """Union of the squares attacked by all sliders, per position (Kogge-Stone occluded fills)"""
+    attacks = np.zeros_like(sliders)
+    for step, mask in directions:
+        generator = sliders
+        propagator = empty & mask
+        for distance in (step, 2 * step, 4 * step):
+            generator = generator | (propagator & shift(generator, distance))
+            propagator = propagator & shift(propagator, distance)
+        attacks |= shift(generator, step) & mask
+    return attacks
+
+
+def knight_attacks(knights):
+    not_ab = U64(~(chess.BB_FILE_A | chess.BB_FILE_B) & chess.BB_ALL)
+    not_gh = U64(~(chess.BB_FILE_G | chess.BB_FILE_H) & chess.BB_ALL)
+    return ((shift(knights, 17) & NOT_A) | (shift(knights, 15) & NOT_H) |
+            (shift(knights, 10) & not_ab) | (shift(knights, 6) & not_gh) |
+            (shift(knights, -6) & not_ab) | (shift(knights, -10) & not_gh) |
+            (shift(knights, -15) & NOT_A) | (shift(knights, -17) & NOT_H))
+
+
+def king_squares(kings):
+    """Square of the (single) king per position, -1 where there is none"""
+    squares = np.full(kings.shape, -1, dtype=np.int64)
+    present = kings != 0
+    # A single set bit is a power of two, which float64 represents exactly
+    squares[present] = np.log2(kings[present].astype(np.float64)).astype(np.int64)
+    return squares
+
+
+def chunks(positions):
+    """Consecutive slices of at most CHUNK_POSITIONS positions, so temporaries stay bounded on huge sets"""
+    for start in range(0, max(1, len(positions)), CHUNK_POSITIONS):
+        yield positions[start:start + CHUNK_POSITIONS]
+
+
+def material(positions):
+    """Material balance (White minus Black, in pawns) per position"""
+    return popcount(positions[:, :12]) @ (MATERIAL_VALUES * MATERIAL_SIGNS)
+
+
+def heatmaps(positions):
+    """How often each piece stands on each square: (12, 64) counts"""
+    # Histogram the byte values of every (piece, byte of the bitboard) slot with one
+    # bincount, then expand each byte value into its 8 square bits with a matrix product
+    slots = np.arange(12 * 8, dtype=np.int64) * 256
+    histogram = np.zeros(12 * 8 * 256, dtype=np.int64)
+    for chunk in chunks(positions):
+        chunk = np.ascontiguousarray(chunk[:, :12])
+        values = chunk.view(np.uint8).reshape(len(chunk), 12 * 8)
+        histogram += np.bincount((values + slots).ravel(), minlength=len(histogram))
+    return (histogram.reshape(12 * 8, 256) @ BYTE_BITS).reshape(12, 64)
+
+
+def king_safety(positions, color):
+    """Per position for one side: (own pawns next to the king, enemy pieces around it); -1 without a king"""
+    results = [chunk_king_safety(chunk, color) for chunk in chunks(positions)]
+    return np.concatenate([shield for shield, _ in results]), np.concatenate([attackers for _, attackers in results])
+
+
+def chunk_king_safety(positions, color):
+    own = slice(0, 6) if color == chess.WHITE else slice(6, 12)
+    enemy = slice(6, 12) if color == chess.WHITE else slice(0, 6)
+    squares = king_squares(positions[:, own][:, 5])
+    zones = KING_ZONES[np.maximum(squares, 0)]
+    shield = popcount(zones & positions[:, own][:, 0])
+    enemy_occupied = np.bitwise_or.reduce(positions[:, enemy], axis=1)
+    attackers = popcount(zones & enemy_occupied)
+    missing = squares < 0
+    shield[missing] = -1
+    attackers[missing] = -1
+    return shield, attackers
+
+
+def mobility(positions, color):
+    """Squares attacked by one side's knights, bishops, rooks, queens and king (per group, not occupied by own pieces)"""
+    return np.concatenate([chunk_mobility(chunk, color) for chunk in chunks(positions)])
+
+
+def chunk_mobility(positions, color):
+    # Queens count in both slider groups: diagonal (with bishops) and straight (with rooks)
+    base = 0 if color == chess.WHITE else 6
+    pieces = positions[:, base:base + 6]
+    own = np.bitwise_or.reduce(pieces, axis=1)
+    empty = ~np.bitwise_or.reduce(positions[:, :12], axis=1)
+    diagonal = pieces[:, 2] | pieces[:, 4]
+    straight = pieces[:, 3] | pieces[:, 4]
+    kings = pieces[:, 5]
+    king_moves = (shift(kings, 8) | shift(kings, -8) | (shift(kings, 1) & NOT_A) | (shift(kings, -1) & NOT_H) |
+                  (shift(kings, 9) & NOT_A) | (shift(kings, 7) & NOT_H) |
+                  (shift(kings, -7) & NOT_A) | (shift(kings, -9) & NOT_H))
+    total = np.zeros(len(positions), dtype=np.int64)
+    for attacks in (knight_attacks(pieces[:, 1]), slider_attacks(diagonal, empty, BISHOP_DIRECTIONS),
+                    slider_attacks(straight, empty, ROOK_DIRECTIONS), king_moves):
+        total += popcount(attacks & ~own)
+    return total
+
+
+def compute_stats(positions):
+    """Every feature over a position set, as a dict of arrays"""
+    stats = {"material": material(positions), "heatmaps": heatmaps(positions)}
+    for color, name in ((chess.WHITE, "white"), (chess.BLACK, "black")):
+        stats[f"{name}_king_shield"], stats[f"{name}_king_attackers"] = king_safety(positions, color)
+        stats[f"{name}_mobility"] = mobility(positions, color)
+    return stats
+
+
+def print_stats(stats, count):
+    print(f"{count} positions")
+    balance = stats["material"]
+    print(f"material balance: mean {balance.mean():+.2f}, std {balance.std():.2f}, "
+          f"White ahead {np.mean(balance > 0):.1%}, Black ahead {np.mean(balance < 0):.1%}")
+    for name in ("white", "black"):
+        shield, attackers = stats[f"{name}_king_shield"], stats[f"{name}_king_attackers"]
+        has_king = shield >= 0
+        print(f"{name}: mobility mean {stats[f'{name}_mobility'].mean():.1f}, "
+              f"king shield mean {shield[has_king].mean():.2f}, "
+              f"enemy pieces near king mean {attackers[has_king].mean():.2f}")
+    print("busiest square per piece:")
+    for index, name in enumerate(PIECE_NAMES):
+        square = int(stats["heatmaps"][index].argmax())
+        share = stats["heatmaps"][index, square] / max(1, count)
+        print(f"  {name:>13}: {chess.square_name(square)} ({share:.1%} of positions)")
+
+
+def slow_stats(boards):
+    """The same features the obvious way, looping over board.piece_map() (for the benchmark and tests)"""
+    counts = np.zeros((12, 64), dtype=np.int64)
+    stats = {"material": []}
+    for name in ("white", "black"):
+        stats[f"{name}_king_shield"], stats[f"{name}_king_attackers"], stats[f"{name}_mobility"] = [], [], []
+    for board in boards:
+        balance = 0
+        # Attacked squares per group, grouped like mobility(): a queen's diagonal and straight
+        # attacks go to the bishop and rook groups
+        attacked = {chess.WHITE: {}, chess.BLACK: {}}
+        for square, piece in board.piece_map().items():
+            index = (0 if piece.color == chess.WHITE else 6) + piece.piece_type - 1
+            counts[index, square] += 1
+            balance += MATERIAL_VALUES[index] * MATERIAL_SIGNS[index]
+            if piece.piece_type == chess.PAWN:
+                continue
+            attacks = board.attacks_mask(square)
+            diagonal = attacks & chess.BB_DIAG_ATTACKS[square][0]
+            if piece.piece_type == chess.QUEEN:
+                masks = {chess.BISHOP: diagonal, chess.ROOK: attacks & ~diagonal}
+            else:
+                masks = {piece.piece_type: attacks}
+            group = attacked[piece.color]
+            for piece_type, mask in masks.items():
+                group[piece_type] = group.get(piece_type, 0) | mask
+        for color, name in ((chess.WHITE, "white"), (chess.BLACK, "black")):
+            king = board.king(color)
+            shield = attackers = -1
+            if king is not None:
+                zone = int(KING_ZONES[king])
+                shield = chess.popcount(zone & board.pawns & board.occupied_co[color])
+                attackers = chess.popcount(zone & board.occupied_co[not color])
+            stats[f"{name}_king_shield"].append(shield)
+            stats[f"{name}_king_attackers"].append(attackers)
+            stats[f"{name}_mobility"].append(sum(chess.popcount(mask & ~board.occupied_co[color])
+                                                 for mask in attacked[color].values()))
+        stats["material"].append(balance)
+    stats = {key: np.array(values, dtype=np.int64) for key, values in stats.items()}
+    stats["heatmaps"] = counts
+    return stats
+
+
+def mismatches(stats, expected):
+    """Names of the features where two stats dicts over the same positions disagree"""
+    return [key for key in expected if not np.array_equal(stats[key], expected[key])]
+
+
+def benchmark(source, sample=20000):
+    positions = load_positions(source)
+    compute_stats(positions)  # Page the cache in first: this measures the computation, not the disk
+    started = time.monotonic()
+    stats = compute_stats(positions)
+    vector_time = time.monotonic() - started
+
+    boards = [unpack_board(row) for row in positions[:sample]]
+    started = time.monotonic()
+    expected = slow_stats(boards)
+    loop_time = time.monotonic() - started
+    sampled = {key: values[:len(boards)] for key, values in stats.items() if key != "heatmaps"}
+    sampled["heatmaps"] = heatmaps(positions[:len(boards)])
+    assert not mismatches(sampled, expected), f"vectorized and loop features differ: {mismatches(sampled, expected)}"
+
+    per_vector = vector_time / max(1, len(positions)) * 1e6
+    per_loop = loop_time / max(1, len(boards)) * 1e6
+    print(f"vectorized: {per_vector:.2f} us per position ({len(positions)} positions)")
+    print(f"piece_map() loop: {per_loop:.2f} us per position ({len(boards)} positions)")
+    print(f"{per_loop / per_vector:.0f}x faster")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vectorized statistics over large position sets")
+    parser.add_argument("command", choices=["stats", "convert", "bench"])
+    parser.add_argument("source", help="EPD/FEN list, PGN file or game archive (.cga)")
+    parser.add_argument("--refresh", action="store_true", help="Re-pack even if the cache is up to date")
+    parser.add_argument("--heatmaps", help="Save the (12, 64) occupancy counts to this .npy file")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        load_positions(args.source, refresh=True)
+    elif args.command == "bench":
+        benchmark(args.source)
+    else:
+        positions = load_positions(args.source, args.refresh)
+        started = time.monotonic()
+        stats = compute_stats(positions)
+        print_stats(stats, len(positions))
+        print(f"computed in {time.monotonic() - started:.2f} s")
+        if args.heatmaps:
+            np.save(args.heatmaps, stats["heatmaps"])
+
+
+if __name__ == "__main__":
+    main()
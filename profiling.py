@@ -0,0 +1,163 @@
+"""
+Sampling profiler for the game window (python main.py --profile).
+
+A background thread samples the main thread's Python stack at a fixed
+interval. Every sample is tagged with the subsystem it was spent in (engine,
+rules, render, input, idle or other), so "the game is slow" can be narrowed
+down to drawing, python-chess move generation or waiting on Stockfish. On
+exit the samples are written as collapsed stacks, one line per distinct
+stack with the subsystem as the root frame:
+
+    render;main.py:run;main.py:draw_ui;main.py:draw_clocks 12
+
+which flamegraph.pl, speedscope or inferno turn into a flame graph, and a
+per-subsystem and per-function summary is printed. Nothing is installed
+unless the profiler is started, so the game runs unchanged without --profile.
+"""
+
+import linecache
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILE_PATH = "profile.folded"
+PROFILE_INTERVAL_S = 0.002
+SUMMARY_FUNCTIONS = 25  # Functions listed in the summary
+
+SUBSYSTEMS = ["engine", "rules", "render", "input", "idle", "other"]
+
+# Code that talks to or is an engine: time under it is engine time, even inside python-chess
+ENGINE_FILES = ("engine_backend.py", "builtin_engine.py", "engine_scheduler.py", "chess/engine.py")
+ENGINE_FUNCTIONS = {"request_engine_move", "poll_engine_move", "run_engine_search"}
+
+# Calls into pygame's C code, recognised by the line the main loop is stopped on
+IDLE_CALLS = (".tick(",)
+RENDER_CALLS = ("display.flip(", "screen.fill(", ".blit(", "pygame.draw.")
+INPUT_CALLS = ("event.get(",)
+
+
+def frame_label(filename, function):
+    """Short frame name: path inside site-packages (chess/__init__.py) or the file name"""
+    path = filename.replace("\\", "/")
+    marker = "site-packages/"
+    if marker in path:
+        path = path.split(marker, 1)[1]
+    else:
+        path = os.path.basename(path)
+    return f"{path}:{function}"
+
+
+def classify(labels, leaf_line):
+    """Subsystem of a stack (frame labels from the root, and the source line of the leaf)"""
+    files = [label.rsplit(":", 1)[0] for label in labels]
+    functions = [label.rsplit(":", 1)[1] for label in labels]
+    if any(f.startswith(ENGINE_FILES) for f in files) or ENGINE_FUNCTIONS.intersection(functions):
+        return "engine"
+    if any(f.startswith("chess/") for f in files):
+        return "rules"
+    if any(call in leaf_line for call in IDLE_CALLS):
+        return "idle"
+    if any(call in leaf_line for call in RENDER_CALLS) or any(f.startswith("draw_") for f in functions):
+        return "render"
+    if any(call in leaf_line for call in INPUT_CALLS) or any(f.startswith("handle_") for f in functions):
+        return "input"
+    return "other"
+
+
+class SamplingProfiler:
+    """Samples one thread's stack from a background thread"""
+
+    def __init__(self, interval=PROFILE_INTERVAL_S, thread=None):
+        self.interval = interval
+        self.thread_id = (thread or threading.main_thread()).ident
+        self.stacks = Counter()  # (subsystem, frame labels from the root...) -> samples
+        self.classified = {}  # (frame labels, leaf line) -> subsystem
+        self.samples = 0
+        self.started_at = None
+        self.elapsed = 0.0
+        self.stop_event = threading.Event()
+        self.worker = None
+        self.switch_interval = None
+
+    def start(self):
+        self.started_at = time.monotonic()
+        # The sampler needs the GIL to look at the other thread: hand it over often enough
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self.switch_interval, self.interval / 2))
+        self.worker = threading.Thread(target=self.run, name="profiler", daemon=True)
+        self.worker.start()
+
+    def stop(self):
+        if self.worker is None:
+            return
+        self.stop_event.set()
+        self.worker.join()
+        self.worker = None
+        sys.setswitchinterval(self.switch_interval)
+        self.elapsed = time.monotonic() - self.started_at
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.record(frame)
+            frame = None  # Don't keep the sampled thread's frames alive
+
+    def record(self, frame):
+        leaf_line = linecache.getline(frame.f_code.co_filename, frame.f_lineno)
+        labels = []
+        while frame is not None:
+            labels.append(frame_label(frame.f_code.co_filename, frame.f_code.co_name))
+            frame = frame.f_back
+        labels = tuple(reversed(labels))
+
+        key = (labels, leaf_line)
+        subsystem = self.classified.get(key)
+        if subsystem is None:
+            subsystem = self.classified[key] = classify(labels, leaf_line)
+        self.stacks[(subsystem,) + labels] += 1
+        self.samples += 1
+
+    def write_collapsed(self, path):
+        """Write the samples as collapsed stacks for flame graph tools"""
+        with open(path, "w") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{';'.join(stack)} {count}\n")
+
+    def summary(self):
+        """Time per subsystem, then the functions with the most samples (self and total)"""
+        if not self.samples:
+            return "Profile: no samples"
+        subsystems = Counter()
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            subsystems[stack[0]] += count
+            own[stack[-1]] += count
+            for label in set(stack[1:]):  # Recursive functions count once per sample
+                total[label] += count
+
+        def share(count):
+            return f"{count / self.samples * 100:5.1f}%"
+
+        lines = [f"Profile: {self.samples} samples over {self.elapsed:.1f} s "
+                 f"(one every {self.elapsed / self.samples * 1000:.1f} ms)",
+                 "By subsystem:"]
+        for subsystem in SUBSYSTEMS:
+            if subsystems[subsystem]:
+                lines.append(f"  {subsystem:<8} {share(subsystems[subsystem])}")
+        lines.append("Top functions (self / total):")
+        for label, count in own.most_common(SUMMARY_FUNCTIONS):
+            lines.append(f"  {share(count)} {share(total[label])}  {label}")
+        return "\n".join(lines)
+
+    def save(self, path=PROFILE_PATH):
+        """Write the collapsed stacks and the summary (next to them as .txt), and print the summary"""
+        self.write_collapsed(path)
+        summary = self.summary()
+        with open(os.path.splitext(path)[0] + ".txt", "w") as f:
+            f.write(summary + "\n")
+        print(summary)
+        print(f"Collapsed stacks written to {path} (e.g. flamegraph.pl {path} > profile.svg)")
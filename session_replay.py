@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Record and replay input sessions of the game window.
+
+`python main.py --record session.jsonl` saves every input event the main loop
+handles, with its time, and every engine reply, as JSON lines. Replaying
+drives a new ChessGame headless (SDL dummy video driver) through the same
+handle_events / update / draw_frame calls as the live loop, with the engine
+answering from the recording. A real session then plays out the same way on
+any machine, and its handler and frame timings can be compared between
+versions:
+
+    python session_replay.py session.jsonl              # as fast as possible
+    python session_replay.py session.jsonl --realtime   # at the recorded pace, 60 FPS
+    python session_replay.py session.jsonl --repeat 5
+
+Games with a clock depend on wall-clock time: replayed as fast as possible,
+a flag that fell in the recording may not fall (use --realtime for those).
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+
+import pygame
+
+from engine_backend import EngineBackend, latency_percentiles
+
+SESSION_VERSION = 1
+REPLAY_FPS = 60
+
+
+def encode_event(event):
+    """JSON-friendly form of an input event"""
+    record = {"type": pygame.event.event_name(event.type)}
+    for field in ("pos", "button", "key"):
+        if hasattr(event, field):
+            value = getattr(event, field)
+            record[field] = list(value) if isinstance(value, tuple) else value
+    return record
+
+
+def decode_event(record, event_types):
+    fields = {name: tuple(value) if isinstance(value, list) else value
+              for name, value in record.items() if name != "type"}
+    return pygame.event.Event(event_types[record["type"]], **fields)
+
+
+class SessionRecorder:
+    """Writes a session as it is played: a header, then one line per frame with input and per engine reply"""
+
+    def __init__(self, path, config, event_types):
+        self.path = path
+        self.event_types = set(event_types)
+        self.started = time.monotonic()
+        self.file = open(path, "w")
+        self.write({"version": SESSION_VERSION, "config": config})
+        print(f"Recording session to {path}")
+
+    def write(self, record):
+        # One line at a time: a crash keeps everything recorded up to it
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def elapsed(self):
+        return round(time.monotonic() - self.started, 4)
+
+    def record_events(self, events):
+        events = [encode_event(event) for event in events if event.type in self.event_types]
+        if events:
+            self.write({"t": self.elapsed(), "events": events})
+
+    def record_engine_reply(self, fen, move):
+        self.write({"t": self.elapsed(), "fen": fen, "engine": move})
+
+    def close(self, board):
+        """End the session with the final position, which a replay has to reach too"""
+        self.write({"t": self.elapsed(), "end": board.fen()})
+        self.file.close()
+
+
+def load_session(path):
+    """(header, records) of a recorded session"""
+    with open(path) as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    if not lines or lines[0].get("version") != SESSION_VERSION:
+        raise ValueError(f"{path} is not a version {SESSION_VERSION} session recording")
+    return lines[0], lines[1:]
+
+
+class RecordedEngine(EngineBackend):
+    """Engine that answers with the recorded replies, in order"""
+
+    name = "recorded"
+
+    def __init__(self, replies):
+        super().__init__("recording")
+        self.replies = list(replies)  # (fen, move)
+        self.next = 0
+        self.mismatches = 0
+
+    def set_strength(self, skill_level):
+        pass
+
+    def configure(self, options):
+        pass
+
+    def search(self, fen, limit, on_info=None):
+        if self.next >= len(self.replies):
+            self.mismatches += 1
+            return None
+        recorded_fen, move = self.replies[self.next]
+        self.next += 1
+        if recorded_fen != fen:
+            self.mismatches += 1  # The replay went somewhere the recording didn't
+        return move
+
+    def stop(self):
+        pass
+
+    def kill(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class ReplayResult:
+    """Timings and outcome of one replay"""
+
+    def __init__(self):
+        self.frames = 0
+        self.events = 0
+        self.handler_ms = []  # handle_events per frame with input
+        self.frame_ms = []  # update + draw_frame per frame
+        self.elapsed = 0.0
+        self.final_fen = None
+        self.expected_fen = None
+        self.engine_mismatches = 0
+
+    @property
+    def diverged(self):
+        return self.engine_mismatches > 0 or (self.expected_fen is not None and self.final_fen != self.expected_fen)
+
+    def report(self):
+        lines = [f"Replayed {self.events} events over {self.frames} frames in {self.elapsed:.2f} s"]
+        for name, timings in (("handlers", self.handler_ms), ("frames", self.frame_ms)):
+            stats = latency_percentiles(timings)
+            lines.append(f"  {name:<8} p50 {stats['p50']:.2f} ms, p95 {stats['p95']:.2f} ms, "
+                         f"p99 {stats['p99']:.2f} ms, max {stats['max']:.2f} ms")
+        if self.diverged:
+            lines.append(f"  Diverged from the recording: final position {self.final_fen}, "
+                         f"recorded {self.expected_fen}, {self.engine_mismatches} engine replies didn't match")
+        else:
+            lines.append("  Reached the recorded final position")
+        return "\n".join(lines)
+
+
+def replay_session(path, realtime=False, quiet=True):
+    """Replay a recorded session headless and time it"""
+    # Without a display unless one was asked for; main initialises pygame when imported
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import main as game_module
+
+    header, records = load_session(path)
+    engine = RecordedEngine((record["fen"], record["engine"]) for record in records if "engine" in record)
+    frames = [record for record in records if "events" in record]
+    end = next((record for record in records if "end" in record), None)
+    event_types = {pygame.event.event_name(event_type): event_type for event_type in game_module.INPUT_EVENTS}
+
+    result = ReplayResult()
+    result.expected_fen = end["end"] if end else None
+    output = open(os.devnull, "w") if quiet else sys.stdout
+    with contextlib.redirect_stdout(output):
+        pygame.init()  # Again after an earlier replay's shutdown
+        game = game_module.ChessGame(header["config"], engine=engine)
+        game.builtin_engine = engine  # Easy mode moves were recorded too
+        game.analyse_finished_games = False
+        clock = pygame.time.Clock()
+        started = time.perf_counter()
+
+        index = 0
+        while index < len(frames):
+            if realtime:
+                # Live pacing: every frame is drawn, input is handed over once it is due
+                events = []
+                elapsed = time.perf_counter() - started
+                while index < len(frames) and frames[index]["t"] <= elapsed:
+                    events.extend(frames[index]["events"])
+                    index += 1
+            else:
+                events = frames[index]["events"]
+                index += 1
+
+            # Live, input that came in while the engine thought only touched the view:
+            # the recorded input after a move always follows the engine's reply
+            game.wait_for_engine_move()
+            frame_started = time.perf_counter()
+            if events:
+                game.handle_events([decode_event(event, event_types) for event in events])
+                result.handler_ms.append((time.perf_counter() - frame_started) * 1000)
+                result.events += len(events)
+            game.update()
+            game.draw_frame()
+            result.frame_ms.append((time.perf_counter() - frame_started) * 1000)
+            result.frames += 1
+            if realtime:
+                clock.tick(REPLAY_FPS)
+
+        game.wait_for_engine_move()
+        result.elapsed = time.perf_counter() - started
+        result.final_fen = game.board.fen()
+        result.engine_mismatches = engine.mismatches
+        game.shutdown()
+    if quiet:
+        output.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a session recorded with main.py --record")
+    parser.add_argument("session")
+    parser.add_argument("--realtime", action="store_true", help="Keep the recorded pace (default: as fast as possible)")
+    parser.add_argument("--repeat", type=int, default=1, help="Replay this many times")
+    parser.add_argument("--verbose", action="store_true", help="Show the game's console output")
+    args = parser.parse_args()
+
+    diverged = False
+    for run in range(args.repeat):
+        result = replay_session(args.session, args.realtime, quiet=not args.verbose)
+        if args.repeat > 1:
+            print(f"Run {run + 1}:")
+        print(result.report())
+        diverged = diverged or result.diverged
+    sys.exit(1 if diverged else 0)
+
+
+if __name__ == "__main__":
+    main()
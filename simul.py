@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""
+Simultaneous exhibition: you against Stockfish on many boards in one window.
+
+Every board is an independent game with its own move limit: as in the main
+game, Stockfish tries to mate you within it. Engine moves go to a shared
+EngineScheduler with one session per board, so every board can be thinking
+at once while the window keeps drawing at 60 FPS. Each board is drawn to its
+own surface only when it changes, and only the screen areas of changed
+boards are updated, so idle boards cost nothing per frame.
+
+    python simul.py --boards 9
+    python simul.py --boards 16 --max-moves 5,6,7 --color alternate
+    python simul.py --boards 4 --fens puzzles.epd --difficulty strongest
+
+Click a piece, then its destination (pawns promote to a queen). Frame time
+and engine reply percentiles are printed on exit.
+"""
+
+import argparse
+import math
+import queue
+import threading
+import time
+
+import chess
+import pygame
+
+from engine_backend import CONFIG_PATH, DIFFICULTY_PRESETS, difficulty_limit, latency_percentiles
+from engine_scheduler import INTERACTIVE, EngineScheduler
+from engine_tuning import host_cores, load_engine_options
+from main import BLACK, INPUT_EVENTS, TEXT_COLOR, WHITE, load_piece_images
+
+SIMUL_WINDOW = (1280, 960)
+SIMUL_FPS = 60
+STATUS_HEIGHT = 30
+LABEL_HEIGHT = 22
+CELL_MARGIN = 6
+STATUS_INTERVAL_S = 0.25  # How often the status line is redrawn
+
+BACKGROUND_COLOR = (40, 40, 40)
+SELECTED_COLOR = (255, 255, 0)
+LAST_MOVE_COLOR = (205, 210, 106)
+THINKING_COLOR = (74, 144, 226)
+FINISHED_COLOR = (120, 120, 120)
+
+
+class SimulBoard:
+    """One game of the simul, with its own cached drawing"""
+
+    def __init__(self, index, fen, user_color, max_moves, rect, square_size):
+        self.index = index
+        self.board = chess.Board(fen)
+        self.user_color = user_color
+        self.max_moves = max_moves
+        self.engine_moves = 0
+        self.selected = None
+        self.thinking = False  # An engine request is out
+        self.result = ""
+        self.rect = rect  # Screen area: label, then the board
+        self.square_size = square_size
+        self.surface = pygame.Surface(rect.size)
+        self.dirty = True
+        # A starting position from a FEN file may already be over
+        if self.board.is_checkmate():
+            self.result = "Checkmate!"
+        else:
+            self.check_draw()
+
+    @property
+    def game_over(self):
+        return bool(self.result)
+
+    @property
+    def user_to_move(self):
+        return not self.game_over and not self.thinking and self.board.turn == self.user_color
+
+    def square_at(self, pos):
+        """Board square under a screen position, or None"""
+        x, y = pos[0] - self.rect.x, pos[1] - self.rect.y - LABEL_HEIGHT
+        if not (0 <= x < self.square_size * 8 and 0 <= y < self.square_size * 8):
+            return None
+        file, row = x // self.square_size, y // self.square_size
+        if self.user_color == chess.WHITE:
+            return chess.square(file, 7 - row)
+        return chess.square(7 - file, row)
+
+    def square_origin(self, square):
+        """Top-left corner of a square on the board surface"""
+        file, rank = chess.square_file(square), chess.square_rank(square)
+        if self.user_color == chess.BLACK:
+            file, rank = 7 - file, 7 - rank
+        return file * self.square_size, LABEL_HEIGHT + (7 - rank) * self.square_size
+
+    def click(self, pos):
+        """Select a piece or play the selected one; returns the user's move once one is made"""
+        square = self.square_at(pos)
+        if square is None or not self.user_to_move:
+            return None
+        piece = self.board.piece_at(square)
+        if piece is not None and piece.color == self.user_color:
+            self.selected = None if self.selected == square else square
+            self.dirty = True
+            return None
+        if self.selected is None:
+            return None
+
+        move = chess.Move(self.selected, square)
+        if move not in self.board.legal_moves:
+            move = chess.Move(self.selected, square, promotion=chess.QUEEN)
+        self.selected = None
+        self.dirty = True
+        if move not in self.board.legal_moves:
+            return None
+        self.play_user_move(move)
+        return move
+
+    def play_user_move(self, move):
+        self.board.push(move)
+        if self.board.is_checkmate():
+            if self.max_moves == float('inf'):
+                self.result = "You won!"
+            else:
+                self.result = f"You won! No mate in {self.max_moves}"
+        else:
+            self.check_draw()
+
+    def play_engine_move(self, uci):
+        self.thinking = False
+        self.dirty = True
+        move = chess.Move.from_uci(uci) if uci else None
+        if move is None or move not in self.board.legal_moves:
+            self.result = "Engine failed"
+            return
+        self.board.push(move)
+        self.engine_moves += 1
+        if self.board.is_checkmate():
+            self.result = f"Stockfish wins in {self.engine_moves}"
+        elif self.engine_moves >= self.max_moves:
+            self.result = f"You survived {int(self.max_moves)} moves!"
+        else:
+            self.check_draw()
+
+    def check_draw(self):
+        if self.board.is_stalemate():
+            self.result = "Stalemate!"
+        elif self.board.is_game_over():
+            self.result = "Draw!"
+
+    def draw(self, empty_board, images, font):
+        """Redraw the board surface"""
+        surface = self.surface
+        surface.fill(BACKGROUND_COLOR)
+        surface.blit(empty_board, (0, LABEL_HEIGHT))
+
+        highlights = []
+        if self.board.move_stack:
+            last = self.board.peek()
+            highlights += [(last.from_square, LAST_MOVE_COLOR), (last.to_square, LAST_MOVE_COLOR)]
+        if self.selected is not None:
+            highlights.append((self.selected, SELECTED_COLOR))
+        for square, color in highlights:
+            x, y = self.square_origin(square)
+            pygame.draw.rect(surface, color, (x, y, self.square_size, self.square_size), 3)
+
+        for square, piece in self.board.piece_map().items():
+            x, y = self.square_origin(square)
+            surface.blit(images[piece.symbol()], (x + 2, y + 2))
+
+        if self.result:
+            label, color = self.result, FINISHED_COLOR
+        elif self.thinking:
+            label, color = "Stockfish thinking...", THINKING_COLOR
+        else:
+            limit = "" if self.max_moves == float('inf') else f"/{int(self.max_moves)}"
+            label, color = f"Your move (Stockfish {self.engine_moves}{limit})", TEXT_COLOR
+        surface.blit(font.render(f"#{self.index + 1}  {label}", True, color), (2, 3))
+        self.dirty = False
+
+
+class SimulExhibition:
+    """The simul window: boards in a grid, engine replies coming back from worker threads"""
+
+    def __init__(self, scheduler, fens, max_moves, colors, difficulty, size=SIMUL_WINDOW):
+        self.scheduler = scheduler
+        self.difficulty = difficulty
+        self.limit = difficulty_limit(difficulty)
+        self.screen = pygame.display.set_mode(size)
+        pygame.display.set_caption(f"Chess simul - {len(fens)} boards vs Stockfish")
+        self.font = pygame.font.Font(None, 22)
+
+        # Grid: as square as possible, each cell holds a label and a board
+        count = len(fens)
+        columns = math.ceil(math.sqrt(count))
+        rows = math.ceil(count / columns)
+        cell_width = size[0] // columns
+        cell_height = (size[1] - STATUS_HEIGHT) // rows
+        square_size = max(8, min(cell_width - CELL_MARGIN, cell_height - CELL_MARGIN - LABEL_HEIGHT) // 8)
+        self.boards = []
+        for index, fen in enumerate(fens):
+            row, column = divmod(index, columns)
+            width, height = square_size * 8, LABEL_HEIGHT + square_size * 8
+            rect = pygame.Rect(column * cell_width + (cell_width - width) // 2,
+                               STATUS_HEIGHT + row * cell_height + (cell_height - height) // 2, width, height)
+            self.boards.append(SimulBoard(index, fen, colors[index], max_moves[index], rect, square_size))
+
+        self.images = load_piece_images(square_size - 4)
+        self.empty_board = pygame.Surface((square_size * 8, square_size * 8))
+        for rank in range(8):
+            for file in range(8):
+                color = WHITE if (rank + file) % 2 == 0 else BLACK
+                self.empty_board.fill(color, (file * square_size, rank * square_size, square_size, square_size))
+
+        self.replies = queue.Queue()  # (board, fen, uci move or None, error) from the search threads
+        self.status_rect = pygame.Rect(0, 0, size[0], STATUS_HEIGHT)
+        self.status_drawn_at = 0.0
+        self.frame_work_ms = []  # Handling, drawing and updating per frame (without the wait for the next one)
+        self.frame_intervals_ms = []
+        self.reply_ms = []
+
+    def dispatch(self, board):
+        """Ask the scheduler for the engine's move on a board, without waiting for it"""
+        board.thinking = True
+        board.dirty = True
+        fen = board.board.fen()
+        threading.Thread(target=self.search, args=(board, fen), daemon=True).start()
+
+    def search(self, board, fen):
+        """Worker: one engine request; the reply is applied by the main loop"""
+        started = time.monotonic()
+        move, error = None, None
+        try:
+            move = self.scheduler.search(fen, self.limit, self.difficulty, session=board.index, priority=INTERACTIVE)
+        except Exception as e:
+            error = e
+        self.replies.put((board, fen, move, error, (time.monotonic() - started) * 1000))
+
+    def apply_replies(self):
+        while True:
+            try:
+                board, fen, move, error, elapsed_ms = self.replies.get_nowait()
+            except queue.Empty:
+                return
+            if error is not None:
+                print(f"Board {board.index + 1}: engine error: {error}")
+            if board.board.fen() != fen:
+                continue  # Can't happen while the board waits for its reply, but never play into a changed position
+            self.reply_ms.append(elapsed_ms)
+            board.play_engine_move(move)
+
+    def handle_click(self, pos):
+        for board in self.boards:
+            if board.rect.collidepoint(pos):
+                if board.click(pos) is not None and not board.game_over:
+                    self.dispatch(board)
+                return
+
+    def draw_status(self):
+        thinking = sum(board.thinking for board in self.boards)
+        finished = sum(board.game_over for board in self.boards)
+        waiting = len(self.boards) - thinking - finished
+        recent = self.frame_intervals_ms[-SIMUL_FPS:]
+        fps = 1000 * len(recent) / sum(recent) if recent and sum(recent) > 0 else 0
+        text = (f"{len(self.boards)} boards: {waiting} your move, {thinking} Stockfish thinking, "
+                f"{finished} finished   |   {fps:.0f} FPS")
+        self.screen.fill(BACKGROUND_COLOR, self.status_rect)
+        self.screen.blit(self.font.render(text, True, TEXT_COLOR), (8, 8))
+
+    def run(self, duration=None):
+        """Main loop until the window is closed (or for duration seconds)"""
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed(INPUT_EVENTS)
+        clock = pygame.time.Clock()
+        for board in self.boards:
+            if not board.game_over and board.board.turn != board.user_color:
+                self.dispatch(board)
+
+        # First frame: everything, then only what changed
+        self.screen.fill(BACKGROUND_COLOR)
+        for board in self.boards:
+            board.draw(self.empty_board, self.images, self.font)
+            self.screen.blit(board.surface, board.rect)
+        self.draw_status()
+        pygame.display.flip()
+
+        started = last_frame = time.perf_counter()
+        running = True
+        while running:
+            frame_started = time.perf_counter()
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+                elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                    self.handle_click(event.pos)
+            self.apply_replies()
+
+            updated = []
+            for board in self.boards:
+                if board.dirty:
+                    board.draw(self.empty_board, self.images, self.font)
+                    self.screen.blit(board.surface, board.rect)
+                    updated.append(board.rect)
+            if frame_started - self.status_drawn_at >= STATUS_INTERVAL_S:
+                self.draw_status()
+                self.status_drawn_at = frame_started
+                updated.append(self.status_rect)
+            if updated:
+                pygame.display.update(updated)
+
+            now = time.perf_counter()
+            self.frame_work_ms.append((now - frame_started) * 1000)
+            self.frame_intervals_ms.append((now - last_frame) * 1000)
+            last_frame = now
+            if duration is not None and now - started >= duration:
+                running = False
+            clock.tick(SIMUL_FPS)
+
+    def report(self):
+        lines = []
+        for board in self.boards:
+            lines.append(f"Board {board.index + 1}: {board.result or 'unfinished'} ({len(board.board.move_stack)} plies)")
+        if self.frame_work_ms:
+            work = latency_percentiles(self.frame_work_ms)
+            intervals = self.frame_intervals_ms[1:] or [0.0]
+            fps = 1000 * len(intervals) / sum(intervals) if sum(intervals) > 0 else 0
+            late = sum(interval > 1000 / SIMUL_FPS * 1.5 for interval in intervals)
+            lines.append(f"{len(self.frame_work_ms)} frames at {fps:.1f} FPS, {late} late; frame work p50 "
+                         f"{work['p50']:.2f} ms, p95 {work['p95']:.2f} ms, p99 {work['p99']:.2f} ms, "
+                         f"max {work['max']:.2f} ms")
+        if self.reply_ms:
+            replies = latency_percentiles(self.reply_ms)
+            lines.append(f"{len(self.reply_ms)} engine replies: p50 {replies['p50']:.0f} ms, "
+                         f"p95 {replies['p95']:.0f} ms, max {replies['max']:.0f} ms")
+        return "\n".join(lines)
+
+
+def parse_max_moves(text):
+    """'5' or '5,6,7' (cycled over the boards); 0 means unlimited"""
+    try:
+        values = [int(value) for value in text.split(",") if value.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a list of move counts: {text!r}")
+    if not values:
+        raise argparse.ArgumentTypeError("at least one move count is needed")
+    if any(value < 0 for value in values):
+        raise argparse.ArgumentTypeError("move counts can't be negative (0 means unlimited)")
+    return [float('inf') if value == 0 else value for value in values]
+
+
+def load_fens(path):
+    """Starting positions, one FEN (or EPD) per line"""
+    fens = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                fens.append(chess.Board(line).fen())
+            except ValueError:
+                fens.append(chess.Board.from_epd(line)[0].fen())
+    return fens
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play many boards against Stockfish at once")
+    parser.add_argument("--boards", type=int, default=9, help="Number of boards (1-16)")
+    parser.add_argument("--max-moves", type=parse_max_moves, default=[5],
+                        help="Stockfish's move limit, or a comma separated list cycled over the boards (0: unlimited)")
+    parser.add_argument("--color", choices=["white", "black", "alternate"], default="white", help="Your side")
+    parser.add_argument("--difficulty", choices=list(DIFFICULTY_PRESETS), default="normal")
+    parser.add_argument("--fens", help="File of starting positions, one per line, cycled over the boards")
+    parser.add_argument("--engines", type=int, default=None,
+                        help="Engine processes (default: one per board, at most one per core)")
+    parser.add_argument("--path", help="Engine binary, or 'standin' for the bundled stand-in")
+    parser.add_argument("--config", default=CONFIG_PATH, help="Configuration file with tuned engine options")
+    parser.add_argument("--size", default=f"{SIMUL_WINDOW[0]}x{SIMUL_WINDOW[1]}", help="Window size, e.g. 1600x1000")
+    args = parser.parse_args()
+
+    if not 1 <= args.boards <= 16:
+        parser.error("--boards must be between 1 and 16")
+    fens = load_fens(args.fens) if args.fens else [chess.STARTING_FEN]
+    if not fens:
+        parser.error(f"no positions in {args.fens}")
+    fens = [fens[i % len(fens)] for i in range(args.boards)]
+    max_moves = [args.max_moves[i % len(args.max_moves)] for i in range(args.boards)]
+    if args.color == "alternate":
+        colors = [chess.WHITE if i % 2 == 0 else chess.BLACK for i in range(args.boards)]
+    else:
+        colors = [chess.WHITE if args.color == "white" else chess.BLACK] * args.boards
+    try:
+        width, height = (int(value) for value in args.size.lower().split("x"))
+    except ValueError:
+        parser.error(f"--size must be WIDTHxHEIGHT, e.g. 1600x1000, not {args.size!r}")
+    if width <= 0 or height <= 0:
+        parser.error("--size must be positive")
+
+    # Every board may wait for its move at once: no queue limit or timeout below the board count
+    engines = args.engines or max(1, min(args.boards, host_cores()))
+    scheduler = EngineScheduler(engines, max_queue=args.boards,
+                                paths=[args.path] if args.path else None, queue_timeout=None,
+                                options=load_engine_options(args.config))
+    try:
+        simul = SimulExhibition(scheduler, fens, max_moves, colors, args.difficulty, (width, height))
+        simul.run()
+        print(simul.report())
+    finally:
+        scheduler.close()
+        pygame.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Deterministic stand-in for Stockfish speaking just enough UCI for the game,
+the engine backends and the benchmarks.
+
+It doesn't search: moves come from a script or a deterministic pick among the
+legal moves, so measurements show the game's own overhead rather than engine
+thinking time. Point the game at it with config.json:
+
+    {"stockfish_path": "standin_engine.py"}
+
+Behaviour is set with command line flags or, when launched by the game,
+environment variables:
+
+    --latency-ms / STANDIN_LATENCY_MS     reply delay for every search (default 0)
+    --jitter-ms / STANDIN_JITTER_MS       extra random delay, seeded (default 0)
+    --seed / STANDIN_SEED                 jitter seed (default 0)
+    --moves / STANDIN_MOVES               scripted replies, e.g. "e2e4,g8f6"
+    --crash-after / STANDIN_CRASH_AFTER   exit after answering N searches
+    --hang-after / STANDIN_HANG_AFTER     stop answering after N searches
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import zlib
+
+import chess
+
+ENGINE_NAME = "Stockfish 16.1 stand-in"
+
+# Options real Stockfish declares that the game sets
+UCI_OPTIONS = [
+    "option name Threads type spin default 1 min 1 max 1024",
+    "option name Hash type spin default 16 min 1 max 33554432",
+    "option name MultiPV type spin default 1 min 1 max 500",
+    "option name Move Overhead type spin default 10 min 0 max 5000",
+    "option name Skill Level type spin default 20 min 0 max 20",
+    "option name UCI_LimitStrength type check default false",
+    "option name UCI_Elo type spin default 1320 min 1320 max 3190",
+    "option name UCI_ShowWDL type check default false",
+    "option name Ponder type check default false",
+]
+
+
+class StandinEngine:
+    """UCI command loop with scripted moves and fault injection"""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, seed=0, moves=None, crash_after=None, hang_after=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.random = random.Random(seed)
+        self.script = list(moves or [])
+        self.crash_after = crash_after
+        self.hang_after = hang_after
+
+        self.board = chess.Board()
+        self.options = {}
+        self.searches = 0
+        self.hung = False
+        self.output_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.search_thread = None
+
+    def send(self, line):
+        with self.output_lock:
+            sys.stdout.write(line + "\n")
+            sys.stdout.flush()
+
+    def run(self):
+        self.send(f"{ENGINE_NAME} by the stand-in authors")
+        for line in sys.stdin:
+            tokens = line.split()
+            if not tokens:
+                continue
+            command = tokens[0]
+            if command == "quit":
+                break
+            if self.hung:
+                continue  # A hung engine ignores everything but being killed
+
+            if command == "uci":
+                self.send(f"id name {ENGINE_NAME}")
+                self.send("id author the stand-in authors")
+                for option in UCI_OPTIONS:
+                    self.send(option)
+                self.send("uciok")
+            elif command == "isready":
+                self.send("readyok")
+            elif command == "setoption":
+                self.set_option(tokens)
+            elif command == "ucinewgame":
+                self.board = chess.Board()
+            elif command == "position":
+                self.set_position(tokens)
+            elif command == "go":
+                self.go(tokens)
+            elif command == "stop":
+                self.stop_event.set()
+            elif command == "d":
+                # Enough of Stockfish's debug output for the stockfish package
+                self.send(f"Fen: {self.board.fen()}")
+                self.send(f"Checkers: {' '.join(chess.square_name(sq) for sq in self.board.checkers())}")
+
+        self.stop_event.set()
+
+    def set_option(self, tokens):
+        if "name" not in tokens:
+            return
+        name_end = tokens.index("value") if "value" in tokens else len(tokens)
+        name = " ".join(tokens[tokens.index("name") + 1:name_end])
+        self.options[name] = " ".join(tokens[name_end + 1:])
+
+    def set_position(self, tokens):
+        if len(tokens) > 1 and tokens[1] == "fen":
+            moves_at = tokens.index("moves") if "moves" in tokens else len(tokens)
+            self.board = chess.Board(" ".join(tokens[2:moves_at]))
+        else:
+            moves_at = tokens.index("moves") if "moves" in tokens else len(tokens)
+            self.board = chess.Board()
+        for move in tokens[moves_at + 1:]:
+            self.board.push_uci(move)
+
+    def go(self, tokens):
+        if self.crash_after is not None and self.searches >= self.crash_after:
+            os._exit(3)
+        if self.hang_after is not None and self.searches >= self.hang_after:
+            self.hung = True
+            return
+        self.searches += 1
+
+        move = self.pick_move()
+        infinite = "infinite" in tokens
+        delay_ms = self.latency_ms + (self.random.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+
+        if not infinite and delay_ms <= 0:
+            self.reply(move)
+            return
+
+        # Delayed replies run in a thread so "stop" can cut them short
+        self.stop_event.clear()
+        self.search_thread = threading.Thread(target=self.delayed_reply, args=(move, delay_ms, infinite), daemon=True)
+        self.search_thread.start()
+
+    def delayed_reply(self, move, delay_ms, infinite):
+        self.stop_event.wait(None if infinite else delay_ms / 1000)
+        self.reply(move)
+
+    def reply(self, move):
+        if move is None:
+            self.send("info depth 0 score mate 0" if self.board.is_checkmate() else "info depth 0 score cp 0")
+            self.send("bestmove (none)")
+            return
+        self.send(f"info depth 1 seldepth 1 multipv 1 score cp 0 nodes 1 nps 1 time 0 pv {move.uci()}")
+        self.send(f"bestmove {move.uci()}")
+
+    def pick_move(self):
+        """Next scripted move if it's legal here, otherwise a deterministic legal move"""
+        legal_moves = sorted(self.board.legal_moves, key=lambda move: move.uci())
+        if not legal_moves:
+            return None
+        while self.script:
+            move = chess.Move.from_uci(self.script.pop(0))
+            if move in legal_moves:
+                return move
+        # Same position, same move: hash the position, not Python's randomized hash()
+        return legal_moves[zlib.crc32(self.board.board_fen().encode()) % len(legal_moves)]
+
+
+def env_number(name, cast=int):
+    value = os.environ.get(name)
+    return cast(value) if value else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deterministic stand-in UCI engine")
+    parser.add_argument("--latency-ms", type=float, default=env_number("STANDIN_LATENCY_MS", float) or 0)
+    parser.add_argument("--jitter-ms", type=float, default=env_number("STANDIN_JITTER_MS", float) or 0)
+    parser.add_argument("--seed", type=int, default=env_number("STANDIN_SEED") or 0)
+    parser.add_argument("--moves", default=os.environ.get("STANDIN_MOVES", ""),
+                        help="Comma separated scripted replies in UCI notation")
+    parser.add_argument("--crash-after", type=int, default=env_number("STANDIN_CRASH_AFTER"))
+    parser.add_argument("--hang-after", type=int, default=env_number("STANDIN_HANG_AFTER"))
+    args = parser.parse_args()
+
+    moves = [move for move in args.moves.split(",") if move]
+    StandinEngine(args.latency_ms, args.jitter_ms, args.seed, moves, args.crash_after, args.hang_after).run()
+
+
+if __name__ == "__main__":
+    main()
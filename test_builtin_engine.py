@@ -0,0 +1,127 @@
+"""
+Tests for the built-in engine: forced mates, finished positions and search limits
+"""
+
+import chess
+import chess.engine
+import pytest
+
+from builtin_engine import BuiltinEngine, evaluate
+
+ROOK_ROLLER = "7k/8/8/8/8/8/R7/1R4K1 w - - 0 1"  # Ra7, then Rb8#
+
+
+def forces_mate(board, moves):
+    """True when the side to move mates within `moves` of its own moves against any defence"""
+    if moves == 0:
+        return False
+    for move in board.legal_moves:
+        board.push(move)
+        try:
+            if board.is_checkmate():
+                return True
+            replies = list(board.legal_moves)
+            if replies and all(mates_after(board, reply, moves - 1) for reply in replies):
+                return True
+        finally:
+            board.pop()
+    return False
+
+
+def mates_after(board, reply, moves):
+    board.push(reply)
+    try:
+        return forces_mate(board, moves)
+    finally:
+        board.pop()
+
+
+def search(fen, depth):
+    """Best move and the info of the last completed depth"""
+    infos = []
+    move = BuiltinEngine(seed=1).search(fen, chess.engine.Limit(depth=depth), infos.append)
+    return chess.Move.from_uci(move), infos[-1]
+
+
+@pytest.mark.parametrize("fen, moves", [
+    ("6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1", 1),  # Back rank
+    ("r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4", 1),  # Scholar's mate
+    (ROOK_ROLLER, 2),
+    (chess.Board(ROOK_ROLLER).mirror().fen(), 2),  # The same for Black
+    ("kbK5/pp6/1P6/8/8/8/8/R7 w - - 0 1", 2),  # Quiet first move: Ra6
+])
+def test_finds_mate_in_n(fen, moves):
+    board = chess.Board(fen)
+    move, info = search(fen, 2 * moves + 1)
+    assert info["score"].pov(board.turn) == chess.engine.Mate(moves)
+    board.push(move)
+    if moves == 1:
+        assert board.is_checkmate()
+    else:
+        # Every defence still loses to a mate in one move fewer
+        assert all(mates_after(board, reply, moves - 1) for reply in list(board.legal_moves))
+
+
+def test_sees_its_own_mate_coming():
+    board = chess.Board(ROOK_ROLLER)
+    board.push_uci("a2a7")
+    move, info = search(board.fen(), 3)
+    assert move in board.legal_moves
+    assert info["score"].pov(board.turn) == chess.engine.Mate(-1)
+
+
+@pytest.mark.parametrize("fen", [
+    "3R2k1/5ppp/8/8/8/8/5PPP/6K1 b - - 1 1",  # Checkmate
+    "7k/5Q2/6K1/8/8/8/8/8 b - - 0 1",  # Stalemate
+])
+def test_no_move_in_finished_positions(fen):
+    assert BuiltinEngine().search(fen, chess.engine.Limit(depth=3)) is None
+
+
+def test_mate_on_the_hundredth_half_move_is_not_a_draw():
+    move, info = search("6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 99 80", 3)
+    assert move == chess.Move.from_uci("d1d8")
+    assert info["score"].pov(chess.WHITE) == chess.engine.Mate(1)
+
+
+def test_noise_does_not_leak_into_scores_or_the_table():
+    fen = "6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1"
+    engine = BuiltinEngine(seed=3)
+    engine.set_strength(0)
+    infos = []
+    engine.search(fen, chess.engine.Limit(depth=3), infos.append)
+    assert infos[-1]["score"].pov(chess.WHITE) == chess.engine.Mate(1)
+    assert chess.Board(fen)._transposition_key() not in engine.table
+
+
+def test_node_limit_is_exact():
+    engine = BuiltinEngine(seed=1)
+    infos = []
+    move = engine.search(chess.STARTING_FEN, chess.engine.Limit(nodes=2000), infos.append)
+    assert chess.Move.from_uci(move) in chess.Board().legal_moves
+    assert all(info["nodes"] <= 2000 for info in infos)
+    assert engine.nodes <= 2001  # The node over the budget ends the search
+
+
+def test_stop_before_the_search_starts_is_kept():
+    engine = BuiltinEngine(seed=1)
+    engine.begin_search()
+    engine.stop()  # Arrives before search() runs
+    infos = []
+    engine.search(chess.STARTING_FEN, chess.engine.Limit(depth=8), infos.append)
+    assert engine.nodes <= 1024
+    assert not infos or infos[-1]["depth"] < 8
+
+
+def test_stale_stop_is_cleared_by_the_next_hand_off():
+    engine = BuiltinEngine(seed=1)
+    engine.stop()  # Came after an earlier search had already finished
+    engine.begin_search()
+    infos = []
+    engine.search(chess.STARTING_FEN, chess.engine.Limit(depth=2), infos.append)
+    assert infos[-1]["depth"] == 2
+
+
+def test_evaluation_is_symmetric():
+    board = chess.Board("r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4")
+    assert evaluate(board) == evaluate(board.mirror())
@@ -0,0 +1,84 @@
+"""
+Tests for the chess clocks of the game window
+"""
+
+import os
+
+import chess
+import pygame
+import pytest
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+from main import ChessClock, ChessGame  # noqa: E402  (initialises pygame, needs the video driver set first)
+from session_replay import RecordedEngine  # noqa: E402
+
+
+def test_press_adds_increment_and_switches_side():
+    clock = ChessClock(60000, 60000, 2000, 0)
+    clock.start(chess.WHITE)
+    clock.press()
+    assert clock.running == chess.BLACK
+    assert 61000 < clock.remaining[chess.WHITE] <= 62000
+    clock.stop()
+    assert clock.running is None
+
+
+@pytest.fixture
+def clocked_game():
+    pygame.init()  # Again after an earlier game's shutdown
+    game = ChessGame({}, engine=RecordedEngine([]))
+    game.analyse_finished_games = False
+    game.user_color = chess.WHITE
+    game.selected_time_control = next(i for i, (_, sides) in enumerate(game.time_controls) if sides is not None)
+    game.start_game()
+    yield game
+    game.shutdown()
+
+
+def test_undo_and_redo_switch_the_clock(clocked_game):
+    game = clocked_game
+    move = chess.Move.from_uci("e2e4")
+    game.board.push(move)
+    game.move_history.append(move)
+    game.clock.press()
+    assert game.clock.running == chess.BLACK
+
+    white_left = game.clock.remaining[chess.WHITE]
+    game.undo_move()
+    assert game.board.turn == chess.WHITE
+    assert game.clock.running == chess.WHITE
+
+    game.redo_move()
+    assert game.clock.remaining[chess.WHITE] <= white_left  # No increment for stepping through history
+    # Stockfish to move, but no search was started: its clock must not run
+    assert game.clock.running is None
+    assert game.engine_search is None
+
+    game.make_stockfish_move()
+    assert game.clock.running == chess.BLACK
+    game.wait_for_engine_move()
+
+
+def test_mate_stops_the_clock(clocked_game):
+    game = clocked_game
+    for uci in ["e2e4", "e7e5", "f1c4", "b8c6", "d1h5", "g8f6"]:
+        move = chess.Move.from_uci(uci)
+        game.board.push(move)
+        game.move_history.append(move)
+    game.make_user_move(chess.Move.from_uci("h5f7"))
+    assert game.game_over and game.game_result.startswith("You won!")
+    assert game.clock.running is None
+
+
+def test_undo_checks_the_flag(clocked_game):
+    game = clocked_game
+    move = chess.Move.from_uci("e2e4")
+    game.board.push(move)
+    game.move_history.append(move)
+    game.clock.press()
+    game.clock.remaining[chess.WHITE] = 0
+
+    game.undo_move()
+    assert game.game_over
+    assert game.game_result == "You ran out of time!"
+    assert game.clock.running is None
@@ -0,0 +1,151 @@
+"""
+Tests for the engine scheduler: priority, fairness between sessions and preemption
+"""
+
+import threading
+
+import chess
+import chess.engine
+import pytest
+
+from engine_backend import EngineBackend
+from engine_scheduler import BACKGROUND, INTERACTIVE, EngineRequest, EngineScheduler, PoolSaturated, reached_limit
+
+DEEP = chess.engine.Limit(depth=10)
+
+
+class FakeEngine(EngineBackend):
+    """Engine that can hold its next search until released, and honour or ignore stop"""
+
+    name = "fake"
+
+    def __init__(self, honour_stop=True):
+        super().__init__("fake")
+        self.honour_stop = honour_stop
+        self.hold_next = False
+        self.holding = threading.Event()
+        self.release = threading.Event()
+        self.stopped = False
+        self.searches = []
+
+    def set_strength(self, skill_level):
+        pass
+
+    def configure(self, options):
+        pass
+
+    def search(self, fen, limit, on_info=None):
+        self.searches.append(limit)
+        stopped = False
+        if self.hold_next:
+            self.hold_next = False
+            self.holding.set()
+            self.release.wait(5)
+            stopped, self.stopped = self.stopped, False
+        if on_info is not None:
+            on_info({"depth": 1 if stopped else limit.depth or 1})
+        return "a2a3" if stopped else "e2e4"
+
+    def stop(self):
+        # An idle engine, or one that already answered, ignores stop
+        if self.honour_stop and self.holding.is_set() and not self.release.is_set():
+            self.stopped = True
+            self.release.set()
+
+    def kill(self):
+        self.release.set()
+
+    def close(self):
+        self.release.set()
+
+
+def fake_scheduler(engines, **kwargs):
+    """Scheduler running on the given engines instead of started processes"""
+    scheduler = EngineScheduler(0, **kwargs)
+    scheduler.engines = list(engines)
+    scheduler.size = len(engines)
+    scheduler.workers = [threading.Thread(target=scheduler.work, args=(i,), daemon=True) for i in range(len(engines))]
+    for worker in scheduler.workers:
+        worker.start()
+    return scheduler
+
+
+def in_thread(function, *args):
+    result = {}
+
+    def run():
+        try:
+            result["value"] = function(*args)
+        except Exception as e:
+            result["error"] = e
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, result
+
+
+def test_sessions_take_turns_and_interactive_goes_first():
+    scheduler = EngineScheduler(0)
+    requests = [EngineRequest(chess.STARTING_FEN, DEEP, None, session, priority, None)
+                for session, priority in [("a", BACKGROUND), ("a", INTERACTIVE), ("a", INTERACTIVE),
+                                          ("a", INTERACTIVE), ("b", INTERACTIVE), ("c", INTERACTIVE)]]
+    with scheduler.condition:
+        for request in requests:
+            scheduler.enqueue(request)
+        order = [scheduler.take() for _ in requests]
+        assert scheduler.take() is None
+    assert [(request.session, request.priority) for request in order] == [
+        ("a", INTERACTIVE), ("b", INTERACTIVE), ("c", INTERACTIVE),
+        ("a", INTERACTIVE), ("a", INTERACTIVE), ("a", BACKGROUND)]
+
+
+def test_full_queue_is_refused():
+    scheduler = EngineScheduler(0, max_queue=1)
+    scheduler.submit(EngineRequest(chess.STARTING_FEN, DEEP, None, "a", INTERACTIVE, None))
+    with pytest.raises(PoolSaturated):
+        scheduler.submit(EngineRequest(chess.STARTING_FEN, DEEP, None, "b", INTERACTIVE, None))
+    assert scheduler.metrics()["classes"][INTERACTIVE]["rejected"] == 1
+
+
+def test_interactive_move_preempts_background_search():
+    engine = FakeEngine(honour_stop=True)
+    engine.hold_next = True
+    scheduler = fake_scheduler([engine])
+    try:
+        background, background_result = in_thread(scheduler.search, chess.STARTING_FEN, DEEP, None, "bg", BACKGROUND)
+        assert engine.holding.wait(5)
+        assert scheduler.search(chess.STARTING_FEN, DEEP, None, "move", INTERACTIVE) == "e2e4"
+        background.join(5)
+        # The stopped search was run again from scratch and its full result delivered
+        assert background_result["value"] == "e2e4"
+        assert len(engine.searches) == 3
+        assert scheduler.metrics()["classes"][BACKGROUND]["preempted"] == 1
+    finally:
+        scheduler.close()
+
+
+def test_search_the_stop_missed_is_delivered():
+    engine = FakeEngine(honour_stop=False)
+    engine.hold_next = True
+    scheduler = fake_scheduler([engine])
+    try:
+        background, background_result = in_thread(scheduler.search, chess.STARTING_FEN, DEEP, None, "bg", BACKGROUND)
+        assert engine.holding.wait(5)
+        interactive, interactive_result = in_thread(scheduler.search, chess.STARTING_FEN, DEEP, None, "move")
+        while scheduler.metrics()["queued"][INTERACTIVE] == 0:
+            interactive.join(0.01)
+        engine.release.set()  # The background search runs to its limit despite the stop
+        background.join(5)
+        interactive.join(5)
+        assert background_result["value"] == "e2e4"
+        assert interactive_result["value"] == "e2e4"
+        assert len(engine.searches) == 2
+        assert scheduler.metrics()["classes"][BACKGROUND]["preempted"] == 0
+    finally:
+        scheduler.close()
+
+
+def test_reached_limit():
+    assert reached_limit(chess.engine.Limit(depth=12), {"depth": 12})
+    assert not reached_limit(chess.engine.Limit(depth=12), {"depth": 7})
+    assert reached_limit(chess.engine.Limit(nodes=1000), {"nodes": 1004})
+    assert not reached_limit(chess.engine.Limit(nodes=1000), {})
@@ -0,0 +1,89 @@
+"""
+Tests for the binary game archive: round trips, score coding and format details
+"""
+
+import chess
+import chess.engine
+import pytest
+
+from game_archive import (ARCHIVE_MAGIC, ARCHIVE_VERSION, ArchivedGame, ArchiveWriter, archive_version,
+                          count_games, decode_score, encode_score, pack_moves, read_game, read_games)
+
+SCHOLARS_MATE = ["e2e4", "e7e5", "f1c4", "b8c6", "d1h5", "g8f6", "h5f7"]
+
+
+def make_game(moves=SCHOLARS_MATE, starting_fen=chess.STARTING_FEN, scores=None, **headers):
+    return ArchivedGame(dict({"White": "You", "Black": "Stockfish", "Result": "1-0"}, **headers),
+                        starting_fen, [chess.Move.from_uci(move) for move in moves], scores)
+
+
+@pytest.mark.parametrize("score", [
+    chess.engine.PovScore(chess.engine.Mate(0), chess.BLACK),  # Black is mated
+    chess.engine.PovScore(chess.engine.Mate(0), chess.WHITE),  # White is mated
+    chess.engine.PovScore(chess.engine.MateGiven, chess.WHITE),
+    chess.engine.PovScore(chess.engine.Mate(3), chess.WHITE),
+    chess.engine.PovScore(chess.engine.Mate(-2), chess.WHITE),
+    chess.engine.PovScore(chess.engine.Mate(1), chess.BLACK),
+    chess.engine.PovScore(chess.engine.Cp(0), chess.WHITE),
+    chess.engine.PovScore(chess.engine.Cp(-35), chess.BLACK),
+    chess.engine.PovScore(chess.engine.Cp(1234), chess.WHITE),
+])
+def test_score_round_trip(score):
+    decoded = decode_score(encode_score(score))
+    assert decoded.white() == score.white()
+    assert (decoded.white() > chess.engine.Cp(0)) == (score.white() > chess.engine.Cp(0))
+
+
+def test_missing_score_round_trip():
+    assert decode_score(encode_score(None)) is None
+
+
+def test_moves_are_little_endian():
+    move = chess.Move.from_uci("e7e8q")
+    code = move.from_square | move.to_square << 6 | chess.QUEEN << 12
+    assert pack_moves([move]) == bytes([code & 0xFF, code >> 8])
+
+
+def test_archive_round_trip(tmp_path):
+    path = str(tmp_path / "games.cga")
+    mated = chess.engine.PovScore(chess.engine.Mate(0), chess.BLACK)
+    scores = [chess.engine.PovScore(chess.engine.Cp(20), chess.WHITE)] * 6 + [mated]
+    games = [make_game(scores=scores),
+             make_game(["e1e2"], "4k3/8/8/8/8/8/8/4K3 w - - 0 1", Event="Setup"),
+             make_game([])]
+    with ArchiveWriter(path, append=False) as writer:
+        assert [writer.write(game) for game in games] == [0, 1, 2]
+    with ArchiveWriter(path) as writer:
+        assert writer.write(make_game()) == 3
+
+    assert count_games(path) == 4
+    loaded = list(read_games(path))
+    for game, original in zip(loaded, games):
+        assert game.headers == original.headers
+        assert game.starting_fen == original.starting_fen
+        assert game.moves == original.moves
+    assert loaded[0].board().is_checkmate()
+    assert loaded[0].scores[-1].white() == mated.white()
+    assert loaded[1].scores is None
+    assert read_game(path, 3).game_id == 3
+    assert read_game(path, 4) is None
+
+
+def test_pgn_round_trip():
+    game = make_game(scores=[chess.engine.PovScore(chess.engine.Cp(10 * i), chess.WHITE) for i in range(7)])
+    converted = ArchivedGame.from_pgn(game.to_pgn())
+    assert converted.moves == game.moves
+    assert [score.white() for score in converted.scores] == [score.white() for score in game.scores]
+
+
+def test_version_1_archive_is_upgraded_before_appending(tmp_path):
+    path = tmp_path / "games.cga"
+    with ArchiveWriter(str(path), append=False) as writer:
+        writer.write(make_game())
+    data = path.read_bytes()
+    path.write_bytes(ARCHIVE_MAGIC + bytes([1]) + data[len(ARCHIVE_MAGIC) + 1:])
+
+    with ArchiveWriter(str(path)) as writer:
+        assert writer.write(make_game(Event="Later")) == 1
+    assert archive_version(str(path)) == ARCHIVE_VERSION
+    assert [game.headers.get("Event") for game in read_games(str(path))] == [None, "Later"]
@@ -0,0 +1,120 @@
+"""
+Tests for the game server's session handling when the engine can't reply, and its HTTP front end
+"""
+
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import chess
+import pytest
+
+from engine_backend import difficulty_limit
+from engine_scheduler import EngineScheduler, EngineTimeout, PoolSaturated
+from game_server import GameServer, make_http_server
+
+
+class FailingScheduler:
+    """Scheduler whose searches fail with the given error, or give the given reply, then answer with a move"""
+
+    def __init__(self, error, reply=False):
+        self.error = error
+        self.reply = reply  # False: a legal move
+
+    def search(self, fen, limit, difficulty=None, session=None, priority=None, on_info=None):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+        if self.reply is not False:
+            reply, self.reply = self.reply, False
+            return reply
+        return next(iter(chess.Board(fen).legal_moves)).uci()
+
+
+@pytest.mark.parametrize("error", [PoolSaturated("queue is full"), RuntimeError("no engine left in the pool"),
+                                   EngineTimeout("engine missed its deadline")])
+def test_failed_reply_takes_the_move_back(error):
+    server = GameServer(FailingScheduler(None))
+    session = server.create_session({"color": "white"})
+    server.scheduler.error = error
+
+    with pytest.raises(type(error)):
+        server.play_move(session, "e2e4")
+    assert session.board.fen() == chess.STARTING_FEN
+    assert session.move_history == []
+
+    # The same move can simply be sent again
+    server.play_move(session, "e2e4")
+    assert len(session.move_history) == 2
+    assert session.board.turn == chess.WHITE
+
+
+def test_failed_first_reply_drops_the_session():
+    server = GameServer(FailingScheduler(RuntimeError("engine crashed")))
+    with pytest.raises(RuntimeError):
+        server.create_session({"color": "black"})
+    assert server.sessions == {}
+
+
+def test_hung_engine_misses_its_deadline(monkeypatch):
+    monkeypatch.setenv("STANDIN_HANG_AFTER", "0")
+    scheduler = EngineScheduler(1, paths=["standin"], queue_timeout=1.0)
+    try:
+        with pytest.raises(EngineTimeout):
+            scheduler.search(chess.STARTING_FEN, difficulty_limit("easy"), "easy", "a")
+        assert scheduler.metrics()["classes"]["interactive"]["timeouts"] == 1
+    finally:
+        scheduler.close()
+
+
+@pytest.mark.parametrize("reply", [None, "e2e4", "e7e8q", "nonsense"])
+def test_missing_or_illegal_reply_takes_the_move_back(reply):
+    server = GameServer(FailingScheduler(None))
+    session = server.create_session({"color": "white"})
+    server.scheduler.reply = reply
+
+    with pytest.raises(RuntimeError):
+        server.play_move(session, "e2e4")
+    assert session.board.fen() == chess.STARTING_FEN
+    assert session.move_history == []
+
+
+def test_session_starting_in_mate_asks_no_engine():
+    server = GameServer(FailingScheduler(AssertionError("engine asked to move in a finished game")))
+    session = server.create_session({"color": "white", "fen": "3R2k1/5ppp/8/8/8/8/5PPP/6K1 b - - 1 1"})
+    assert session.game_over and session.game_result.startswith("You won!")
+
+
+@pytest.fixture
+def base_url():
+    httpd = make_http_server(GameServer(FailingScheduler(None)), "127.0.0.1", 0)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def call(url, method="GET", body=None):
+    data = body.encode() if body is not None else None
+    request = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+@pytest.mark.parametrize("body", ["[]", "5", '"e2e4"', "{"])
+def test_body_that_is_not_an_object_is_a_bad_request(base_url, body):
+    status, _ = call(f"{base_url}/games", "POST", body)
+    assert status == 400
+
+
+def test_query_strings_are_ignored(base_url):
+    status, game = call(f"{base_url}/games?client=test", "POST", '{"color": "white"}')
+    assert status == 201
+    status, same = call(f"{base_url}/games/{game['id']}?x=1")
+    assert status == 200 and same["id"] == game["id"]
+    status, played = call(f"{base_url}/games/{game['id']}/move?x=1", "POST", '{"move": "e2e4"}')
+    assert status == 200 and played["moves"][0] == "e2e4" and len(played["moves"]) == 2
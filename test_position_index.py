@@ -0,0 +1,79 @@
+"""
+Tests for the position index: lookups from the log and from the sorted file
+"""
+
+import chess
+
+from game_archive import ArchivedGame, ArchiveWriter
+from position_index import PositionIndex, build_index, summarize
+
+
+def make_game(moves, result, white="You", black="Stockfish"):
+    return ArchivedGame({"White": white, "Black": black, "Result": result},
+                        moves=[chess.Move.from_uci(move) for move in moves])
+
+
+GAMES = [
+    make_game(["e2e4", "e7e5", "g1f3"], "1-0"),
+    make_game(["e2e4", "c7c5"], "0-1"),
+    make_game(["d2d4", "d7d5"], "1/2-1/2", white="Stockfish", black="You"),
+]
+
+
+def after(*moves):
+    board = chess.Board()
+    for move in moves:
+        board.push_uci(move)
+    return board
+
+
+def check_lookups(index):
+    entries = index.lookup(chess.Board())
+    assert sorted(entry.game_id for entry in entries) == [0, 1, 2]
+    results, moves = summarize(entries)
+    assert results == {"1-0": 1, "0-1": 1, "1/2-1/2": 1}
+    assert moves[0] == (chess.Move.from_uci("e2e4"), 2, False)
+    assert (chess.Move.from_uci("d2d4"), 1, True) in moves
+
+    [entry] = index.lookup(after("e2e4", "e7e5"))
+    assert (entry.game_id, entry.ply, entry.move, entry.engine_move) == (0, 2, chess.Move.from_uci("g1f3"), False)
+    [entry] = index.lookup(after("e2e4", "c7c5"))
+    assert entry.move is None and entry.result == "0-1"
+    assert index.lookup(after("a2a3")) == []
+
+
+def test_lookup_from_the_log(tmp_path):
+    index = PositionIndex(str(tmp_path / "positions.idx"))
+    for game_id, game in enumerate(GAMES):
+        index.add_game(game_id, game)
+    check_lookups(index)
+    index.close()
+
+    # The log is read back on the next start
+    index = PositionIndex(str(tmp_path / "positions.idx"))
+    check_lookups(index)
+    index.close()
+
+
+def test_lookup_after_compaction(tmp_path):
+    index = PositionIndex(str(tmp_path / "positions.idx"))
+    index.add_game(0, GAMES[0])
+    index.compact()
+    index.add_game(1, GAMES[1])
+    index.add_game(2, GAMES[2])
+    check_lookups(index)  # Half sorted file, half log
+    index.compact()
+    assert index.log_records == 0 and index.count == 10
+    check_lookups(index)
+    index.close()
+
+
+def test_build_from_archive(tmp_path):
+    archive_path = str(tmp_path / "games.cga")
+    with ArchiveWriter(archive_path, append=False) as writer:
+        for game in GAMES:
+            writer.write(game)
+    index, games = build_index(archive_path, str(tmp_path / "positions.idx"))
+    assert games == 3
+    check_lookups(index)
+    index.close()
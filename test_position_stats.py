@@ -0,0 +1,51 @@
+"""
+Tests for the vectorized position statistics against the piece_map() loop
+"""
+
+import chess
+import numpy as np
+import pytest
+
+import position_stats
+from position_stats import compute_stats, load_positions, mismatches, pack_board, slow_stats, unpack_board
+
+FENS = [
+    chess.STARTING_FEN,
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3",  # En passant
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+    "7k/8/8/3Q4/8/1B6/8/R3K3 b Q - 0 1",  # Queen between a bishop and a rook's lines
+    "8/8/8/4k3/8/8/8/8 w - - 0 1",  # No white king
+]
+
+
+def packed(fens):
+    return np.array([pack_board(chess.Board(fen)) for fen in fens], dtype="<u8").reshape(-1, position_stats.COLUMNS)
+
+
+def test_pack_round_trip():
+    for fen, row in zip(FENS, packed(FENS)):
+        assert unpack_board(row).epd() == chess.Board(fen).epd()  # Move counters are not packed
+
+
+def test_vectorized_features_match_the_loop():
+    stats = compute_stats(packed(FENS))
+    expected = slow_stats([chess.Board(fen) for fen in FENS])
+    assert mismatches(stats, expected) == []
+    assert stats["white_king_shield"][-1] == -1
+    assert stats["white_mobility"][0] == 4  # Only the knights can move at the start
+
+
+@pytest.mark.parametrize("chunk", [1, 4, 1 << 18])
+def test_chunking_does_not_change_results(monkeypatch, chunk):
+    monkeypatch.setattr(position_stats, "CHUNK_POSITIONS", chunk)
+    stats = compute_stats(packed(FENS))
+    assert mismatches(stats, slow_stats([chess.Board(fen) for fen in FENS])) == []
+
+
+def test_load_positions_from_fen_list(tmp_path):
+    source = tmp_path / "positions.epd"
+    source.write_text("\n".join(FENS) + "\n")
+    positions = load_positions(str(source))
+    assert positions.shape == (len(FENS), position_stats.COLUMNS)
+    assert (np.asarray(positions) == packed(FENS)).all()
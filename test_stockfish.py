@@ -4,7 +4,9 @@ Test script to check if Stockfish is working properly
 """
 
 import os
+import sys
 from stockfish import Stockfish
+from engine_backend import engine_command, resolve_engine_path
 
 def test_stockfish():
     print("=" * 50)
@@ -19,6 +21,9 @@ def test_stockfish():
         "stockfish.exe",
         "stockfish"
     ]
+    # $STOCKFISH_PATH (e.g. "standin" on machines without Stockfish) is tried first
+    if os.environ.get("STOCKFISH_PATH"):
+        stockfish_paths.insert(0, os.environ["STOCKFISH_PATH"])
     
     stockfish = None
     working_path = None
@@ -29,8 +34,8 @@ def test_stockfish():
     for i, path in enumerate(stockfish_paths, 1):
         print(f"{i}. Testing: {path}")
         
-        # Check if file exists
-        if os.path.exists(path):
+        # Check if file exists ("standin" is shorthand for the bundled stand-in engine)
+        if os.path.exists(resolve_engine_path(path)):
             print(f"   ✓ File exists")
         else:
             print(f"   ✗ File not found")
@@ -38,7 +43,7 @@ def test_stockfish():
             
         # Try to initialize Stockfish
         try:
-            stockfish = Stockfish(path=path)
+            stockfish = Stockfish(path=engine_command(path))
             working_path = path
             print(f"   ✓ Stockfish initialized successfully!")
             break
@@ -86,6 +91,12 @@ def test_stockfish():
         print()
         print("Expected location based on your info:")
         print(r"C:\Users\NAV\Downloads\stockfish-windows-x86-64-avx2\stockfish\stockfish.exe")
+        if not os.environ.get("STOCKFISH_PATH") and "pytest" in sys.modules:
+            # Nothing installed and nothing configured: report a skip, not a pass
+            import pytest
+            pytest.skip("no Stockfish found; set STOCKFISH_PATH (e.g. to 'standin') to run this test")
+
+    assert stockfish is not None, f"No working engine among {stockfish_paths}"
 
 if __name__ == "__main__":
     test_stockfish()